@@ -12,7 +12,10 @@ from threading import Event, enumerate as enumerate_threads
 from traceback import print_exc
 
 from twisted.internet import reactor
+from twisted.internet.defer import gatherResults
+from twisted.internet.threads import deferToThread
 
+from Tribler.Core.APIImplementation.checkpointer import DownloadCheckpointer
 from Tribler.Core.APIImplementation.threadpoolmanager import ThreadPoolManager
 from Tribler.Core.CacheDB.sqlitecachedb import forceDBThread
 from Tribler.Core.DownloadConfig import DownloadStartupConfig
@@ -21,10 +24,11 @@ from Tribler.Core.TorrentDef import TorrentDef, TorrentDefNoMetainfo
 from Tribler.Core.Utilities.configparser import CallbackConfigParser
 from Tribler.Core.Video.VideoPlayer import VideoPlayer
 from Tribler.Core.exceptions import DuplicateDownloadException
-from Tribler.Core.simpledefs import NTFY_DISPERSY, NTFY_STARTED, NTFY_TORRENTS, NTFY_UPDATE
+from Tribler.Core.simpledefs import (DLSTATUS_SEEDING, DLSTATUS_STOPPED, DLSTATUS_STOPPED_ON_ERROR, NTFY_DISPERSY,
+                                     NTFY_STARTED, NTFY_TORRENTS, NTFY_UPDATE)
 from Tribler.Main.globals import DefaultDownloadStartupConfig
 from Tribler.dispersy.taskmanager import TaskManager
-from Tribler.dispersy.util import blockingCallFromThread, blocking_call_on_reactor_thread
+from Tribler.dispersy.util import blockingCallFromThread, blocking_call_on_reactor_thread, call_on_reactor_thread
 
 
 try:
@@ -37,6 +41,10 @@ if sys.platform == 'win32':
 else:
     SOCKET_BLOCK_ERRORCODE = errno.EWOULDBLOCK
 
+RESUME_READ_BATCH_SIZE = 100  # the number of pstate files read and parsed by one thread pool job at startup
+RESUME_ADD_BATCH_SIZE = 25  # the number of downloads resumed in one reactor iteration at startup
+RESUME_ADD_BATCH_INTERVAL = 0.1  # the number of seconds between resuming two batches of downloads
+
 
 # Internal classes
 #
@@ -44,6 +52,8 @@ else:
 
 class TriblerLaunchMany(TaskManager):
 
+    _reactor = reactor
+
     def __init__(self):
         """ Called only once (unless we have multiple Sessions) by MainThread """
         super(TriblerLaunchMany, self).__init__()
@@ -65,6 +75,7 @@ class TriblerLaunchMany(TaskManager):
 
         # modules
         self.threadpool = ThreadPoolManager()
+        self.checkpointer = None
         self.torrent_store = None
         self.metadata_store = None
         self.rtorrent_handler = None
@@ -166,6 +177,12 @@ class TriblerLaunchMany(TaskManager):
             self.init(autoload_discovery)
 
     def init(self, autoload_discovery):
+        # the checkpointer writes the pstates from a LoopingCall, which has to be started from the reactor thread
+        @blocking_call_on_reactor_thread
+        def start_checkpointer():
+            self.checkpointer = DownloadCheckpointer(self.session.get_downloads_pstate_dir())
+        start_checkpointer()
+
         if self.dispersy:
             from Tribler.dispersy.community import HardKilledCommunity
 
@@ -426,18 +443,97 @@ class TriblerLaunchMany(TaskManager):
     #
     # Persistence methods
     #
+    @call_on_reactor_thread
     def load_checkpoint(self, initialdlstatus=None, initialdlstatus_dict={}):
-        """ Called by any thread """
+        """
+        Called by any thread. The pstate files are read and parsed on the thread pool, after which the downloads
+        are resumed in batches: downloading ones first, then seeding ones and stopped ones last.
+        """
+        if not self.initComplete:
+            self.register_task("load_checkpoint", self._reactor.callLater(1, self.load_checkpoint, initialdlstatus,
+                                                                          initialdlstatus_dict))
+            return
+
+        start_time = timemod.time()
+        filenames = list(iglob(os.path.join(self.session.get_downloads_pstate_dir(), '*.state')))
+        self._logger.info("tlm: startup: reading %d checkpoints", len(filenames))
+
+        def on_read(results):
+            checkpoints = [checkpoint for result in results for checkpoint in result]
+            self._logger.info("tlm: startup: read %d checkpoints in %.2f seconds", len(checkpoints),
+                              timemod.time() - start_time)
+
+            resume_list = []
+            for filename, tdef, dscfg, pstate in checkpoints:
+                initialstatus = initialdlstatus_dict.get(tdef.get_infohash(), initialdlstatus) if tdef \
+                    else initialdlstatus
+                priority = self._get_resume_priority(pstate, initialstatus)
+                resume_list.append((priority, filename, tdef, dscfg, pstate))
+            resume_list.sort(key=lambda entry: entry[0])
+
+            self._resume_checkpoints(resume_list, initialdlstatus, initialdlstatus_dict, start_time)
+
+        def on_error(failure):
+            self._logger.error("tlm: startup: could not read checkpoints: %s", failure.getErrorMessage())
+
+        deferreds = [deferToThread(self._read_checkpoints, filenames[i:i + RESUME_READ_BATCH_SIZE])
+                     for i in xrange(0, len(filenames), RESUME_READ_BATCH_SIZE)]
+        gatherResults(deferreds).addCallbacks(on_read, on_error)
+
+    def _read_checkpoints(self, filenames):
+        """
+        Reads and parses pstate files, called on the thread pool.
+        :return: A list of (filename, tdef, dscfg, pstate) tuples, tdef and dscfg are None if the pstate is
+        invalid.
+        """
+        checkpoints = []
+        for filename in filenames:
+            tdef = dscfg = pstate = None
+            try:
+                pstate = self.load_download_pstate(filename)
+                tdef, dscfg = self._get_tdef_and_config(pstate)
+            except:
+                # pstate is invalid or non-existing, resume_download falls back on the torrent store
+                self._logger.debug("tlm: startup: invalid checkpoint %s", filename)
+            checkpoints.append((filename, tdef, dscfg, pstate))
+        return checkpoints
+
+    @staticmethod
+    def _get_resume_priority(pstate, initialdlstatus):
+        """
+        Returns the order in which a download is resumed at startup, lower is earlier.
+        """
+        try:
+            status = pstate.get('state', 'dlstate')['status']
+        except:
+            status = None
 
-        def do_load_checkpoint(initialdlstatus, initialdlstatus_dict):
-            with self.sesslock:
-                for i, filename in enumerate(iglob(os.path.join(self.session.get_downloads_pstate_dir(), '*.state'))):
-                    self.resume_download(filename, initialdlstatus, initialdlstatus_dict, setupDelay=i * 0.1)
+        if initialdlstatus == DLSTATUS_STOPPED or status in (DLSTATUS_STOPPED, DLSTATUS_STOPPED_ON_ERROR):
+            return 2
+        if status == DLSTATUS_SEEDING:
+            return 1
+        return 0
 
-        if self.initComplete:
-            do_load_checkpoint(initialdlstatus, initialdlstatus_dict)
+    def _resume_checkpoints(self, resume_list, initialdlstatus, initialdlstatus_dict, start_time, nr_resumed=0):
+        """
+        Resumes the next batch of downloads from resume_list and schedules the batch after it.
+        """
+        batch, resume_list = resume_list[:RESUME_ADD_BATCH_SIZE], resume_list[RESUME_ADD_BATCH_SIZE:]
+        with self.sesslock:
+            for _, filename, tdef, dscfg, pstate in batch:
+                self._resume_download(filename, tdef, dscfg, pstate, initialdlstatus, initialdlstatus_dict)
+        nr_resumed += len(batch)
+
+        if resume_list:
+            self._logger.debug("tlm: startup: resumed %d downloads after %.2f seconds", nr_resumed,
+                               timemod.time() - start_time)
+            self.register_task("load_checkpoint", self._reactor.callLater(RESUME_ADD_BATCH_INTERVAL,
+                                                                          self._resume_checkpoints, resume_list,
+                                                                          initialdlstatus, initialdlstatus_dict,
+                                                                          start_time, nr_resumed))
         else:
-            self.register_task("load_checkpoint", reactor.callLater(1, do_load_checkpoint))
+            self._logger.info("tlm: startup: resumed %d downloads in %.2f seconds", nr_resumed,
+                              timemod.time() - start_time)
 
     def load_download_pstate_noexc(self, infohash):
         """ Called by any thread, assume sesslock already held """
@@ -452,26 +548,35 @@ class TriblerLaunchMany(TaskManager):
         except Exception:
             self._logger.exception("Exception while loading pstate: %s", infohash)
 
+    @staticmethod
+    def _get_tdef_and_config(pstate):
+        # SWIFTPROC
+        metainfo = pstate.get('state', 'metainfo')
+        if 'infohash' in metainfo:
+            tdef = TorrentDefNoMetainfo(metainfo['infohash'], metainfo['name'], metainfo.get('url', None))
+        else:
+            tdef = TorrentDef.load_from_dict(metainfo)
+
+        if pstate.has_option('downloadconfig', 'saveas') and \
+                isinstance(pstate.get('downloadconfig', 'saveas'), tuple):
+            pstate.set('downloadconfig', 'saveas', pstate.get('downloadconfig', 'saveas')[-1])
+
+        return tdef, DownloadStartupConfig(pstate)
+
     def resume_download(self, filename, initialdlstatus=None, initialdlstatus_dict={}, setupDelay=0):
         tdef = dscfg = pstate = None
 
         try:
             pstate = self.load_download_pstate(filename)
+            tdef, dscfg = self._get_tdef_and_config(pstate)
+        except:
+            pass
 
-            # SWIFTPROC
-            metainfo = pstate.get('state', 'metainfo')
-            if 'infohash' in metainfo:
-                tdef = TorrentDefNoMetainfo(metainfo['infohash'], metainfo['name'], metainfo.get('url', None))
-            else:
-                tdef = TorrentDef.load_from_dict(metainfo)
-
-            if pstate.has_option('downloadconfig', 'saveas') and \
-                    isinstance(pstate.get('downloadconfig', 'saveas'), tuple):
-                pstate.set('downloadconfig', 'saveas', pstate.get('downloadconfig', 'saveas')[-1])
-
-            dscfg = DownloadStartupConfig(pstate)
+        self._resume_download(filename, tdef, dscfg, pstate, initialdlstatus, initialdlstatus_dict, setupDelay)
 
-        except:
+    def _resume_download(self, filename, tdef, dscfg, pstate, initialdlstatus=None, initialdlstatus_dict={},
+                         setupDelay=0):
+        if tdef is None or dscfg is None:
             # pstate is invalid or non-existing
             _, file = os.path.split(filename)
 
@@ -490,8 +595,6 @@ class TriblerLaunchMany(TaskManager):
                         if os.path.isdir(dest_dir) or dest_dir == '':
                             dscfg.set_dest_dir(dest_dir)
 
-        self._logger.debug("tlm: load_checkpoint: pstate is %s %s",
-                           pstate.get('dlstate', 'status'), pstate.get('dlstate', 'progress'))
         if pstate is None or pstate.get('state', 'engineresumedata') is None:
             self._logger.debug("tlm: load_checkpoint: resumedata None")
         else:
@@ -531,24 +634,32 @@ class TriblerLaunchMany(TaskManager):
     def network_checkpoint_callback(self, dllist, stop, checkpoint, gracetime):
         """ Called by network thread """
         if checkpoint:
+            nr_unchanged = 0
             for d in dllist:
                 try:
-                    # Tell all downloads to stop, and save their persistent state
-                    # in a infohash -> pstate dict which is then passed to the user
-                    # for storage.
+                    # Tell all downloads to stop, and save their persistent state. When not stopping, only
+                    # the downloads that changed since their last checkpoint are saved. Running downloads
+                    # are written once libtorrent has their resume data.
                     #
                     if stop:
                         (infohash, pstate) = d.network_stop(False, False)
-                    else:
-                        (infohash, pstate) = d.network_checkpoint()
+                        self._logger.debug("tlm: network checkpointing: %s %s", d.get_def().get_name(), pstate)
+                        self.save_download_pstate(infohash, pstate)
 
-                    self._logger.debug("tlm: network checkpointing: %s %s", d.get_def().get_name(), pstate)
+                    elif not d.need_checkpoint():
+                        nr_unchanged += 1
 
-                    self.save_download_pstate(infohash, pstate)
+                    elif not d.save_resume_data():
+                        (infohash, pstate) = d.network_checkpoint()
+                        self._logger.debug("tlm: network checkpointing: %s %s", d.get_def().get_name(), pstate)
+                        self.save_download_pstate(infohash, pstate)
 
                 except Exception as e:
                     self._logger.exception("Exception while checkpointing: %s", d.get_def().get_name())
 
+            self._logger.debug("tlm: checkpointing %d downloads, %d unchanged", len(dllist) - nr_unchanged,
+                               nr_unchanged)
+
         if stop:
             # Some grace time for early shutdown tasks
             if self.shutdownstarttime is not None:
@@ -566,6 +677,9 @@ class TriblerLaunchMany(TaskManager):
     def remove_pstate(self, infohash):
         def do_remove():
             if not self.download_exists(infohash):
+                if self.checkpointer:
+                    self.checkpointer.cancel_write(infohash)
+
                 dlpstatedir = self.session.get_downloads_pstate_dir()
 
                 # Remove checkpoint
@@ -657,6 +771,9 @@ class TriblerLaunchMany(TaskManager):
             self.mainline_dht = None
 
         if self.torrent_store is not None:
+            # libtorrent keeps running until network_shutdown, its metainfo cache must not use the closed store
+            if self.ltmgr and self.ltmgr.metainfo_cache:
+                self.ltmgr.metainfo_cache.detach_torrent_store()
             self.torrent_store.close()
             self.torrent_store = None
 
@@ -679,17 +796,19 @@ class TriblerLaunchMany(TaskManager):
             self.ltmgr.shutdown()
             self.ltmgr = None
 
+        # Write the checkpoints still waiting in the queue, including those made while libtorrent was shut down
+        if self.checkpointer:
+            self.checkpointer.shutdown()
+            self.checkpointer = None
+
         if self.threadpool:
             self.threadpool.cancel_all_pending_tasks()
             self.threadpool = None
 
     def save_download_pstate(self, infohash, pstate):
-        """ Called by network thread """
-        basename = binascii.hexlify(infohash) + '.state'
-        filename = os.path.join(self.session.get_downloads_pstate_dir(), basename)
-
-        self._logger.debug("tlm: network checkpointing: to file %s", filename)
-        pstate.write_file(filename)
+        """ Called by any thread """
+        if self.checkpointer:
+            self.checkpointer.schedule_write(infohash, pstate)
 
     def load_download_pstate(self, filename):
         """ Called by any thread """
@@ -0,0 +1,103 @@
+import binascii
+import logging
+import os
+import sys
+from collections import OrderedDict
+from threading import RLock
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+from Tribler.dispersy.taskmanager import TaskManager
+
+
+CHECKPOINT_WRITE_INTERVAL = 0.5  # the number of seconds between two rounds of pstate writes
+CHECKPOINT_WRITES_PER_ROUND = 25  # the maximum number of pstate files written in one round
+
+
+class DownloadCheckpointer(TaskManager):
+
+    """
+    Writes the persistent state (pstate) files of the downloads. Writes are queued and spread over time, so
+    checkpointing thousands of downloads does not block the reactor, and a newer pstate of a download replaces a
+    queued one instead of being written twice. Every file is written to a temporary file first and then renamed,
+    so a crash during a checkpoint never leaves a truncated pstate behind.
+    """
+    _reactor = reactor
+
+    def __init__(self, pstate_dir, write_interval=CHECKPOINT_WRITE_INTERVAL,
+                 writes_per_round=CHECKPOINT_WRITES_PER_ROUND):
+        super(DownloadCheckpointer, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._pstate_dir = pstate_dir
+
+        # infohash -> pstate, oldest request first
+        self._lock = RLock()
+        self._pending_writes = OrderedDict()
+
+        self.nr_written = 0
+        self.nr_replaced = 0
+
+        self._write_lc = self.register_task(u"write pstates", LoopingCall(self._write_pending, writes_per_round))
+        self._write_lc.clock = self._reactor
+        self._write_lc.start(write_interval, now=False)
+
+    def __len__(self):
+        return len(self._pending_writes)
+
+    def get_pstate_filename(self, infohash):
+        return os.path.join(self._pstate_dir, binascii.hexlify(infohash) + '.state')
+
+    def schedule_write(self, infohash, pstate):
+        """
+        Queues the pstate of a download to be written.
+        """
+        with self._lock:
+            if self._pending_writes.pop(infohash, None) is not None:
+                self.nr_replaced += 1
+            self._pending_writes[infohash] = pstate
+
+    def cancel_write(self, infohash):
+        """
+        Drops the queued pstate of a download, e.g. because the download was removed.
+        """
+        with self._lock:
+            self._pending_writes.pop(infohash, None)
+
+    def _write_pending(self, max_writes=None):
+        with self._lock:
+            nr_writes = len(self._pending_writes) if max_writes is None else max_writes
+            pending = [self._pending_writes.popitem(last=False)
+                       for _ in xrange(min(nr_writes, len(self._pending_writes)))]
+
+        for infohash, pstate in pending:
+            self.write_pstate(infohash, pstate)
+
+    def write_pstate(self, infohash, pstate):
+        """
+        Writes the pstate file of a download right away.
+        """
+        filename = self.get_pstate_filename(infohash)
+        tmp_filename = filename + '.tmp'
+        self._logger.debug("writing pstate to %s", filename)
+
+        try:
+            pstate.write_file(tmp_filename)
+            if sys.platform == 'win32' and os.path.exists(filename):
+                # os.rename does not replace existing files on Windows
+                os.remove(filename)
+            os.rename(tmp_filename, filename)
+            self.nr_written += 1
+        except (IOError, OSError) as e:
+            self._logger.error("could not write pstate to %s: %s", filename, e)
+
+    def flush(self):
+        """
+        Writes all queued pstate files right away.
+        """
+        self._write_pending()
+
+    def shutdown(self):
+        self.cancel_all_pending_tasks()
+        self.flush()
@@ -8,8 +8,8 @@ import os
 import threading
 import json
 from copy import deepcopy
+from functools import wraps
 from pprint import pformat
-from struct import unpack_from
 from time import time
 from traceback import print_exc
 from collections import OrderedDict, defaultdict
@@ -18,7 +18,8 @@ from twisted.internet.task import LoopingCall
 
 from Tribler.Core.CacheDB.sqlitecachedb import bin2str, str2bin
 from Tribler.Core.TorrentDef import TorrentDef
-from Tribler.Core.Utilities.search_utils import split_into_keywords, filter_keywords
+from Tribler.Core.Utilities.search_utils import split_into_keywords, filter_keywords, fts_rank, get_fts_match_columns
+from Tribler.Core.Utilities.spelling_utils import SymmetricDeleteIndex
 from Tribler.Core.Utilities.unicode import dunno2unicode
 from Tribler.Core.simpledefs import (INFOHASH_LENGTH, NTFY_UPDATE, NTFY_INSERT, NTFY_DELETE, NTFY_CREATE,
                                      NTFY_MODIFIED, NTFY_TRACKERINFO, NTFY_MYPREFERENCES, NTFY_VOTECAST, NTFY_TORRENTS,
@@ -26,6 +27,8 @@ from Tribler.Core.simpledefs import (INFOHASH_LENGTH, NTFY_UPDATE, NTFY_INSERT,
                                      NTFY_MODERATIONS, NTFY_MARKINGS, NTFY_STATE,
                                      SIGNAL_CHANNEL_COMMUNITY, SIGNAL_ON_TORRENT_UPDATED)
 from Tribler.dispersy.taskmanager import TaskManager
+from Tribler.dispersy.util import blocking_call_on_reactor_thread
+from Tribler.Core.Modules.tracker_manager import TRACKER_RETRY_INTERVAL
 from Tribler.Core.Utilities.tracker_utils import get_uniformed_tracker_url
 
 
@@ -43,6 +46,20 @@ MAX_POPULARITY_REC_PER_TORRENT_PEER = 3  # maximum number of records per each co
 
 DEFAULT_ID_CACHE_SIZE = 1024 * 5
 
+# the number of results returned for a search request of another peer
+REMOTE_SEARCH_MAX_RESULTS = 25
+
+# the TermFrequency table used for autocompletion keeps at most this many of the most frequent swarmname terms,
+# it is pruned every TERM_FREQUENCY_PRUNE_INTERVAL indexed torrents
+MIN_AUTOCOMPLETE_TERM_LENGTH = 2
+MAX_AUTOCOMPLETE_TERMS = 100000
+TERM_FREQUENCY_PRUNE_INTERVAL = 1000
+# the number of most frequent terms used for spelling suggestions
+MAX_SPELLING_TERMS = 10000
+
+# the maximum number of variables in a single SQL statement, SQLite allows 999 by default
+MAX_SQL_VARIABLES = 500
+
 
 class LimitedOrderedDict(OrderedDict):
 
@@ -56,6 +73,19 @@ class LimitedOrderedDict(OrderedDict):
             self.popitem(last=False)
 
 
+def read_async(func):
+    """
+    Creates the asynchronous variant of a read-only DBHandler method.
+    The returned method runs func on the read pool of SQLiteCacheDB and returns a Deferred that fires with its
+    result, so the caller does not block the reactor thread while the query runs.
+    """
+    @wraps(func)
+    def async_func(self, *args, **kwargs):
+        return self._db.run_read_async(func, self, *args, **kwargs)
+    async_func.__name__ = func.__name__ + "_async"
+    return async_func
+
+
 class BasicDBHandler(TaskManager):
 
     def __init__(self, session, table_name):
@@ -173,8 +203,7 @@ class PeerDBHandler(BasicDBHandler):
         if 'name' in value:
             value['name'] = dunno2unicode(value['name'])
         if peer_id is not None:
-            where = u'peer_id == %d' % peer_id
-            self._db.update('Peer', where, **value)
+            self._db.update('Peer', u'peer_id == ?', (peer_id,), **value)
         else:
             self._db.insert_or_ignore('Peer', permid=bin2str(permid), **value)
 
@@ -194,7 +223,7 @@ class PeerDBHandler(BasicDBHandler):
                 return True
 
     def updatePeer(self, permid, **argv):
-        self._db.update(self.table_name, u'permid = ' + repr(bin2str(permid)), **argv)
+        self._db.update(self.table_name, u'permid = ?', (bin2str(permid),), **argv)
 
     def deletePeer(self, permid=None, peer_id=None):
         # don't delete friend of superpeers, except that force is True
@@ -235,6 +264,8 @@ class TorrentDBHandler(BasicDBHandler):
         self.mypref_db = self.votecast_db = self.channelcast_db = self._rtorrent_handler = None
 
         self.infohash_id = LimitedOrderedDict(DEFAULT_ID_CACHE_SIZE)
+        self._nr_indexed_torrents = 0
+        self._spelling_index = None
 
     def initialize(self, *args, **kwargs):
         super(TorrentDBHandler, self).initialize(*args, **kwargs)
@@ -244,6 +275,8 @@ class TorrentDBHandler(BasicDBHandler):
         self.channelcast_db = self.session.open_dbhandler(NTFY_CHANNELCAST)
         self._rtorrent_handler = self.session.lm.rtorrent_handler
 
+        self._db.create_scalar_function(u"fts_rank", fts_rank, 4)
+
     def close(self):
         super(TorrentDBHandler, self).close()
         self.category = None
@@ -320,6 +353,128 @@ class TorrentDBHandler(BasicDBHandler):
                 self._addTorrentToDB(torrentdef, extra_info)
                 self.notifier.notify(NTFY_TORRENTS, NTFY_INSERT, infohash)
 
+    def addExternalTorrents(self, torrentdefs, extra_info={}):
+        """
+        Adds many torrents at once. The torrents are tokenized before the database is touched, after which the
+        Torrent, FullTextIndex, TermFrequency and TorrentTrackerMapping rows are written with one executemany per
+        table and committed at once.
+        :param torrentdefs: The finalized TorrentDefs to add. Like addExternalTorrent, the collected torrents are
+        skipped and the rows of torrents that are known but not collected are updated.
+        :param extra_info: The extra info of all torrents, see addExternalTorrent.
+        :return: The infohashes of the added or updated torrents.
+        """
+        start_time = time()
+
+        # keep the first TorrentDef of every infohash
+        unique_torrentdefs = OrderedDict()
+        for torrentdef in torrentdefs:
+            assert isinstance(torrentdef, TorrentDef), "TORRENTDEF has invalid type: %s" % type(torrentdef)
+            if torrentdef.is_finalized():
+                unique_torrentdefs.setdefault(torrentdef.get_infohash(), torrentdef)
+
+        torrent_ids = {}
+        infohashes = unique_torrentdefs.keys()
+        for i in xrange(0, len(infohashes), MAX_SQL_VARIABLES):
+            torrent_ids.update(self.getTorrentIDS(infohashes[i:i + MAX_SQL_VARIABLES]))
+        collected_infohashes = self._getCollectedInfohashes(
+            [infohash for infohash, torrent_id in torrent_ids.iteritems() if torrent_id is not None])
+
+        torrents = []
+        for infohash, torrentdef in unique_torrentdefs.iteritems():
+            if infohash not in collected_infohashes:
+                swarmname = torrentdef.get_name_as_unicode()
+                if not torrentdef.is_multifile_torrent():
+                    swarmname, _ = os.path.splitext(swarmname)
+
+                torrents.append((infohash, self._get_database_dict(torrentdef, extra_info),
+                                 self._get_index_values(swarmname, torrentdef.get_files_as_unicode()),
+                                 self._get_tracker_set(torrentdef)))
+
+        if torrents:
+            torrents = self._addTorrentsToDB(torrents, torrent_ids)
+            for infohash, _, _, _ in torrents:
+                self.notifier.notify(NTFY_TORRENTS, NTFY_INSERT, infohash)
+
+        elapsed = time() - start_time
+        self._logger.info(u"Added %d of %d torrents in %.2f seconds (%.1f torrents/s)", len(torrents),
+                          len(unique_torrentdefs), elapsed, len(torrents) / elapsed if elapsed else 0.0)
+        return [infohash for infohash, _, _, _ in torrents]
+
+    def _getCollectedInfohashes(self, infohashes):
+        """
+        Returns the set of the given infohashes that are in the CollectedTorrent table.
+        """
+        collected_infohashes = set(infohash for infohash in infohashes if infohash in self.existed_torrents)
+        infohash_strs = [bin2str(infohash) for infohash in infohashes if infohash not in collected_infohashes]
+        for i in xrange(0, len(infohash_strs), MAX_SQL_VARIABLES):
+            batch = infohash_strs[i:i + MAX_SQL_VARIABLES]
+            sql = u"SELECT infohash FROM CollectedTorrent WHERE infohash IN (%s)" % u",".join(u"?" * len(batch))
+            collected_infohashes.update(str2bin(infohash) for infohash, in self._db.fetchall(sql, batch))
+        self.existed_torrents.update(collected_infohashes)
+        return collected_infohashes
+
+    @blocking_call_on_reactor_thread
+    def _addTorrentsToDB(self, torrents, torrent_ids):
+        """
+        Writes torrents to the database in a single transaction, inserting the new ones and updating the known ones.
+        :param torrents: A list of (infohash, database dict, index values, tracker set) tuples.
+        :param torrent_ids: A dict of infohash to torrent_id, which is None for the new torrents.
+        :return: The torrents that were written, i.e. the ones that have a torrent_id afterwards.
+        """
+        # all database dicts have the same keys as they are created with the same extra info
+        keys = sorted(torrents[0][1].keys())
+        new_torrents = [database_dict for infohash, database_dict, _, _ in torrents if torrent_ids[infohash] is None]
+        if new_torrents:
+            # a torrent inserted by someone else in the mean time should not roll back the other inserts
+            sql = u"INSERT OR IGNORE INTO Torrent (%s) VALUES (%s)" % (u", ".join(keys), u", ".join(u"?" * len(keys)))
+            self._db.executemany_write(sql, [[database_dict[key] for key in keys] for database_dict in new_torrents])
+
+        # no need to update the infohash, it's already stored
+        update_keys = [key for key in keys if key != "infohash"]
+        known_torrents = [(infohash, database_dict) for infohash, database_dict, _, _ in torrents
+                          if torrent_ids[infohash] is not None]
+        if known_torrents:
+            sql = u"UPDATE Torrent SET %s WHERE torrent_id = ?" % u", ".join(u"%s = ?" % key for key in update_keys)
+            self._db.executemany_write(sql, [[database_dict[key] for key in update_keys] + [torrent_ids[infohash]]
+                                             for infohash, database_dict in known_torrents])
+
+        torrent_ids = {}
+        infohashes = [infohash for infohash, _, _, _ in torrents]
+        for i in xrange(0, len(infohashes), MAX_SQL_VARIABLES):
+            torrent_ids.update(self.getTorrentIDS(infohashes[i:i + MAX_SQL_VARIABLES]))
+
+        # the torrents whose insert failed are not indexed, as a NULL rowid would create an orphaned index row
+        missing_infohashes = [infohash for infohash in infohashes if torrent_ids.get(infohash) is None]
+        if missing_infohashes:
+            self._logger.error(u"Could not add %d torrents to the database: %s", len(missing_infohashes),
+                               u", ".join(bin2str(infohash) for infohash in missing_infohashes))
+            torrents = [torrent for torrent in torrents if torrent_ids.get(torrent[0]) is not None]
+            if not torrents:
+                return torrents
+
+        index_rows = [(torrent_ids[infohash],) + index_values for infohash, _, index_values, _ in torrents]
+        indexed_torrent_ids = self._getIndexedTorrentIds([index_row[0] for index_row in index_rows])
+        self._db.executemany_write(u"DELETE FROM FullTextIndex WHERE rowid = ?",
+                                   [(index_row[0],) for index_row in index_rows])
+        self._db.executemany_write(u"INSERT INTO FullTextIndex (rowid, swarmname, filenames, fileextensions) "
+                                   u"VALUES(?,?,?,?)", [index_row[:4] for index_row in index_rows])
+        # the terms of torrents that were indexed before have been counted already
+        self._addTermFrequencies([index_row[4] for index_row in index_rows
+                                  if index_row[0] not in indexed_torrent_ids])
+
+        trackers = set()
+        for _, _, _, tracker_set in torrents:
+            trackers.update(tracker_set)
+        self._addTrackers(list(trackers))
+
+        sql = u"INSERT OR IGNORE INTO TorrentTrackerMapping(torrent_id, tracker_id)" \
+              u" VALUES(?, (SELECT tracker_id FROM TrackerInfo WHERE tracker = ?))"
+        self._db.executemany_write(sql, [(torrent_ids[infohash], tracker)
+                                         for infohash, _, _, tracker_set in torrents for tracker in tracker_set])
+
+        self._db.commit_now()
+        return torrents
+
     def addExternalTorrentNoDef(self, infohash, name, files, trackers, timestamp, extra_info={}):
         if not self.hasTorrent(infohash):
             metainfo = {'info': {}, 'encoding': 'utf_8'}
@@ -357,7 +512,7 @@ class TorrentDBHandler(BasicDBHandler):
                 insert_files = [(torrent_id, unicode(path), length) for path, length in files]
                 if len(insert_files) > 0:
                     sql_insert_files = "INSERT OR IGNORE INTO TorrentFiles (torrent_id, path, length) VALUES (?,?,?)"
-                    self._db.executemany(sql_insert_files, insert_files)
+                    self._db.executemany_write(sql_insert_files, insert_files)
             except:
                 self._logger.error("Could not create a TorrentDef instance %r %r %r %r %r %r", infohash, timestamp, name, files, trackers, extra_info)
                 print_exc()
@@ -380,7 +535,7 @@ class TorrentDBHandler(BasicDBHandler):
                 to_be_inserted.add(infohash)
 
         sql = "INSERT INTO Torrent (infohash, status) VALUES (?, ?)"
-        self._db.executemany(sql, [(bin2str(infohash), u'unknown') for infohash in to_be_inserted])
+        self._db.executemany_write(sql, [(bin2str(infohash), u'unknown') for infohash in to_be_inserted])
 
         torrent_id_results = self.getTorrentIDS(infohashes)
         torrent_ids = []
@@ -430,8 +585,7 @@ class TorrentDBHandler(BasicDBHandler):
 
         else:  # infohash in db
             del database_dict["infohash"]  # no need for infohash, its already stored
-            where = "torrent_id = %d" % torrent_id
-            self._db.update('Torrent', where=where, **database_dict)
+            self._db.update('Torrent', where=u"torrent_id = ?", where_args=(torrent_id,), **database_dict)
 
         if not torrentdef.is_multifile_torrent():
             swarmname, _ = os.path.splitext(swarmname)
@@ -445,9 +599,46 @@ class TorrentDBHandler(BasicDBHandler):
         if existed:
             return
 
+        swarmname, filenames, fileextensions, swarm_keywords = self._get_index_values(swarmname, files)
+        values = (torrent_id, swarmname, filenames, fileextensions)
+        try:
+            is_indexed = bool(self._getIndexedTorrentIds([torrent_id]))
+        except:
+            # this will fail if the fts3 module cannot be found
+            print_exc()
+            return
+
+        # INSERT OR REPLACE not working for fts3 table, failed writes are logged by the write queue
+        self._db.execute_write(u"DELETE FROM FullTextIndex WHERE rowid = ?", (torrent_id,))
+        self._db.execute_write(
+            u"INSERT INTO FullTextIndex (rowid, swarmname, filenames, fileextensions) VALUES(?,?,?,?)", values)
+
+        # the terms of a torrent that was indexed before have been counted already
+        if not is_indexed:
+            self._addTermFrequencies([swarm_keywords])
+
+    def _getIndexedTorrentIds(self, torrent_ids):
+        """
+        Returns the set of the given torrent ids that have a row in the FullTextIndex.
+        """
+        indexed_torrent_ids = set()
+        for i in xrange(0, len(torrent_ids), MAX_SQL_VARIABLES):
+            batch = torrent_ids[i:i + MAX_SQL_VARIABLES]
+            sql = u"SELECT rowid FROM FullTextIndex WHERE rowid IN (%s)" % u",".join(u"?" * len(batch))
+            indexed_torrent_ids.update(rowid for rowid, in self._db.fetchall(sql, batch))
+        return indexed_torrent_ids
+
+    def _get_index_values(self, swarmname, files):
+        """
+        Tokenizes a torrent for the FullTextIndex.
+        :param swarmname: The name of the torrent, without extension for single file torrents.
+        :param files: The paths of the files in the torrent.
+        :return: A (swarmname, filenames, fileextensions, swarmname keywords) tuple, the first three are the values
+        of the FullTextIndex columns.
+        """
         # Niels: new method for indexing, replaces invertedindex
         # Making sure that swarmname does not include extension for single file torrents
-        swarm_keywords = " ".join(split_into_keywords(swarmname))
+        swarm_keywords = split_into_keywords(swarmname)
 
         filedict = {}
         fileextensions = set()
@@ -465,20 +656,46 @@ class TorrentDBHandler(BasicDBHandler):
             filenames.sort(cmp=popSort, reverse=True)
             filenames = filenames[:1000]
 
-        values = (torrent_id, swarm_keywords, " ".join(filenames), " ".join(fileextensions))
-        try:
-            # INSERT OR REPLACE not working for fts3 table
-            self._db.execute_write(u"DELETE FROM FullTextIndex WHERE rowid = ?", (torrent_id,))
-            self._db.execute_write(
-                u"INSERT INTO FullTextIndex (rowid, swarmname, filenames, fileextensions) VALUES(?,?,?,?)", values)
-        except:
-            # this will fail if the fts3 module cannot be found
-            print_exc()
+        return " ".join(swarm_keywords), " ".join(filenames), " ".join(fileextensions), swarm_keywords
+
+    def _addTermFrequencies(self, keyword_lists):
+        """
+        Counts the swarmname terms of newly indexed torrents in the TermFrequency table used by getAutoCompleteTerms.
+        :param keyword_lists: The keywords of the swarmname of every torrent.
+        """
+        frequencies = defaultdict(int)
+        for keywords in keyword_lists:
+            for term in set(keywords):
+                if MIN_AUTOCOMPLETE_TERM_LENGTH <= len(term) <= MAX_KEYWORD_LENGTH:
+                    frequencies[term] += 1
+
+        if frequencies:
+            self._db.executemany_write(u"INSERT OR IGNORE INTO TermFrequency (term, freq) VALUES (?, 0)",
+                                       [(term,) for term in frequencies])
+            self._db.executemany_write(u"UPDATE TermFrequency SET freq = freq + ? WHERE term = ?",
+                                       [(frequency, term) for term, frequency in frequencies.iteritems()])
+
+            if self._spelling_index is not None:
+                for term, frequency in frequencies.iteritems():
+                    self._spelling_index.add(term, frequency)
+
+        nr_indexed_torrents = self._nr_indexed_torrents + len(keyword_lists)
+        if nr_indexed_torrents // TERM_FREQUENCY_PRUNE_INTERVAL > \
+                self._nr_indexed_torrents // TERM_FREQUENCY_PRUNE_INTERVAL:
+            # only keep the most frequent terms
+            self._db.execute_write(u"DELETE FROM TermFrequency WHERE term IN "
+                                   u"(SELECT term FROM TermFrequency ORDER BY freq DESC LIMIT -1 OFFSET ?)",
+                                   (MAX_AUTOCOMPLETE_TERMS,))
+        self._nr_indexed_torrents = nr_indexed_torrents
 
     # ------------------------------------------------------------
     # Adds the trackers of a given torrent into the database.
     # ------------------------------------------------------------
     def _addTorrentTracker(self, torrent_id, torrentdef, extra_info={}):
+        # add trackers in batch
+        self.addTorrentTrackerMappingInBatch(torrent_id, list(self._get_tracker_set(torrentdef)))
+
+    def _get_tracker_set(self, torrentdef):
         # Set add_all to True if you want to put all multi-trackers into db.
         # In the current version (4.2) only the main tracker is used.
 
@@ -508,8 +725,7 @@ class TorrentDBHandler(BasicDBHandler):
                     if tracker_url:
                         new_tracker_set.add(tracker_url)
 
-        # add trackers in batch
-        self.addTorrentTrackerMappingInBatch(torrent_id, list(new_tracker_set))
+        return new_tracker_set
 
     def updateTorrent(self, infohash, notify=True, **kw):  # watch the schema of database
         if 'seeder' in kw:
@@ -523,8 +739,7 @@ class TorrentDBHandler(BasicDBHandler):
 
         if len(kw) > 0:
             infohash_str = bin2str(infohash)
-            where = "infohash='%s'" % infohash_str
-            self._db.update(self.table_name, where, **kw)
+            self._db.update(self.table_name, u"infohash = ?", (infohash_str,), **kw)
 
         if notify:
             self.notifier.notify(NTFY_TORRENTS, NTFY_UPDATE, infohash)
@@ -551,7 +766,7 @@ class TorrentDBHandler(BasicDBHandler):
 
         if len(to_be_inserted) > 0:
             sql = u"INSERT OR IGNORE INTO Torrent (infohash) VALUES (?)"
-            self._db.executemany(sql, to_be_inserted)
+            self._db.executemany_write(sql, to_be_inserted)
 
     def on_search_response(self, torrents):
         status = u'unknown'
@@ -596,24 +811,23 @@ class TorrentDBHandler(BasicDBHandler):
         if len(update) > 0:
             sql = u"UPDATE Torrent SET name = ?, length = ?, num_files = ?, category = ?, creation_date = ?," \
                   u" infohash = ?, status = ? WHERE torrent_id = ?"
-            self._db.executemany(sql, update)
+            self._db.executemany_write(sql, update)
 
         if len(update_infohash) > 0:
             sql = u"UPDATE Torrent SET infohash = ? WHERE torrent_id = ?"
-            self._db.executemany(sql, update_infohash)
+            self._db.executemany_write(sql, update_infohash)
 
         if len(insert) > 0:
             sql = u"INSERT INTO Torrent (name, length, num_files, category, creation_date, infohash," \
                   u" status) VALUES (?, ?, ?, ?, ?, ?, ?)"
-            try:
-                self._db.executemany(sql, insert)
+            deferred = self._db.executemany_write(sql, insert)
+            deferred.addErrback(lambda failure: self._logger.error(u"Failed to insert search results %s: %s",
+                                                                   insert, failure.getErrorMessage()))
 
-                were_inserted = [(inserted[5],) for inserted in insert]
-                sql = u"SELECT torrent_id, name FROM Torrent WHERE infohash == ?"
-                to_be_indexed = to_be_indexed + list(self._db.executemany(sql, were_inserted))
-            except:
-                print_exc()
-                self._logger.error(u"infohashes: %s", insert)
+            # this flushes the insert, so only the torrents that were inserted are found
+            were_inserted = [(inserted[5],) for inserted in insert]
+            sql = u"SELECT torrent_id, name FROM Torrent WHERE infohash == ?"
+            to_be_indexed = to_be_indexed + list(self._db.executemany(sql, were_inserted))
 
         for torrent_id, swarmname in to_be_indexed:
             self._indexTorrent(torrent_id, swarmname, [])
@@ -625,15 +839,56 @@ class TorrentDBHandler(BasicDBHandler):
 
     def updateTorrentCheckResult(self, torrent_id, infohash, seeders, leechers, last_check, next_check, status,
                                  retries):
+        self.updateTorrentCheckResults([(torrent_id, infohash, seeders, leechers, last_check, next_check, status,
+                                         retries)])
+
+    def updateTorrentCheckResults(self, results):
+        """
+        Stores the results of torrent health checks with a single statement.
+        :param results: A list of (torrent_id, infohash, seeders, leechers, last_check, next_check, status, retries).
+        """
         sql = u"UPDATE Torrent SET num_seeders = ?, num_leechers = ?, last_tracker_check = ?, next_tracker_check = ?," \
               u" status = ?, tracker_check_retries = ? WHERE torrent_id = ?"
 
-        self._db.execute_write(sql, (seeders, leechers, last_check, next_check, status, retries, torrent_id))
+        self._db.executemany_write(sql, [(seeders, leechers, last_check, next_check, status, retries, torrent_id)
+                                         for torrent_id, _, seeders, leechers, last_check, next_check, status, retries
+                                         in results])
 
-        self._logger.debug(u"update result %d/%d for %s/%d", seeders, leechers, bin2str(infohash), torrent_id)
+        self._logger.debug(u"updated %d torrent check results", len(results))
 
         # notify
-        self.notifier.notify(NTFY_TORRENTS, NTFY_UPDATE, infohash)
+        for result in results:
+            self.notifier.notify(NTFY_TORRENTS, NTFY_UPDATE, result[1])
+
+    def getTorrentCheckRetriesByInfohash(self, infohashes):
+        """
+        Gets the torrent ids and the number of failed checks of torrents.
+        :param infohashes: The infohashes of the torrents.
+        :return: A dict of infohash to (torrent_id, tracker_check_retries).
+        """
+        retries_dict = {}
+        infohashes = list(infohashes)
+        for i in xrange(0, len(infohashes), MAX_SQL_VARIABLES):
+            infohash_strs = [bin2str(infohash) for infohash in infohashes[i:i + MAX_SQL_VARIABLES]]
+            sql = u"SELECT infohash, torrent_id, tracker_check_retries FROM Torrent WHERE infohash IN (%s)" \
+                  % u",".join(u"?" * len(infohash_strs))
+            for infohash, torrent_id, retries in self._db.fetchall(sql, infohash_strs):
+                retries_dict[str2bin(infohash)] = (torrent_id, retries or 0)
+        return retries_dict
+
+    def _addTrackers(self, tracker_list):
+        """ Adds the trackers that are not in the TrackerInfo table yet. """
+        found_tracker_list = set()
+        for i in xrange(0, len(tracker_list), MAX_SQL_VARIABLES):
+            trackers = tuple(tracker_list[i:i + MAX_SQL_VARIABLES])
+            sql = u"SELECT tracker FROM TrackerInfo WHERE tracker IN (%s)" % u",".join(u"?" * len(trackers))
+            found_tracker_list.update(tracker for tracker, in self._db.fetchall(sql, trackers))
+
+        # update tracker info
+        not_found_tracker_list = [tracker for tracker in tracker_list if tracker not in found_tracker_list]
+        for tracker in not_found_tracker_list:
+            if self.session.lm.tracker_manager is not None:
+                self.session.lm.tracker_manager.add_tracker(tracker)
 
     def addTorrentTrackerMapping(self, torrent_id, tracker):
         self.addTorrentTrackerMappingInBatch(torrent_id, [tracker, ])
@@ -642,25 +897,14 @@ class TorrentDBHandler(BasicDBHandler):
         if not tracker_list:
             return
 
-        parameters = u"?," * len(tracker_list)
-        parameters = parameters[:-1]
-        sql = u"SELECT tracker FROM TrackerInfo WHERE tracker IN (%s)" % parameters
-
-        found_tracker_list = self._db.fetchall(sql, tuple(tracker_list))
-        found_tracker_list = [tracker[0] for tracker in found_tracker_list]
-
-        # update tracker info
-        not_found_tracker_list = [tracker for tracker in tracker_list if tracker not in found_tracker_list]
-        for tracker in not_found_tracker_list:
-            if self.session.lm.tracker_manager is not None:
-                self.session.lm.tracker_manager.add_tracker(tracker)
+        self._addTrackers(tracker_list)
 
         # update torrent-tracker mapping
         sql = 'INSERT OR IGNORE INTO TorrentTrackerMapping(torrent_id, tracker_id)'\
             + ' VALUES(?, (SELECT tracker_id FROM TrackerInfo WHERE tracker = ?))'
         new_mapping_list = [(torrent_id, tracker) for tracker in tracker_list]
         if new_mapping_list:
-            self._db.executemany(sql, new_mapping_list)
+            self._db.executemany_write(sql, new_mapping_list)
 
         # add trackers into the torrent file if it has been collected
         if not self.session.get_torrent_store() or self.session.lm.torrent_store is None:
@@ -690,16 +934,33 @@ class TorrentDBHandler(BasicDBHandler):
                 # have to use bencode to get around the TorrentDef.is_finalized() check in TorrentDef.encode()
                 self.session.save_collected_torrent(infohash, bencode(tdef.metainfo))
 
-    def getTorrentsOnTracker(self, tracker, current_time):
-        sql = """
-            SELECT T.torrent_id, T.infohash, T.last_tracker_check
+    def getTorrentsToCheck(self, current_time, last_check_before, limit,
+                           tracker_retry_interval=TRACKER_RETRY_INTERVAL):
+        """
+        Gets the (torrent, tracker) pairs that are due for a health check, the most overdue first.
+        :param current_time: The current time.
+        :param last_check_before: Skip torrents that were checked after this time.
+        :param limit: The maximum number of pairs to return.
+        :param tracker_retry_interval: Trackers that failed are skipped for this interval times 2 ^ failures,
+        like TrackerManager.should_check_tracker does.
+        :return: A list of (torrent_id, infohash, tracker, next_tracker_check, number of peers, tracker failures,
+        tracker_check_retries).
+        """
+        sql = u"""
+            SELECT T.torrent_id, T.infohash, TI.tracker, T.next_tracker_check,
+              IFNULL(T.num_seeders, 0) + IFNULL(T.num_leechers, 0), TI.failures, T.tracker_check_retries
               FROM Torrent T, TrackerInfo TI, TorrentTrackerMapping TTM
-              WHERE TI.tracker = ?
+              WHERE T.next_tracker_check < ? AND T.last_tracker_check < ?
               AND TI.tracker_id = TTM.tracker_id AND T.torrent_id = TTM.torrent_id
-              AND next_tracker_check < ?
+              AND TI.tracker != 'no-DHT'
+              AND IFNULL(TI.last_check, 0) + ? * (1 << MIN(IFNULL(TI.failures, 0), 32)) <= ?
+              ORDER BY T.next_tracker_check
+              LIMIT ?
             """
-        infohash_list = self._db.fetchall(sql, (tracker, current_time))
-        return [(torrent_id, str2bin(infohash), last_tracker_check) for torrent_id, infohash, last_tracker_check in infohash_list]
+        results = self._db.fetchall(sql, (current_time, last_check_before, tracker_retry_interval, current_time,
+                                          limit))
+        return [(torrent_id, str2bin(infohash), tracker, next_check or 0, nr_peers, failures or 0, retries or 0)
+                for torrent_id, infohash, tracker, next_check, nr_peers, failures, retries in results]
 
     def getTrackerListByTorrentID(self, torrent_id):
         sql = 'SELECT TR.tracker FROM TrackerInfo TR, TorrentTrackerMapping MP'\
@@ -717,7 +978,7 @@ class TorrentDBHandler(BasicDBHandler):
 
     def addTrackerInfoInBatch(self, tracker_list, to_notify=True):
         sql = 'INSERT INTO TrackerInfo(tracker) VALUES(?)'
-        self._db.executemany(sql, [(tracker,) for tracker in tracker_list])
+        self._db.executemany_write(sql, [(tracker,) for tracker in tracker_list])
 
         if to_notify:
             self.notifier.notify(NTFY_TRACKERINFO, NTFY_INSERT, tracker_list)
@@ -731,7 +992,7 @@ class TorrentDBHandler(BasicDBHandler):
         sql = 'UPDATE TrackerInfo SET'\
             + ' last_check = ?, failures = ?, is_alive = ?'\
             + ' WHERE tracker = ?'
-        self._db.executemany(sql, args)
+        self._db.executemany_write(sql, args)
 
     def getRecentlyAliveTrackers(self, limit=10):
         sql = """
@@ -772,6 +1033,8 @@ class TorrentDBHandler(BasicDBHandler):
 
         return torrent
 
+    getTorrent_async = read_async(getTorrent)
+
     def getLibraryTorrents(self, keys):
         sql = u"SELECT " + u", ".join(keys) + u""" FROM MyPreference, Torrent LEFT JOIN ChannelTorrents
             ON Torrent.torrent_id = ChannelTorrents.torrent_id WHERE destination_path != ''
@@ -781,6 +1044,8 @@ class TorrentDBHandler(BasicDBHandler):
         fixed = self.__fixTorrents(keys, data)
         return fixed
 
+    getLibraryTorrents_async = read_async(getLibraryTorrents)
+
     def __fixTorrents(self, keys, results):
         def fix_value(key):
             if key in keys:
@@ -797,6 +1062,8 @@ class TorrentDBHandler(BasicDBHandler):
         # return self._db.size('CollectedTorrent')
         return self._db.getOne('CollectedTorrent', 'count(torrent_id)')
 
+    getNumberCollectedTorrents_async = read_async(getNumberCollectedTorrents)
+
     def getRecentlyCollectedTorrents(self, limit):
         sql = u"""
             SELECT CT.infohash, CT.num_seeders, CT.num_leechers, T.last_tracker_check, CT.insert_time
@@ -807,6 +1074,8 @@ class TorrentDBHandler(BasicDBHandler):
         results = self._db.fetchall(sql, (limit,))
         return [[str2bin(result[0]), result[1], result[2], result[3] or 0, result[4]] for result in results]
 
+    getRecentlyCollectedTorrents_async = read_async(getRecentlyCollectedTorrents)
+
     def getRandomlyCollectedTorrents(self, insert_time, limit):
         sql = u"""
             SELECT CT.infohash, CT.num_seeders, CT.num_leechers, T.last_tracker_check
@@ -818,6 +1087,8 @@ class TorrentDBHandler(BasicDBHandler):
         results = self._db.fetchall(sql, (insert_time, limit))
         return [[str2bin(result[0]), result[1], result[2], result[3] or 0] for result in results]
 
+    getRandomlyCollectedTorrents_async = read_async(getRandomlyCollectedTorrents)
+
     def select_torrents_to_collect(self, hashes):
         parameters = '?,' * len(hashes)
         parameters = parameters[:-1]
@@ -831,28 +1102,32 @@ class TorrentDBHandler(BasicDBHandler):
     def getTorrentsStats(self):
         return self._db.getOne('CollectedTorrent', ['count(torrent_id)', 'sum(length)', 'sum(num_files)'])
 
+    getTorrentsStats_async = read_async(getTorrentsStats)
+
     def freeSpace(self, torrents2del):
         if self.channelcast_db and self.channelcast_db._channel_id:
             sql = U"""
                 SELECT torrent_file_name, torrent_id, relevance,
-                MIN(relevance, 2500) + MIN(500, num_leechers) + 4*MIN(500, num_seeders) - (MAX(0, MIN(500, (%d - creation_date)/86400)) ) AS weight
+                MIN(relevance, 2500) + MIN(500, num_leechers) + 4*MIN(500, num_seeders) - (MAX(0, MIN(500, (? - creation_date)/86400)) ) AS weight
                 FROM CollectedTorrent
                 WHERE torrent_id NOT IN (SELECT torrent_id FROM MyPreference)
-                AND torrent_id NOT IN (SELECT torrent_id FROM ChannelTorrents WHERE channel_id == %d)
+                AND torrent_id NOT IN (SELECT torrent_id FROM ChannelTorrents WHERE channel_id == ?)
                 ORDER BY weight
-                LIMIT %d
-            """ % (int(time()), self.channelcast_db._channel_id, torrents2del)
+                LIMIT ?
+            """
+            args = (int(time()), self.channelcast_db._channel_id, torrents2del)
         else:
             sql = u"""
                 SELECT torrent_file_name, torrent_id, relevance,
-                    min(relevance,2500) +  min(500,num_leechers) + 4*min(500,num_seeders) - (max(0,min(500,(%d-creation_date)/86400)) ) AS weight
+                    min(relevance,2500) +  min(500,num_leechers) + 4*min(500,num_seeders) - (max(0,min(500,(?-creation_date)/86400)) ) AS weight
                 FROM CollectedTorrent
                 WHERE torrent_id NOT IN (SELECT torrent_id FROM MyPreference)
                 ORDER BY weight
-                LIMIT %d
-            """ % (int(time()), torrents2del)
+                LIMIT ?
+            """
+            args = (int(time()), torrents2del)
 
-        res_list = self._db.fetchall(sql)
+        res_list = self._db.fetchall(sql, args)
         if len(res_list) == 0:
             return False
 
@@ -862,7 +1137,7 @@ class TorrentDBHandler(BasicDBHandler):
         # sql_del_pref = "delete from Preference where torrent_id=?"
         tids = [(torrent_id,) for torrent_file_name, torrent_id, relevance, weight in res_list]
 
-        self._db.executemany(sql_del_torrent, tids)
+        self._db.executemany_write(sql_del_torrent, tids)
         # self._db.executemany(sql_del_tracker, tids)
         # self._db.executemany(sql_del_pref, tids)
 
@@ -876,20 +1151,30 @@ class TorrentDBHandler(BasicDBHandler):
 
         if len(insert_files) > 0:
             sql_insert_files = "INSERT OR IGNORE INTO TorrentFiles (torrent_id, path, length) VALUES (?,?,?)"
-            self._db.executemany(sql_insert_files, insert_files)
+            self._db.executemany_write(sql_insert_files, insert_files)
 
         self._logger.info("Erased %d torrents", deleted)
         return deleted
 
-    def searchNames(self, kws, local=True, keys=None, doSort=True):
+    def searchNames(self, kws, local=True, keys=None, doSort=True, limit=None, offset=0):
+        """
+        Searches the FullTextIndex for torrents matching the keywords. SQLite ranks the matches (see fts_rank), picks
+        the best channel for every torrent and paginates the results, so only the requested page is processed here.
+        :param kws: The keywords to search for.
+        :param local: Whether to search all torrents, or only the collected ones when answering a remote search.
+        :param keys: The columns to return, must include infohash.
+        :param doSort: Whether to return the torrents with seeders before the ones without.
+        :param limit: The maximum number of results, by default unlimited for local searches and
+        REMOTE_SEARCH_MAX_RESULTS for remote ones.
+        :param offset: The number of results to skip.
+        :return: A list of results with the values of keys, the channel id, the matching keywords and the channel.
+        """
         assert 'infohash' in keys
-        assert not doSort or ('num_seeders' in keys or 'T.num_seeders' in keys)
 
         infohash_index = keys.index('infohash')
-        num_seeders_index = keys.index('num_seeders') if 'num_seeders' in keys else -1
 
-        if num_seeders_index == -1:
-            doSort = False
+        if limit is None:
+            limit = -1 if local else REMOTE_SEARCH_MAX_RESULTS
 
         values = ", ".join(keys)
         mainsql = "SELECT " + values + ", C.channel_id, Matchinfo(FullTextIndex) FROM"
@@ -898,25 +1183,40 @@ class TorrentDBHandler(BasicDBHandler):
         else:
             mainsql += " CollectedTorrent T"
 
+        # of all channels a torrent is in, always prefer my channel, then the channel with the highest vote of mine
+        # and then the one with the most votes. Torrents whose best channel is spam to me are not returned.
         mainsql += """, FullTextIndex
-                    LEFT OUTER JOIN _ChannelTorrents C ON T.torrent_id = C.torrent_id
-                    WHERE t.name IS NOT NULL AND t.torrent_id = FullTextIndex.rowid AND C.deleted_at IS NULL AND FullTextIndex MATCH ?
+                    LEFT OUTER JOIN _ChannelTorrents C ON C.id = (
+                        SELECT CT.id FROM _ChannelTorrents CT
+                        LEFT OUTER JOIN _Channels CH ON CH.id = CT.channel_id
+                        LEFT OUTER JOIN ChannelVotes V ON V.channel_id = CT.channel_id AND V.voter_id ISNULL
+                        WHERE CT.torrent_id = T.torrent_id AND CT.deleted_at IS NULL
+                        ORDER BY CT.channel_id = ? DESC, IFNULL(V.vote, 0) DESC,
+                                 IFNULL(CH.nr_favorite, 0) - IFNULL(CH.nr_spam, 0) DESC
+                        LIMIT 1)
+                    WHERE T.name IS NOT NULL AND T.torrent_id = FullTextIndex.rowid AND FullTextIndex MATCH ?
+                    AND IFNULL((SELECT vote FROM ChannelVotes
+                                WHERE channel_id = C.channel_id AND voter_id ISNULL), 0) >= 0
                     """
 
         if not local:
-            mainsql += "AND T.secret is not 1 LIMIT 250"
+            mainsql += "AND T.secret is not 1 "
+
+        mainsql += "ORDER BY "
+        if doSort:
+            mainsql += "T.num_seeders > 0 DESC, "
+        mainsql += """fts_rank(Matchinfo(FullTextIndex), (SELECT MAX(torrent_id) FROM Torrent), T.num_seeders,
+                               (SELECT nr_favorite - nr_spam FROM _Channels WHERE id = C.channel_id)) DESC
+                      LIMIT ? OFFSET ?"""
 
         query = " ".join(filter_keywords(kws))
         not_negated = [kw for kw in filter_keywords(kws) if kw[0] != '-']
 
-        results = self._db.fetchall(mainsql, (query,))
+        my_channel_id = self.channelcast_db._channel_id or 0
+        results = [list(result) for result in self._db.fetchall(mainsql, (my_channel_id, query, limit, offset))]
 
-        channels = set()
+        channels = set(result[-2] for result in results if result[-2])
         channel_dict = {}
-        for result in results:
-            if result[-2]:
-                channels.add(result[-2])
-
         if len(channels) > 0:
             # results are tuples of (id, str(dispersy_cid), name, description,
             # nr_torrents, nr_favorites, nr_spam, my_vote, modified, id ==
@@ -925,155 +1225,73 @@ class TorrentDBHandler(BasicDBHandler):
                 if channel[1] != '-1':
                     channel_dict[channel[0]] = channel
 
-        myChannelId = self.channelcast_db._channel_id or 0
-
-        result_dict = {}
-
-        # step 1, merge torrents keep one with best channel
         for result in results:
-            channel_id = result[-2]
-            channel = channel_dict.get(channel_id, None)
-
-            infohash = result[infohash_index]
-            if channel:
-                # ignoring spam channels
-                if channel[7] < 0:
-                    continue
-
-                # see if we have a better channel in torrents_dict
-                if infohash in result_dict:
-                    old_channel = channel_dict.get(result_dict[infohash][-2], False)
-                    if old_channel:
-
-                        # allways prefer my channel
-                        if old_channel[0] == myChannelId:
-                            continue
-
-                        # allways prefer channel with higher vote
-                        if channel[7] < old_channel[7]:
-                            continue
-
-                        votes = (channel[5] or 0) - (channel[6] or 0)
-                        oldvotes = (old_channel[5] or 0) - (old_channel[6] or 0)
-                        if votes < oldvotes:
-                            continue
-
-                result_dict[infohash] = result
-
-            elif infohash not in result_dict:
-                result_dict[infohash] = result
-
-
-        # step 2, fix all dict fields
-        dont_sort_list = []
-        results = [list(result) for result in result_dict.values()]
-        for i in xrange(len(results) - 1, -1, -1):
-            result = results[i]
-
             result[infohash_index] = str2bin(result[infohash_index])
 
-            matches = {'swarmname': set(), 'filenames': set(), 'fileextensions': set()}
-
-            # Matchinfo is documented at: http://www.sqlite.org/fts3.html#matchinfo
-            matchinfo = str(result[-1])
-            num_phrases, num_cols = unpack_from('II', matchinfo)
-            unpack_str = 'I' * (3 * num_cols * num_phrases)
-            matchinfo = unpack_from('II' + unpack_str, matchinfo)
-
-            swarmnames, filenames, fileextensions = [
-                [matchinfo[3 * (i + p * num_cols) + 2] for p in range(num_phrases)]
-                for i in range(num_cols)
-            ]
-
-            for i, keyword in enumerate(not_negated):
-                if swarmnames[i]:
-                    matches['swarmname'].add(keyword)
-                if filenames[i]:
-                    matches['filenames'].add(keyword)
-                if fileextensions[i]:
-                    matches['fileextensions'].add(keyword)
+            matches = {}
+            for column, matched in zip(('swarmname', 'filenames', 'fileextensions'),
+                                       get_fts_match_columns(result[-1], len(not_negated))):
+                matches[column] = set(keyword for keyword, hit in zip(not_negated, matched) if hit)
             result[-1] = matches
 
             channel = channel_dict.get(result[-2], (result[-2], None, '', '', 0, 0, 0, 0, 0, False))
             result.extend(channel)
 
-            if doSort and result[num_seeders_index] <= 0:
-                dont_sort_list.append(result)
-                results.pop(i)
-
-
-        if doSort:
-            def compare(a, b):
-                return cmp(a[num_seeders_index], b[num_seeders_index])
-            results.sort(compare, reverse=True)
-        results.extend(dont_sort_list)
-
-        if not local:
-            results = results[:25]
-
         return results
 
-    def getAutoCompleteTerms(self, keyword, max_terms, limit=100):
-        sql = "SELECT swarmname FROM FullTextIndex WHERE swarmname MATCH ? LIMIT ?"
-        result = self._db.fetchall(sql, (keyword + '*', limit))
+    searchNames_async = read_async(searchNames)
 
-        all_terms = set()
-        for line, in result:
-            if len(all_terms) >= max_terms:
-                break
-            i1 = line.find(keyword)
-            i2 = line.find(' ', i1 + len(keyword))
-            all_terms.add(line[i1:i2] if i2 >= 0 else line[i1:])
-
-        if keyword in all_terms:
-            all_terms.remove(keyword)
-        if '' in all_terms:
-            all_terms.remove('')
+    def getAutoCompleteTerms(self, keyword, max_terms):
+        """
+        Returns the most frequent swarmname terms that start with the given keyword.
+        :param keyword: The (partial) keyword to complete.
+        :param max_terms: The maximum number of terms to return.
+        :return: A list of terms, ordered by the number of torrents they occur in.
+        """
+        keyword = keyword.lower()
+        # the range covers all terms that have keyword as prefix, except keyword itself
+        sql = u"SELECT term FROM TermFrequency WHERE term > ? AND term < ? ORDER BY freq DESC LIMIT ?"
+        return [term for term, in self._db.fetchall(sql, (keyword, keyword + u"\uffff", max_terms))]
 
-        return list(all_terms)
+    getAutoCompleteTerms_async = read_async(getAutoCompleteTerms)
 
     def getSearchSuggestion(self, keywords, limit=1):
-        match = [keyword.lower() for keyword in keywords if len(keyword) > 3]
-
-        def lev(a, b):
-            "Calculates the Levenshtein distance between a and b."
-            n, m = len(a), len(b)
-            if n > m:
-                # Make sure n <= m, to use O(min(n,m)) space
-                a, b = b, a
-                n, m = m, n
-
-            current = range(n + 1)
-            for i in range(1, m + 1):
-                previous, current = current, [i] + [0] * n
-                for j in range(1, n + 1):
-                    add, delete = previous[j] + 1, current[j - 1] + 1
-                    change = previous[j - 1]
-                    if a[j - 1] != b[i - 1]:
-                        change = change + 1
-                    current[j] = min(add, delete, change)
-
-            return current[n]
-
-        def levcollate(s1, s2):
-            l1 = sum(sorted([lev(a, b) for a in s1.split() for b in match])[:len(match)])
-            l2 = sum(sorted([lev(a, b) for a in s2.split() for b in match])[:len(match)])
-
-            # return -1 if s1<s2, +1 if s1>s2 else 0
-            if l1 < l2:
-                return -1
-            if l1 > l2:
-                return 1
-            return 0
-
-        cursor = self._db.get_cursor()
-        connection = cursor.getconnection()
-        connection.createcollation("leven", levcollate)
+        """
+        Returns alternative queries in which the keywords that are not in the vocabulary of the swarmnames are
+        replaced by known terms within a small edit distance.
+        :param keywords: The keywords of the query.
+        :param limit: The maximum number of suggestions.
+        :return: A list of queries.
+        """
+        spelling_index = self._get_spelling_index()
 
-        sql = "SELECT swarmname FROM FullTextIndex WHERE swarmname MATCH ? ORDER By swarmname collate leven ASC LIMIT ?"
-        results = self._db.fetchall(sql, (' OR '.join(['*%s*' % m for m in match]), limit))
-        connection.createcollation("leven", None)
-        return [result[0] for result in results]
+        keywords = [keyword.lower() for keyword in keywords]
+        corrections = []
+        for keyword in keywords:
+            candidates = spelling_index.lookup(keyword, limit) if len(keyword) > 3 else []
+            if not candidates or keyword in candidates:
+                candidates = [keyword]
+            corrections.append(candidates)
+
+        query = u" ".join(keywords)
+        suggestions = []
+        for i in xrange(limit):
+            suggestion = u" ".join(candidates[min(i, len(candidates) - 1)] for candidates in corrections)
+            if suggestion != query and suggestion not in suggestions:
+                suggestions.append(suggestion)
+        return suggestions
+
+    def _get_spelling_index(self):
+        """
+        Returns the spelling index of the most frequent swarmname terms, building it the first time.
+        """
+        if self._spelling_index is None:
+            spelling_index = SymmetricDeleteIndex(max_terms=MAX_SPELLING_TERMS)
+            sql = u"SELECT term, freq FROM TermFrequency ORDER BY freq DESC LIMIT ?"
+            for term, frequency in self._db.fetchall(sql, (MAX_SPELLING_TERMS,)):
+                spelling_index.add(term, frequency)
+            self._spelling_index = spelling_index
+        return self._spelling_index
 
 
 class MyPreferenceDBHandler(BasicDBHandler):
@@ -1107,18 +1325,21 @@ class MyPreferenceDBHandler(BasicDBHandler):
         res = [item for sublist in res for item in sublist]
         return [str2bin(p) if p else '' for p in res]
 
+    getMyPrefListInfohash_async = read_async(getMyPrefListInfohash)
+
     def getMyPrefStats(self, torrent_id=None):
         value_name = ('torrent_id', 'destination_path',)
         if torrent_id is not None:
-            where = 'torrent_id == %s' % torrent_id
+            res = self.getAll(value_name, torrent_id=torrent_id)
         else:
-            where = None
-        res = self.getAll(value_name, where)
+            res = self.getAll(value_name)
         mypref_stats = {}
         for torrent_id, destination_path in res:
             mypref_stats[torrent_id] = destination_path
         return mypref_stats
 
+    getMyPrefStats_async = read_async(getMyPrefStats)
+
     def getMyPrefStatsInfohash(self, infohash):
         torrent_id = self._torrent_db.getTorrentID(infohash)
         if torrent_id is not None:
@@ -1168,7 +1389,7 @@ class MyPreferenceDBHandler(BasicDBHandler):
         if not isinstance(destdir, basestring):
             self._logger.info('DESTDIR IS NOT STRING: %s', destdir)
             return
-        self._db.update(self.table_name, 'torrent_id=%d' % torrent_id, destination_path=destdir)
+        self._db.update(self.table_name, u'torrent_id = ?', (torrent_id,), destination_path=destdir)
 
 
 class VoteCastDBHandler(BasicDBHandler):
@@ -1193,7 +1414,7 @@ class VoteCastDBHandler(BasicDBHandler):
 
     def on_votes_from_dispersy(self, votes):
         insert_vote = "INSERT OR REPLACE INTO _ChannelVotes (channel_id, voter_id, dispersy_id, vote, time_stamp) VALUES (?,?,?,?,?)"
-        self._db.executemany(insert_vote, votes)
+        self._db.executemany_write(insert_vote, votes)
 
         for channel_id, voter_id, _, vote, _ in votes:
             if voter_id is None:
@@ -1204,7 +1425,7 @@ class VoteCastDBHandler(BasicDBHandler):
 
     def on_remove_votes_from_dispersy(self, votes, contains_my_vote):
         remove_vote = "UPDATE _ChannelVotes SET deleted_at = ? WHERE channel_id = ? AND dispersy_id = ?"
-        self._db.executemany(remove_vote, votes)
+        self._db.executemany_write(remove_vote, votes)
 
         if contains_my_vote:
             for _, channel_id, _ in votes:
@@ -1230,7 +1451,8 @@ class VoteCastDBHandler(BasicDBHandler):
 
             updates = [(positive_votes.get(channel_id, 0), negative_votes.get(channel_id, 0), channel_id)
                        for channel_id in channel_ids]
-            self._db.executemany("UPDATE OR IGNORE _Channels SET nr_favorite = ?, nr_spam = ? WHERE id = ?", updates)
+            self._db.executemany_write("UPDATE OR IGNORE _Channels SET nr_favorite = ?, nr_spam = ? WHERE id = ?",
+                                       updates)
 
             for channel_id in channel_ids:
                 self.notifier.notify(NTFY_VOTECAST, NTFY_UPDATE, channel_id)
@@ -1254,6 +1476,8 @@ class VoteCastDBHandler(BasicDBHandler):
             return result
         return 0, 0
 
+    getPosNegVotes_async = read_async(getPosNegVotes)
+
     def getVoteOnChannel(self, channel_id, voter_id):
         """ return the vote status if such record exists, otherwise None  """
         if voter_id:
@@ -1262,6 +1486,8 @@ class VoteCastDBHandler(BasicDBHandler):
         sql = "select vote from ChannelVotes where channel_id = ? and voter_id ISNULL"
         return self._db.fetchone(sql, (channel_id,))
 
+    getVoteOnChannel_async = read_async(getVoteOnChannel)
+
     def getVoteForMyChannel(self, voter_id):
         return self.getVoteOnChannel(self.channelcast_db._channel_id, voter_id)
 
@@ -1285,11 +1511,15 @@ class VoteCastDBHandler(BasicDBHandler):
         if not self.my_votes:
             sql = "SELECT channel_id, vote FROM ChannelVotes WHERE voter_id ISNULL"
 
-            self.my_votes = {}
+            # build the dict before publishing it, getMyVotes can be called from the read pool as well
+            my_votes = {}
             for channel_id, vote in self._db.fetchall(sql):
-                self.my_votes[channel_id] = vote
+                my_votes[channel_id] = vote
+            self.my_votes = my_votes
         return self.my_votes
 
+    getMyVotes_async = read_async(getMyVotes)
+
 
 class ChannelCastDBHandler(BasicDBHandler):
 
@@ -1312,11 +1542,11 @@ class ChannelCastDBHandler(BasicDBHandler):
         def update_nr_torrents():
             rows = self.getChannelNrTorrents(50)
             update = "UPDATE _Channels SET nr_torrents = ? WHERE id = ?"
-            self._db.executemany(update, rows)
+            self._db.executemany_write(update, rows)
 
             rows = self.getChannelNrTorrentsLatestUpdate(50)
             update = "UPDATE _Channels SET nr_torrents = ?, modified = ? WHERE id = ?"
-            self._db.executemany(update, rows)
+            self._db.executemany_write(update, rows)
 
         self.register_task(u"update_nr_torrents", LoopingCall(update_nr_torrents)).start(300, now=False)
 
@@ -1453,7 +1683,7 @@ ORDER BY CMD.time_stamp DESC LIMIT ?;
 
         if len(insert_data) > 0:
             sql_insert_torrent = "INSERT INTO _ChannelTorrents (dispersy_id, torrent_id, channel_id, peer_id, name, time_stamp) VALUES (?,?,?,?,?,?)"
-            self._db.executemany(sql_insert_torrent, insert_data)
+            self._db.executemany_write(sql_insert_torrent, insert_data)
 
         updated_channel_torrent_dict = defaultdict(list)
         for torrent in torrentlist:
@@ -1464,7 +1694,7 @@ ORDER BY CMD.time_stamp DESC LIMIT ?;
 
         sql_update_channel = "UPDATE _Channels SET modified = strftime('%s','now'), nr_torrents = nr_torrents+? WHERE id = ?"
         update_channels = [(new_torrents, channel_id) for channel_id, new_torrents in updated_channels.iteritems()]
-        self._db.executemany(sql_update_channel, update_channels)
+        self._db.executemany_write(sql_update_channel, update_channels)
 
         for channel_id in updated_channels.keys():
             self.notifier.notify(NTFY_CHANNELCAST, NTFY_UPDATE, channel_id)
@@ -1867,6 +2097,8 @@ ORDER BY CMD.time_stamp DESC LIMIT ?;
 
         return torrent_dict
 
+    getRecentAndRandomTorrents_async = read_async(getRecentAndRandomTorrents)
+
     def getRandomTorrents(self, channel_id, limit=15):
         sql = """SELECT infohash FROM ChannelTorrents, Torrent WHERE ChannelTorrents.torrent_id = Torrent.torrent_id
         AND channel_id = ? ORDER BY RANDOM() LIMIT ?"""
@@ -2114,6 +2346,8 @@ ORDER BY CMD.time_stamp DESC LIMIT ?;
               "WHERE Playlists.channel_id = ? GROUP BY Playlists.id ORDER BY Playlists.name DESC"
         return self._db.fetchall(sql, (channel_id,))
 
+    getPlaylistsFromChannelId_async = read_async(getPlaylistsFromChannelId)
+
     def getPlaylist(self, playlist_id, keys):
         sql = "SELECT " + ", ".join(keys) + \
               ", count(DISTINCT ChannelTorrents.id) FROM Playlists " + \
@@ -2132,6 +2366,8 @@ ORDER BY CMD.time_stamp DESC LIMIT ?;
             sql += " LIMIT %d" % limit
         return self._db.fetchall(sql, (channel_id,))
 
+    getCommentsFromChannelId_async = read_async(getCommentsFromChannelId)
+
     def getCommentsFromPlayListId(self, playlist_id, keys, limit=None):
         playlistKeys = keys[:]
         if 'CommentTorrent.channeltorrent_id' in playlistKeys:
@@ -2210,6 +2446,8 @@ ORDER BY CMD.time_stamp DESC LIMIT ?;
             return results
         return []
 
+    searchChannelsTorrent_async = read_async(searchChannelsTorrent)
+
     def searchChannels(self, keywords):
         sql = "SELECT id, name, description, dispersy_cid, modified, nr_torrents, nr_favorite, nr_spam " + \
               "FROM Channels WHERE"
@@ -2218,6 +2456,8 @@ ORDER BY CMD.time_stamp DESC LIMIT ?;
         sql = sql[:-3]
         return self._getChannels(sql)
 
+    searchChannels_async = read_async(searchChannels)
+
     def getChannel(self, channel_id):
         sql = "Select id, name, description, dispersy_cid, modified, nr_torrents, nr_favorite, nr_spam " + \
               "FROM Channels WHERE id = ?"
@@ -2225,6 +2465,8 @@ ORDER BY CMD.time_stamp DESC LIMIT ?;
         if len(channels) > 0:
             return channels[0]
 
+    getChannel_async = read_async(getChannel)
+
     def getChannels(self, channel_ids):
         channel_ids = "','".join(map(str, channel_ids))
         sql = "Select id, name, description, dispersy_cid, modified, " + \
@@ -2234,6 +2476,8 @@ ORDER BY CMD.time_stamp DESC LIMIT ?;
             "')"
         return self._getChannels(sql)
 
+    getChannels_async = read_async(getChannels)
+
     def getChannelsByCID(self, channel_cids):
         parameters = '?,' * len(channel_cids)
         parameters = parameters[:-1]
@@ -2245,17 +2489,23 @@ ORDER BY CMD.time_stamp DESC LIMIT ?;
             ")"
         return self._getChannels(sql, channel_cids)
 
+    getChannelsByCID_async = read_async(getChannelsByCID)
+
     def getAllChannels(self):
         """ Returns all the channels """
         sql = "Select id, name, description, dispersy_cid, modified, nr_torrents, nr_favorite, nr_spam FROM Channels"
         return self._getChannels(sql)
 
+    getAllChannels_async = read_async(getAllChannels)
+
     def getNewChannels(self, updated_since=0):
         """ Returns all newest unsubscribed channels, ie the ones with no votes (positive or negative)"""
         sql = "Select id, name, description, dispersy_cid, modified, nr_torrents, nr_favorite, nr_spam " + \
               "FROM Channels WHERE nr_favorite = 0 AND nr_spam = 0 AND modified > ?"
         return self._getChannels(sql, (updated_since,))
 
+    getNewChannels_async = read_async(getNewChannels)
+
     def getLatestUpdated(self, max_nr=20):
         def channel_sort(a, b):
             # first compare local vote, spam -> return -1
@@ -2276,11 +2526,15 @@ ORDER BY CMD.time_stamp DESC LIMIT ?;
               "FROM Channels Order By modified DESC Limit ?"
         return self._getChannels(sql, (max_nr,), cmpF=channel_sort)
 
+    getLatestUpdated_async = read_async(getLatestUpdated)
+
     def getMostPopularChannels(self, max_nr=20):
         sql = "Select id, name, description, dispersy_cid, modified, nr_torrents, nr_favorite, nr_spam " + \
               "FROM Channels ORDER BY nr_favorite DESC, modified DESC LIMIT ?"
         return self._getChannels(sql, (max_nr,), includeSpam=False)
 
+    getMostPopularChannels_async = read_async(getMostPopularChannels)
+
     def getMySubscribedChannels(self, includeDispsersy=False):
         sql = "SELECT id, name, description, dispersy_cid, modified, nr_torrents, nr_favorite, nr_spam " + \
               "FROM Channels, ChannelVotes " + \
@@ -2290,6 +2544,8 @@ ORDER BY CMD.time_stamp DESC LIMIT ?;
 
         return self._getChannels(sql)
 
+    getMySubscribedChannels_async = read_async(getMySubscribedChannels)
+
     def _getChannels(self, sql, args=None, cmpF=None, includeSpam=True):
         """Returns the channels based on the input sql, if the number of positive votes
         is less than maxvotes and the number of torrent > 0"""
@@ -2391,3 +2647,5 @@ ORDER BY CMD.time_stamp DESC LIMIT ?;
                 elif channel[5] == best_channel[5] and channel[4] > best_channel[4]:
                     best_channel = channel
             return best_channel
+
+    getMostPopularChannelFromTorrent_async = read_async(getMostPopularChannelFromTorrent)
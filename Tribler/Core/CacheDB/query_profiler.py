@@ -0,0 +1,143 @@
+import heapq
+import json
+import logging
+import os
+import sys
+from itertools import count
+from threading import RLock, currentThread
+
+
+# upper bounds (in seconds) of the latency histogram buckets, the last bucket holds everything slower
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+DEFAULT_MAX_SLOW_QUERIES = 50
+MAX_PROFILED_STATEMENTS = 2048
+
+EXPLAINABLE_STATEMENTS = (u"SELECT", u"INSERT", u"UPDATE", u"DELETE", u"REPLACE")
+
+# frames from these files are skipped when looking for the caller of a query
+SKIPPED_CALLER_FILES = (u"sqlitecachedb", u"query_profiler", u"dispersy/util", u"twisted")
+
+
+class QueryProfiler(object):
+
+    """
+    Records the latency, number of rows and callers of every statement executed by SQLiteCacheDB, and keeps the
+    slowest queries together with their query plan.
+    """
+
+    def __init__(self, max_slow_queries=DEFAULT_MAX_SLOW_QUERIES):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._lock = RLock()
+        self._max_slow_queries = max_slow_queries
+
+        self._statements = {}
+        # min-heap of (elapsed, sequence number, query info), so the fastest of the slow queries is popped first
+        self._slow_queries = []
+        self._sequence = count()
+
+    def record(self, sql, args, elapsed, nr_rows, cursor=None):
+        """
+        Records an executed statement.
+        :param sql: The executed SQL.
+        :param args: The arguments the SQL was executed with.
+        :param elapsed: The time it took to execute the SQL and fetch its rows, in seconds.
+        :param nr_rows: The number of rows returned or written.
+        :param cursor: The cursor the SQL was executed on, used to get the query plan of slow queries.
+        """
+        caller = self._get_caller()
+        thread_name = currentThread().getName()
+
+        with self._lock:
+            stats = self._statements.get(sql)
+            if stats is None:
+                if len(self._statements) >= MAX_PROFILED_STATEMENTS:
+                    return
+                stats = self._statements[sql] = {u"count": 0, u"total_time": 0.0, u"max_time": 0.0, u"rows": 0,
+                                                 u"histogram": [0] * (len(LATENCY_BUCKETS) + 1), u"callers": {}}
+
+            stats[u"count"] += 1
+            stats[u"total_time"] += elapsed
+            stats[u"max_time"] = max(stats[u"max_time"], elapsed)
+            stats[u"rows"] += nr_rows
+            stats[u"histogram"][self._get_bucket(elapsed)] += 1
+
+            caller_key = u"%s (%s)" % (caller, thread_name)
+            stats[u"callers"][caller_key] = stats[u"callers"].get(caller_key, 0) + 1
+
+            is_slow = len(self._slow_queries) < self._max_slow_queries or elapsed > self._slow_queries[0][0]
+
+        if is_slow:
+            query_info = {u"sql": sql, u"args": repr(args), u"time": elapsed, u"rows": nr_rows,
+                          u"caller": caller, u"thread": thread_name, u"plan": self._explain(sql, args, cursor)}
+            with self._lock:
+                entry = (elapsed, next(self._sequence), query_info)
+                if len(self._slow_queries) < self._max_slow_queries:
+                    heapq.heappush(self._slow_queries, entry)
+                else:
+                    heapq.heappushpop(self._slow_queries, entry)
+
+    @staticmethod
+    def _get_bucket(elapsed):
+        for index, upper_bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= upper_bound:
+                return index
+        return len(LATENCY_BUCKETS)
+
+    @staticmethod
+    def _get_caller():
+        frame = sys._getframe(1)
+        while frame is not None:
+            filename = frame.f_code.co_filename.replace(os.sep, u"/")
+            if not any(skipped in filename for skipped in SKIPPED_CALLER_FILES):
+                module = os.path.splitext(os.path.basename(filename))[0]
+                instance = frame.f_locals.get('self')
+                if instance is not None:
+                    return u"%s.%s" % (instance.__class__.__name__, frame.f_code.co_name)
+                return u"%s.%s" % (module, frame.f_code.co_name)
+            frame = frame.f_back
+        # called from the reactor, e.g. through blocking_call_on_reactor_thread
+        return u"unknown"
+
+    def _explain(self, sql, args, cursor):
+        if cursor is None or not sql.lstrip().upper().startswith(EXPLAINABLE_STATEMENTS):
+            return None
+
+        # only the first statement would be explained, the ones after it would be executed again
+        if u";" in sql.strip().rstrip(u";"):
+            return None
+
+        try:
+            if args:
+                plan = cursor.execute(u"EXPLAIN QUERY PLAN " + sql, args)
+            else:
+                plan = cursor.execute(u"EXPLAIN QUERY PLAN " + sql)
+            return [u" ".join(unicode(column) for column in row) for row in plan]
+        except Exception as e:
+            self._logger.debug(u"Could not get query plan of %s: %s", sql, e)
+            return None
+
+    def get_statistics(self):
+        """
+        Returns the collected statistics.
+        :return: A dictionary with the statistics per statement, sorted by cumulative time, and the slowest queries.
+        """
+        with self._lock:
+            statements = [dict(stats, sql=sql, callers=dict(stats[u"callers"]), histogram=list(stats[u"histogram"]))
+                          for sql, stats in self._statements.iteritems()]
+            slow_queries = [query_info for _, _, query_info in sorted(self._slow_queries, reverse=True)]
+
+        statements.sort(key=lambda stats: stats[u"total_time"], reverse=True)
+        return {u"latency_buckets": list(LATENCY_BUCKETS),
+                u"statements": statements,
+                u"slow_queries": slow_queries}
+
+    def dump(self, file_path):
+        """
+        Writes the collected statistics as JSON to the given file.
+        :param file_path: The path of the file to write.
+        """
+        with open(file_path, "wb") as dump_file:
+            json.dump(self.get_statistics(), dump_file, indent=2)
+        self._logger.info(u"Query profile written to %s", file_path)
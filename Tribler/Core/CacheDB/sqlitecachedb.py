@@ -2,18 +2,25 @@
 # see LICENSE.txt for license information
 import logging
 import os
+from time import time
 from base64 import encodestring, decodestring
-from threading import currentThread, RLock
+from threading import currentThread, RLock, local
 
 import apsw
 from apsw import CantOpenError, SQLError
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.failure import Failure
 from twisted.python.threadable import isInIOThread
+from twisted.python.threadpool import ThreadPool
 
 from Tribler.dispersy.taskmanager import TaskManager
 from Tribler.dispersy.util import blocking_call_on_reactor_thread, call_on_reactor_thread
 
 from Tribler import LIBRARYNAME
 from Tribler.Core.CacheDB.db_versions import LATEST_DB_VERSION
+from Tribler.Core.CacheDB.query_profiler import QueryProfiler, DEFAULT_MAX_SLOW_QUERIES
 
 
 DB_SCRIPT_NAME = u"schema_sdb_v%s.sql" % str(LATEST_DB_VERSION)
@@ -23,9 +30,25 @@ DB_FILE_NAME = u"tribler.sdb"
 DB_DIR_NAME = u"sqlite"
 DB_FILE_RELATIVE_PATH = os.path.join(DB_DIR_NAME, DB_FILE_NAME)
 
+QUERY_PROFILE_FILE_NAME = u"query_profile.json"
+
 
 DEFAULT_BUSY_TIMEOUT = 10000
 
+# number of threads (and thus read-only WAL connections) serving the *_async read methods
+DEFAULT_READ_POOL_SIZE = 4
+
+# queued writes are flushed when this many rows are pending, or after this many seconds
+WRITE_QUEUE_MAX_ROWS = 1000
+WRITE_QUEUE_MAX_DELAY = 0.5
+
+# the open transaction is committed when this many rows have been written, or after this many seconds
+COMMIT_MAX_ROWS = 10000
+COMMIT_MAX_DELAY = 5.0
+
+# maximum number of distinct query shapes cached and profiled by the generic helpers
+MAX_QUERY_SHAPES = 2048
+
 TRHEADING_DEBUG = False
 
 forceDBThread = call_on_reactor_thread
@@ -46,7 +69,7 @@ def str2bin(str_data):
 
 class SQLiteCacheDB(TaskManager):
 
-    def __init__(self, session, busytimeout=DEFAULT_BUSY_TIMEOUT):
+    def __init__(self, session, busytimeout=DEFAULT_BUSY_TIMEOUT, read_pool_size=DEFAULT_READ_POOL_SIZE):
         super(SQLiteCacheDB, self).__init__()
 
         self._logger = logging.getLogger(self.__class__.__name__)
@@ -60,10 +83,37 @@ class SQLiteCacheDB(TaskManager):
         self._connection = None
         self._busytimeout = busytimeout  # busytimeout is in milliseconds
 
+        # read-only connections, one per read pool thread
+        self._read_pool_size = read_pool_size
+        self._read_threadpool = None
+        self._read_local = local()
+        self._read_connections = []
+
+        # SQL functions implemented in Python, registered on every connection
+        self._scalar_functions = {}
+
         self._version = None
 
         self._should_commit = False
         self._show_execute = False
+        self._profiler = None
+
+        # queue of [sql, [args, ...]] entries, consecutive writes with the same sql share an entry
+        self._write_queue = []
+        self._write_queue_rows = 0
+        self._uncommitted_rows = 0
+        self._flush_call = None
+        self._commit_call = None
+        # SQL per query shape of the generic helpers (getOne, getAll, insert, update, delete), the SQL of the
+        # write shapes, and the [number of calls, cumulative time] per generated SQL
+        self._shape_sql = {}
+        self._shape_write_sql = set()
+        self._shape_lock = RLock()
+        self._shape_stats = {}
+
+        self._write_stats = {u"queued_rows": 0, u"flushes": 0, u"flushed_rows": 0, u"flushed_statements": 0,
+                             u"max_queue_rows": 0, u"commits": 0, u"committed_rows": 0, u"commit_time": 0.0,
+                             u"max_commit_time": 0.0}
 
     @property
     def version(self):
@@ -81,10 +131,13 @@ class SQLiteCacheDB(TaskManager):
 
         # open a connection to the database
         self._open_connection(self.sqlite_db_path, sql_script_path)
+        self._start_read_pool()
 
     @blocking_call_on_reactor_thread
     def close(self):
         self.cancel_all_pending_tasks()
+        self._flush_write_queue()
+        self._stop_read_pool()
         with self._cursor_lock:
             for cursor in self._cursor_table.itervalues():
                 cursor.close()
@@ -178,6 +231,63 @@ class SQLiteCacheDB(TaskManager):
             msg = u"Failed to load database version: %s" % e
             raise CorruptedDatabaseError(msg)
 
+    def _start_read_pool(self):
+        """ Starts the thread pool that runs the *_async read methods off the reactor thread.
+            An in-memory database cannot be shared between connections, in that case no pool is
+            started and the *_async methods fall back to the writer connection.
+        """
+        if self.sqlite_db_path == u":memory:" or self._read_pool_size <= 0:
+            return
+
+        self._read_threadpool = ThreadPool(minthreads=1, maxthreads=self._read_pool_size, name="SQLiteCacheDB-read")
+        self._read_threadpool.start()
+
+    def _stop_read_pool(self):
+        if self._read_threadpool is not None:
+            self._read_threadpool.stop()
+            self._read_threadpool = None
+
+        with self._cursor_lock:
+            for connection in self._read_connections:
+                connection.close()
+            self._read_connections = []
+        self._read_local = local()
+
+    def _get_read_cursor(self):
+        """ Returns the cursor of the read-only connection owned by the current read pool thread.
+            WAL mode lets these connections read concurrently with the writer connection, but they
+            only see data that has been committed by commit_now.
+        """
+        cursor = getattr(self._read_local, 'cursor', None)
+        if cursor is None:
+            connection = apsw.Connection(self.sqlite_db_path)
+            connection.setbusytimeout(self._busytimeout)
+            for name, (func, nargs) in self._scalar_functions.iteritems():
+                connection.createscalarfunction(name, func, nargs)
+            cursor = connection.cursor()
+            cursor.execute(u"PRAGMA query_only = ON;")
+
+            with self._cursor_lock:
+                self._read_connections.append(connection)
+            self._read_local.cursor = cursor
+        return cursor
+
+    @blocking_call_on_reactor_thread
+    def create_scalar_function(self, name, func, nargs=-1):
+        """
+        Registers a Python function as SQL function on the writer connection and on the connections of the read
+        pool, including the ones opened later on. Register functions during startup, before the read pool is used.
+        :param name: The name of the function in SQL.
+        :param func: The Python function.
+        :param nargs: The number of arguments of the function, -1 for any number.
+        """
+        with self._cursor_lock:
+            self._scalar_functions[name] = (func, nargs)
+            connections = [self._connection] + self._read_connections
+
+        for connection in connections:
+            connection.createscalarfunction(name, func, nargs)
+
     def get_cursor(self):
         thread_name = currentThread().getName()
 
@@ -212,11 +322,15 @@ class SQLiteCacheDB(TaskManager):
         if self._should_commit and isInIOThread():
             try:
                 self._logger.info(u"Start committing...")
+                # flush the write queue first so its time is not accounted to the COMMIT
+                self._flush_write_queue()
+                start_time = time()
                 self.execute(u"COMMIT;")
             except:
                 self._logger.exception(u"COMMIT FAILED")
                 raise
             self._should_commit = False
+            self._on_committed(time() - start_time)
 
             if vacuum:
                 self._logger.info(u"Start vacuuming...")
@@ -246,10 +360,47 @@ class SQLiteCacheDB(TaskManager):
     def set_show_sql(self, switch):
         self._show_execute = switch
 
+    def set_profile_sql(self, switch, max_slow_queries=DEFAULT_MAX_SLOW_QUERIES):
+        """ Enables or disables the query profiler. Enabling it again discards the collected statistics. """
+        self._profiler = QueryProfiler(max_slow_queries) if switch else None
+
+    def get_query_profile(self):
+        """ Returns the statistics of the query profiler, or None if profiling is disabled. """
+        if self._profiler is not None:
+            return self._profiler.get_statistics()
+
+    def dump_query_profile(self, file_path=None):
+        """
+        Writes the statistics of the query profiler to a JSON file.
+        :param file_path: The file to write to, by default query_profile.json next to the database file.
+        :return: The path of the written file, or None if profiling is disabled.
+        """
+        if self._profiler is None:
+            return None
+
+        if file_path is None:
+            file_path = os.path.join(self.session.get_state_dir(), DB_DIR_NAME, QUERY_PROFILE_FILE_NAME)
+        self._profiler.dump(file_path)
+        return file_path
+
+    def _execute_profiled(self, cur, sql, args):
+        """ Executes sql on cur and records it in the query profiler. The rows are fetched right away to measure
+            the full cost of the statement, the returned iterator replaces the cursor.
+        """
+        start_time = time()
+        if args is None:
+            rows = list(cur.execute(sql))
+        else:
+            rows = list(cur.execute(sql, args))
+        self._profiler.record(sql, args, time() - start_time, len(rows), cur)
+        return iter(rows)
+
     # --------- generic functions -------------
 
     @blocking_call_on_reactor_thread
     def execute(self, sql, args=None):
+        # queued writes have to be applied first, otherwise this statement could read stale data
+        self._flush_write_queue()
         cur = self.get_cursor()
 
         if self._show_execute:
@@ -257,7 +408,9 @@ class SQLiteCacheDB(TaskManager):
             self._logger.info(u"===%s===\n%s\n-----\n%s\n======\n", thread_name, sql, args)
 
         try:
-            if args is None:
+            if self._profiler is not None:
+                return self._execute_profiled(cur, sql, args)
+            elif args is None:
                 return cur.execute(sql)
             else:
                 return cur.execute(sql, args)
@@ -277,17 +430,28 @@ class SQLiteCacheDB(TaskManager):
     def executemany(self, sql, args=None):
         self._should_commit = True
 
+        self._flush_write_queue()
         cur = self.get_cursor()
         if self._show_execute:
             thread_name = currentThread().getName()
             self._logger.info(u"===%s===\n%s\n-----\n%s\n======\n", thread_name, sql, args)
 
         try:
+            if self._profiler is not None and args is not None:
+                # the arguments may be a generator, keep them around for the profiler
+                args = list(args)
+
+            start_time = time()
             if args is None:
                 result = cur.executemany(sql)
             else:
                 result = cur.executemany(sql, args)
 
+            if self._profiler is not None:
+                rows = list(result)
+                self._profiler.record(sql, args[0] if args else None, time() - start_time, len(rows) or len(args or ()),
+                                      cur)
+                result = iter(rows)
             return result
 
         except Exception as msg:
@@ -297,28 +461,245 @@ class SQLiteCacheDB(TaskManager):
             raise msg
 
     def execute_read(self, sql, args=None):
+        if self._in_read_pool():
+            return iter(self._execute_read_in_pool(sql, args))
         return self.execute(sql, args)
 
     def execute_write(self, sql, args=None):
+        """ Queues a write statement, see _queue_writes.
+            Returns a Deferred that fires on the reactor thread once the write has been executed.
+        """
+        deferred = Deferred()
+        self._queue_writes(sql, [args if args is not None else ()], deferred)
+        return deferred
+
+    def executemany_write(self, sql, args_list):
+        """ Queues a write statement for every args in args_list, see _queue_writes.
+            Returns a Deferred that fires on the reactor thread once all the writes have been executed.
+        """
+        deferred = Deferred()
+        args_list = list(args_list)
+        if args_list:
+            self._queue_writes(sql, args_list, deferred)
+        else:
+            deferred.callback(None)
+        return deferred
+
+    # -------- Write Queue --------
+    @blocking_call_on_reactor_thread
+    def _queue_writes(self, sql, args_list, deferred):
+        """ Queues writes instead of executing them right away, so bursts of small writes from the handlers are
+            executed as a few executemany calls. The queue is flushed before any other statement is executed on
+            the writer connection, so the order of writes and read-your-writes are preserved.
+            The deferred fires when the writes have been executed, or errbacks when they failed. Either all or none
+            of the writes of one call are executed. A failed write is logged, and its failure is consumed after the
+            errbacks attached by the caller have run, so callers that do not care about the result can ignore the
+            deferred. It never fires before it is returned, unless the caller reads from the database first.
+        """
         self._should_commit = True
 
-        self.execute(sql, args)
+        if self._write_queue_rows + len(args_list) > WRITE_QUEUE_MAX_ROWS:
+            # a full queue is flushed before the new writes are added, so their deferred is not fired yet
+            self._flush_write_queue()
 
-    def insert_or_ignore(self, table_name, **argv):
-        if len(argv) == 1:
-            sql = u'INSERT OR IGNORE INTO %s (%s) VALUES (?);' % (table_name, argv.keys()[0])
+        if self._write_queue and self._write_queue[-1][0] == sql:
+            self._write_queue[-1][1].append((args_list, deferred))
         else:
-            questions = '?,' * len(argv)
-            sql = u'INSERT OR IGNORE INTO %s %s VALUES (%s);' % (table_name, tuple(argv.keys()), questions[:-1])
-        self.execute_write(sql, argv.values())
+            self._write_queue.append([sql, [(args_list, deferred)]])
+
+        self._write_queue_rows += len(args_list)
+        self._write_stats[u"queued_rows"] += len(args_list)
+        self._write_stats[u"max_queue_rows"] = max(self._write_stats[u"max_queue_rows"], self._write_queue_rows)
+
+        if self._flush_call is None or not self._flush_call.active():
+            self._flush_call = self.register_task(u"flush write queue",
+                                                  reactor.callLater(WRITE_QUEUE_MAX_DELAY, self._flush_write_queue))
+
+    def _flush_write_queue(self):
+        if not self._write_queue:
+            return
+
+        write_queue, self._write_queue = self._write_queue, []
+        nr_rows, self._write_queue_rows = self._write_queue_rows, 0
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+
+        cur = self.get_cursor()
+        results = []
+        for sql, writes in write_queue:
+            args_list = [args for caller_args_list, _ in writes for args in caller_args_list]
+            if self._show_execute:
+                thread_name = currentThread().getName()
+                self._logger.info(u"===%s===\n%s\n-----\n%s\n======\n", thread_name, sql, args_list)
+
+            start_time = time()
+            try:
+                self._execute_writes(cur, sql, args_list)
+                results.extend((deferred, None) for _, deferred in writes)
+            except Exception:
+                if len(writes) == 1:
+                    results.append((writes[0][1], self._on_write_failed(sql, args_list)))
+                else:
+                    # the writes of several calls were merged, retry them one call at a time so the error only
+                    # affects the call that caused it
+                    for caller_args_list, deferred in writes:
+                        try:
+                            self._execute_writes(cur, sql, caller_args_list)
+                            results.append((deferred, None))
+                        except Exception:
+                            results.append((deferred, self._on_write_failed(sql, caller_args_list)))
+
+            elapsed = time() - start_time
+            if sql in self._shape_write_sql:
+                # the calls of insert, update and delete only queue their writes, so they are timed here
+                self._record_shape_call(sql, elapsed, len(writes))
+            if self._profiler is not None:
+                self._profiler.record(sql, args_list[0], elapsed, len(args_list), cur)
+
+        self._write_stats[u"flushes"] += 1
+        self._write_stats[u"flushed_rows"] += nr_rows
+        self._write_stats[u"flushed_statements"] += len(write_queue)
+
+        self._uncommitted_rows += nr_rows
+        if self._connection.getautocommit():
+            # no transaction is open (yet), the writes have been committed already
+            self._uncommitted_rows = 0
+        elif self._commit_call is None or not self._commit_call.active():
+            delay = 0 if self._uncommitted_rows >= COMMIT_MAX_ROWS else COMMIT_MAX_DELAY
+            self._commit_call = self.register_task(u"commit write queue", reactor.callLater(delay, self.commit_now))
+        elif self._uncommitted_rows >= COMMIT_MAX_ROWS:
+            self._commit_call.reset(0)
+
+        # the callbacks may queue new writes, so they are fired once the queue is in a consistent state
+        for deferred, failure in results:
+            if failure is None:
+                deferred.callback(None)
+            else:
+                deferred.errback(failure)
+                # the error has been logged by _on_write_failed already
+                deferred.addErrback(lambda _: None)
+
+    @staticmethod
+    def _execute_writes(cur, sql, args_list):
+        """ Executes a queued statement for every args in args_list within a savepoint, so either all or none of
+            the rows are written.
+        """
+        cur.execute(u"SAVEPOINT write_queue")
+        try:
+            if len(args_list) == 1:
+                cur.execute(sql, args_list[0])
+            else:
+                cur.executemany(sql, args_list)
+        except Exception:
+            cur.execute(u"ROLLBACK TO write_queue")
+            cur.execute(u"RELEASE write_queue")
+            raise
+        cur.execute(u"RELEASE write_queue")
+
+    def _on_write_failed(self, sql, args_list):
+        """ Logs the error of a queued write, must be called from an except block.
+            Returns the Failure that is passed to the caller of the write.
+        """
+        thread_name = currentThread().getName()
+        self._logger.exception(u"cachedb: failed to flush queued write ===%s===\n%s\n-----\n%s\n======\n",
+                               thread_name, sql, args_list)
+        return Failure()
+
+    def _on_committed(self, commit_time):
+        if self._commit_call is not None and self._commit_call.active():
+            self._commit_call.cancel()
+        self._commit_call = None
+
+        self._write_stats[u"commits"] += 1
+        self._write_stats[u"committed_rows"] += self._uncommitted_rows
+        self._write_stats[u"commit_time"] += commit_time
+        self._write_stats[u"max_commit_time"] = max(self._write_stats[u"max_commit_time"], commit_time)
+        self._uncommitted_rows = 0
+
+    def get_write_statistics(self):
+        """
+        Returns the statistics of the write queue.
+        :return: A dictionary with the counters of the write queue, the current queue depth and the average
+        number of rows per flush and the average commit time.
+        """
+        stats = dict(self._write_stats)
+        stats[u"queue_rows"] = self._write_queue_rows
+        stats[u"uncommitted_rows"] = self._uncommitted_rows
+        stats[u"avg_flush_rows"] = float(stats[u"flushed_rows"]) / stats[u"flushes"] if stats[u"flushes"] else 0.0
+        stats[u"avg_commit_time"] = stats[u"commit_time"] / stats[u"commits"] if stats[u"commits"] else 0.0
+        return stats
+
+    # -------- Query Shapes --------
+    def _get_sql_for_shape(self, shape, build_sql, is_write=False):
+        """ Returns the SQL of a generic helper call with the given shape, building it with build_sql only the
+            first time the shape is seen. The SQL of a shape only contains placeholders, so APSW can reuse its
+            prepared statement as well.
+        """
+        sql = self._shape_sql.get(shape)
+        if sql is None:
+            sql = build_sql()
+            if len(self._shape_sql) < MAX_QUERY_SHAPES:
+                self._shape_sql[shape] = sql
+                if is_write:
+                    self._shape_write_sql.add(sql)
+        return sql
+
+    def _record_shape_call(self, sql, elapsed, nr_calls=1):
+        with self._shape_lock:
+            shape_stats = self._shape_stats.get(sql)
+            if shape_stats is None:
+                if len(self._shape_stats) >= MAX_QUERY_SHAPES:
+                    return
+                shape_stats = self._shape_stats[sql] = [0, 0.0]
+            shape_stats[0] += nr_calls
+            shape_stats[1] += elapsed
+
+    def get_query_shape_statistics(self):
+        """
+        Returns the statistics of the SQL shapes generated by getOne, getAll, insert, update and delete. The calls
+        of insert, update and delete are counted and timed when their queued writes are executed.
+        :return: A list of (sql, number of calls, cumulative time) tuples, sorted by cumulative time.
+        """
+        with self._shape_lock:
+            shape_stats = [(sql, count, total_time) for sql, (count, total_time) in self._shape_stats.iteritems()]
+        return sorted(shape_stats, key=lambda shape_stat: shape_stat[2], reverse=True)
+
+    @staticmethod
+    def _to_names(names):
+        return u",".join(names) if isinstance(names, (tuple, list)) else names
+
+    @staticmethod
+    def _split_kw(kw):
+        """ Splits the keyword arguments of a helper call into a hashable shape and the matching arguments.
+            The keys are sorted, so the same keys always result in the same SQL, regardless of the dict order.
+        """
+        kw_shape = []
+        args = []
+        for key in sorted(kw):
+            value = kw[key]
+            if isinstance(value, tuple):
+                kw_shape.append((key, value[0]))
+                args.append(value[1])
+            else:
+                kw_shape.append((key, None))
+                args.append(value)
+        return tuple(kw_shape), args
+
+    def _insert(self, verb, table_name, argv):
+        keys = tuple(sorted(argv))
+
+        def build_sql():
+            return u'%s INTO %s (%s) VALUES (%s);' % (verb, table_name, u",".join(keys), u",".join(u"?" * len(keys)))
+
+        sql = self._get_sql_for_shape((verb, table_name, keys), build_sql, is_write=True)
+        self.execute_write(sql, [argv[key] for key in keys])
+
+    def insert_or_ignore(self, table_name, **argv):
+        self._insert(u"INSERT OR IGNORE", table_name, argv)
 
     def insert(self, table_name, **argv):
-        if len(argv) == 1:
-            sql = u'INSERT INTO %s (%s) VALUES (?);' % (table_name, argv.keys()[0])
-        else:
-            questions = '?,' * len(argv)
-            sql = u'INSERT INTO %s %s VALUES (%s);' % (table_name, tuple(argv.keys()), questions[:-1])
-        self.execute_write(sql, argv.values())
+        self._insert(u"INSERT", table_name, argv)
 
     # TODO: may remove this, only used by test_sqlitecachedb.py
     def insertMany(self, table_name, values, keys=None):
@@ -331,35 +712,36 @@ class SQLiteCacheDB(TaskManager):
             sql = u'INSERT INTO %s %s VALUES (%s);' % (table_name, tuple(keys), questions[:-1])
         self.executemany(sql, values)
 
-    def update(self, table_name, where=None, **argv):
+    def update(self, table_name, where=None, where_args=None, **argv):
+        """ Updates the columns given as keyword arguments of the rows matching where.
+            where should use placeholders with where_args for its values, so all calls share the same SQL.
+        """
         assert len(argv) > 0, 'NO VALUES TO UPDATE SPECIFIED'
         if len(argv) > 0:
-            sql = u'UPDATE %s SET ' % table_name
-            arg = []
-            for k, v in argv.iteritems():
-                if isinstance(v, tuple):
-                    sql += u'%s %s ?,' % (k, v[0])
-                    arg.append(v[1])
-                else:
-                    sql += u'%s=?,' % k
-                    arg.append(v)
-            sql = sql[:-1]
-            if where is not None:
-                sql += u' WHERE %s' % where
+            kw_shape, arg = self._split_kw(argv)
+
+            def build_sql():
+                sql = u'UPDATE %s SET ' % table_name
+                sql += u','.join(u'%s %s ?' % (k, operator) if operator else u'%s=?' % k
+                                 for k, operator in kw_shape)
+                if where is not None:
+                    sql += u' WHERE %s' % where
+                return sql
+
+            sql = self._get_sql_for_shape((u"UPDATE", table_name, where, kw_shape), build_sql, is_write=True)
+            if where_args:
+                arg.extend(where_args)
             self.execute_write(sql, arg)
 
     def delete(self, table_name, **argv):
-        sql = u'DELETE FROM %s WHERE ' % table_name
-        arg = []
-        for k, v in argv.iteritems():
-            if isinstance(v, tuple):
-                sql += u'%s %s ? AND ' % (k, v[0])
-                arg.append(v[1])
-            else:
-                sql += u'%s=? AND ' % k
-                arg.append(v)
-        sql = sql[:-5]
-        self.execute_write(sql, argv.values())
+        kw_shape, arg = self._split_kw(argv)
+
+        def build_sql():
+            return u'DELETE FROM %s WHERE ' % table_name + u' AND '.join(
+                u'%s %s ?' % (k, operator) if operator else u'%s=?' % k for k, operator in kw_shape)
+
+        sql = self._get_sql_for_shape((u"DELETE", table_name, kw_shape), build_sql, is_write=True)
+        self.execute_write(sql, arg)
 
     # -------- Read Operations --------
     def size(self, table_name):
@@ -367,27 +749,25 @@ class SQLiteCacheDB(TaskManager):
         result = self.fetchone(num_rec_sql)
         return result
 
-    @blocking_call_on_reactor_thread
     def fetchone(self, sql, args=None):
+        if self._in_read_pool():
+            return self._first_row(sql, self._execute_read_in_pool(sql, args))
+        return self._fetchone_on_reactor(sql, args)
+
+    @blocking_call_on_reactor_thread
+    def _fetchone_on_reactor(self, sql, args=None):
         find = self.execute_read(sql, args)
         if not find:
             return
-        else:
-            find = list(find)
-            if len(find) > 0:
-                if len(find) > 1:
-                    self._logger.debug(
-                        u"FetchONE resulted in many more rows than one, consider putting a LIMIT 1 in the sql statement %s, %s", sql, len(find))
-                find = find[0]
-            else:
-                return
-        if len(find) > 1:
-            return find
-        else:
-            return find[0]
+        return self._first_row(sql, list(find))
 
-    @blocking_call_on_reactor_thread
     def fetchall(self, sql, args=None):
+        if self._in_read_pool():
+            return self._execute_read_in_pool(sql, args)
+        return self._fetchall_on_reactor(sql, args)
+
+    @blocking_call_on_reactor_thread
+    def _fetchall_on_reactor(self, sql, args=None):
         res = self.execute_read(sql, args)
         if res is not None:
             find = list(res)
@@ -395,48 +775,102 @@ class SQLiteCacheDB(TaskManager):
         else:
             return []  # should it return None?
 
-    def getOne(self, table_name, value_name, where=None, conj=u"AND", **kw):
-        """ value_name could be a string, a tuple of strings, or '*'
-        """
-        if isinstance(value_name, tuple):
-            value_names = u",".join(value_name)
-        elif isinstance(value_name, list):
-            value_names = u",".join(value_name)
+    def _first_row(self, sql, rows):
+        if len(rows) > 0:
+            if len(rows) > 1:
+                self._logger.debug(
+                    u"FetchONE resulted in many more rows than one, consider putting a LIMIT 1 in the sql statement %s, %s", sql, len(rows))
+            find = rows[0]
         else:
-            value_names = value_name
-
-        if isinstance(table_name, tuple):
-            table_names = u",".join(table_name)
-        elif isinstance(table_name, list):
-            table_names = u",".join(table_name)
+            return
+        if len(find) > 1:
+            return find
         else:
-            table_names = table_name
+            return find[0]
+
+    # -------- Asynchronous Read Operations --------
+    def run_read_async(self, func, *args, **kwargs):
+        """ Calls func(*args, **kwargs) on the read pool and returns a Deferred that fires with its result.
+            While func runs, execute_read, fetchone and fetchall (and thus getOne and getAll) are served by the
+            read-only connection of the pool thread instead of the writer connection on the reactor thread.
+            Therefore func should only read from the database, and it only sees committed data.
+        """
+        if self._read_threadpool is None:
+            return maybeDeferred(func, *args, **kwargs)
+        return deferToThreadPool(reactor, self._read_threadpool, self._call_in_read_pool, func, *args, **kwargs)
+
+    def _call_in_read_pool(self, func, *args, **kwargs):
+        self._read_local.active = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._read_local.active = False
+
+    def _in_read_pool(self):
+        return getattr(self._read_local, 'active', False)
+
+    def _execute_read_in_pool(self, sql, args=None):
+        cur = self._get_read_cursor()
+
+        if self._show_execute:
+            thread_name = currentThread().getName()
+            self._logger.info(u"===%s===\n%s\n-----\n%s\n======\n", thread_name, sql, args)
+
+        try:
+            if self._profiler is not None:
+                return list(self._execute_profiled(cur, sql, args))
+            elif args is None:
+                return list(cur.execute(sql))
+            else:
+                return list(cur.execute(sql, args))
+
+        except Exception as msg:
+            thread_name = currentThread().getName()
+            self._logger.exception(u"cachedb: ===%s===\nSQL Type: %s\n-----\n%s\n-----\n%s\n======\n",
+                                   thread_name, type(sql), sql, args)
+            raise msg
+
+    def fetchall_async(self, sql, args=None):
+        """ Runs a read-only query on the read pool.
+            Returns a Deferred that fires with the list of resulting rows.
+        """
+        return self.run_read_async(self.fetchall, sql, args)
+
+    def fetchone_async(self, sql, args=None):
+        """ Runs a read-only query on the read pool.
+            Returns a Deferred that fires with the same result fetchone would return.
+        """
+        return self.run_read_async(self.fetchone, sql, args)
 
-        sql = u'SELECT %s FROM %s' % (value_names, table_names)
+    def _build_select(self, table_name, value_name, where, conj, kw_shape):
+        sql = u'SELECT %s FROM %s' % (self._to_names(value_name), self._to_names(table_name))
 
-        if where or kw:
+        if where or kw_shape:
             sql += u' WHERE '
         if where:
             sql += where
-            if kw:
+            if kw_shape:
                 sql += u' %s ' % conj
-        if kw:
-            arg = []
-            for k, v in kw.iteritems():
-                if isinstance(v, tuple):
-                    operator = v[0]
-                    arg.append(v[1])
-                else:
-                    operator = "="
-                    arg.append(v)
-                sql += u' %s %s ? ' % (k, operator)
-                sql += conj
-            sql = sql[:-len(conj)]
-        else:
-            arg = None
+        if kw_shape:
+            sql += (u' %s ' % conj).join(u'%s %s ?' % (k, operator or u"=") for k, operator in kw_shape)
+        return sql
+
+    def getOne(self, table_name, value_name, where=None, conj=u"AND", **kw):
+        """ value_name could be a string, a tuple of strings, or '*'
+        """
+        start_time = time()
+        kw_shape, arg = self._split_kw(kw)
+
+        def build_sql():
+            return self._build_select(table_name, value_name, where, conj, kw_shape)
+
+        shape = (u"getOne", self._to_names(table_name), self._to_names(value_name), where, conj, kw_shape)
+        sql = self._get_sql_for_shape(shape, build_sql)
 
         # print >> sys.stderr, 'SQL: %s %s' % (sql, arg)
-        return self.fetchone(sql, arg)
+        result = self.fetchone(sql, arg or None)
+        self._record_shape_call(sql, time() - start_time)
+        return result
 
     def getAll(self, table_name, value_name, where=None, group_by=None, having=None, order_by=None, limit=None,
                offset=None, conj=u"AND", **kw):
@@ -444,58 +878,37 @@ class SQLiteCacheDB(TaskManager):
             order by is represented as order_by
             group by is represented as group_by
         """
-        if isinstance(value_name, tuple):
-            value_names = u",".join(value_name)
-        elif isinstance(value_name, list):
-            value_names = u",".join(value_name)
-        else:
-            value_names = value_name
-
-        if isinstance(table_name, tuple):
-            table_names = u",".join(table_name)
-        elif isinstance(table_name, list):
-            table_names = u",".join(table_name)
-        else:
-            table_names = table_name
-
-        sql = u'SELECT %s FROM %s' % (value_names, table_names)
+        start_time = time()
+        kw_shape, arg = self._split_kw(kw)
+
+        def build_sql():
+            sql = self._build_select(table_name, value_name, where, conj, kw_shape)
+            if group_by is not None:
+                sql += u' GROUP BY ' + group_by
+            if having is not None:
+                sql += u' HAVING ' + having
+            if order_by is not None:
+                # you should add desc after order_by to reversely sort, i.e, 'last_seen desc' as order_by
+                sql += u' ORDER BY ' + order_by
+            if limit is not None:
+                sql += u' LIMIT ?'
+            if offset is not None:
+                sql += u' OFFSET ?'
+            return sql
+
+        shape = (u"getAll", self._to_names(table_name), self._to_names(value_name), where, conj, kw_shape,
+                 group_by, having, order_by, limit is not None, offset is not None)
+        sql = self._get_sql_for_shape(shape, build_sql)
 
-        if where or kw:
-            sql += u' WHERE '
-        if where:
-            sql += where
-            if kw:
-                sql += u' %s ' % conj
-        if kw:
-            arg = []
-            for k, v in kw.iteritems():
-                if isinstance(v, tuple):
-                    operator = v[0]
-                    arg.append(v[1])
-                else:
-                    operator = u"="
-                    arg.append(v)
-
-                sql += u' %s %s ?' % (k, operator)
-                sql += conj
-            sql = sql[:-len(conj)]
-        else:
-            arg = None
-
-        if group_by is not None:
-            sql += u' GROUP BY ' + group_by
-        if having is not None:
-            sql += u' HAVING ' + having
-        if order_by is not None:
-            # you should add desc after order_by to reversely sort, i.e, 'last_seen desc' as order_by
-            sql += u' ORDER BY ' + order_by
         if limit is not None:
-            sql += u' LIMIT %d' % limit
+            arg.append(limit)
         if offset is not None:
-            sql += u' OFFSET %d' % offset
+            arg.append(offset)
 
         try:
-            return self.fetchall(sql, arg) or []
+            result = self.fetchall(sql, arg or None) or []
         except Exception as msg:
             self._logger.exception(u"Wrong getAll sql statement: %s", sql)
             raise Exception(msg)
+        self._record_shape_call(sql, time() - start_time)
+        return result
@@ -22,6 +22,30 @@ from Tribler.Core.simpledefs import (DLSTATUS_WAITING4HASHCHECK, DLSTATUS_HASHCH
                                      UPLOAD, DOWNLOAD, DLMODE_NORMAL, PERSISTENTSTATE_CURRENTVERSION, dlstatus_strings)
 
 
+# alert type name -> name of the method handling it, alerts of other types are ignored
+_ALERT_HANDLER_NAMES = {'tracker_reply_alert': 'on_tracker_reply_alert',
+                        'tracker_error_alert': 'on_tracker_error_alert',
+                        'tracker_warning_alert': 'on_tracker_warning_alert',
+                        'metadata_received_alert': 'on_metadata_received_alert',
+                        'file_renamed_alert': 'on_file_renamed_alert',
+                        'performance_alert': 'on_performance_alert',
+                        'torrent_checked_alert': 'on_torrent_checked_alert',
+                        'torrent_finished_alert': 'on_torrent_finished_alert',
+                        'save_resume_data_alert': 'on_save_resume_data_alert',
+                        'save_resume_data_failed_alert': 'on_save_resume_data_failed_alert',
+                        # alerts after which the status of the download has to be refreshed right away
+                        'state_changed_alert': 'on_status_alert',
+                        'torrent_paused_alert': 'on_status_alert',
+                        'torrent_resumed_alert': 'on_status_alert',
+                        'torrent_error_alert': 'on_status_alert',
+                        'file_error_alert': 'on_status_alert',
+                        'storage_moved_alert': 'on_status_alert'}
+
+# the same table keyed by alert class, skipping alerts the libtorrent bindings do not expose
+ALERT_HANDLERS = dict((getattr(lt, alert_type), handler_name)
+                      for alert_type, handler_name in _ALERT_HANDLER_NAMES.iteritems() if hasattr(lt, alert_type))
+
+
 if sys.platform == "win32":
     try:
         import ctypes
@@ -118,6 +142,8 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
         self.dlstates = [DLSTATUS_WAITING4HASHCHECK, DLSTATUS_HASHCHECKING, DLSTATUS_METADATA, DLSTATUS_DOWNLOADING,
                          DLSTATUS_SEEDING, DLSTATUS_SEEDING, DLSTATUS_ALLOCATING_DISKSPACE, DLSTATUS_HASHCHECKING]
         self.dlstate = DLSTATUS_WAITING4HASHCHECK
+        # the last torrent_status received from libtorrent, refreshed through LibtorrentMgr's batched state updates
+        self.lt_status = None
         self.length = 0
         self.progress = 0.0
         self.bufferprogress = 0.0
@@ -138,6 +164,11 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
         self.max_prebuffsize = 5 * 1024 * 1024
 
         self.pstate_for_restart = None
+        # the last resume data received from libtorrent, and whether a save_resume_data request is outstanding
+        self.resume_data = None
+        self.resume_data_pending = False
+        # the state of the download at its last checkpoint, see need_checkpoint
+        self._checkpoint_key = None
 
         self.cew_scheduled = False
         self.askmoreinfo = False
@@ -255,12 +286,14 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
             has_resume_data = resume_data and isinstance(resume_data, dict)
             if has_resume_data:
                 atp["resume_data"] = lt.bencode(resume_data)
+                self.resume_data = resume_data
             self._logger.info("%s %s", self.tdef.get_name_as_unicode(), dict((k, v)
                               for k, v in resume_data.iteritems() if k not in ['pieces', 'piece_priority', 'peers']) if has_resume_data else None)
         else:
             atp["url"] = self.tdef.get_url() or "magnet:?xt=urn:btih:" + hexlify(self.tdef.get_infohash())
             atp["name"] = self.tdef.get_name_as_unicode()
 
+        self.lt_status = None
         self.handle = self.ltmgr.add_torrent(self, atp)
 
         if self.handle:
@@ -419,13 +452,13 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
         if alert.category() in [lt.alert.category_t.error_notification, lt.alert.category_t.performance_warning]:
             self._logger.debug("LibtorrentDownloadImpl: alert %s with message %s", alert_type, alert)
 
-        alert_types = ('tracker_reply_alert', 'tracker_error_alert', 'tracker_warning_alert', 'metadata_received_alert',
-                       'file_renamed_alert', 'performance_alert', 'torrent_checked_alert', 'torrent_finished_alert')
+        handler_name = ALERT_HANDLERS.get(type(alert))
+        if handler_name:
+            getattr(self, handler_name)(alert)
 
-        if alert_type in alert_types:
-            getattr(self, 'on_' + alert_type)(alert)
-        else:
-            self.update_lt_stats()
+    @checkHandleAndSynchronize()
+    def process_state_update(self, status):
+        self.update_lt_stats(status)
 
     def on_tracker_reply_alert(self, alert):
         self.tracker_status[alert.url] = [alert.num_peers, 'Working']
@@ -471,6 +504,24 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
 
         self.checkpoint()
 
+    def on_save_resume_data_alert(self, alert):
+        self.resume_data_pending = False
+        self.resume_data = alert.resume_data
+        if self.pstate_for_restart is not None:
+            self.pstate_for_restart.set('state', 'engineresumedata', self.resume_data)
+
+        (infohash, pstate) = self.network_checkpoint()
+        self.session.lm.save_download_pstate(infohash, pstate)
+
+    def on_save_resume_data_failed_alert(self, alert):
+        self.resume_data_pending = False
+        self._logger.warning("LibtorrentDownloadImpl: could not save resume data of %s: %s",
+                             self.tdef.get_name(), alert.message())
+
+        # still checkpoint the rest of the state, with the last known resume data
+        (infohash, pstate) = self.network_checkpoint()
+        self.session.lm.save_download_pstate(infohash, pstate)
+
     def on_file_renamed_alert(self, alert):
         if os.path.exists(self.unwanteddir_abs) and not os.listdir(self.unwanteddir_abs) and all(self.handle.file_priorities()):
             os.rmdir(self.unwanteddir_abs)
@@ -531,9 +582,19 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
                 self.set_byte_priority([(self.get_vod_fileindex(), 0, -1)], 1)
                 self.endbuffsize = 0
 
-    def update_lt_stats(self):
-        """ Update libtorrent stats and check if the download should be stopped."""
-        status = self.handle.status()
+    def on_status_alert(self, alert):
+        self.update_lt_stats()
+
+    def update_lt_stats(self, status=None):
+        """
+        Update libtorrent stats and check if the download should be stopped.
+        :param status: The torrent_status of the download from a state_update_alert, if None it is requested from
+        the torrent handle.
+        """
+        if status is None:
+            status = self.handle.status()
+        self.lt_status = status
+
         self.dlstate = self.dlstates[status.state] if not status.paused else DLSTATUS_STOPPED
         self.dlstate = DLSTATUS_STOPPED_ON_ERROR if self.dlstate == DLSTATUS_STOPPED and status.error else self.dlstate
         if self.get_mode() == DLMODE_VOD:
@@ -700,9 +761,16 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
         stats['vod'] = self.get_mode()
         stats['vod_playable'] = self.progress == 1.0 or (
             stats['vod_prebuf_frac'] == 1.0 and self.curspeeds[DOWNLOAD] > 0.0)
-        stats['vod_stats'] = self.network_get_vod_stats()
-        stats['spew'] = self.network_create_spew_from_peerlist() if getpeerlist or self.askmoreinfo else None
-        stats['tracker_status'] = self.network_tracker_status() if getpeerlist or self.askmoreinfo else None
+        stats['vod_stats'] = self.network_get_vod_stats() if stats['vod'] == DLMODE_VOD else None
+
+        # the peer list is only requested from libtorrent for the downloads the caller asked more info about, and
+        # shared by the spew and the tracker status
+        if getpeerlist or self.askmoreinfo:
+            peer_infos = self.handle.get_peer_info()
+            stats['spew'] = self.network_create_spew_from_peerlist(peer_infos)
+            stats['tracker_status'] = self.network_tracker_status(peer_infos)
+        else:
+            stats['spew'] = stats['tracker_status'] = None
 
         seeding_stats = {}
         seeding_stats['total_up'] = self.all_time_upload
@@ -719,7 +787,7 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
 
     @checkHandleAndSynchronize()
     def network_create_statistics_reponse(self):
-        status = self.handle.status()
+        status = self.lt_status or self.handle.status()
         numTotSeeds = status.num_complete if status.num_complete >= 0 else status.list_seeds
         numTotPeers = status.num_incomplete if status.num_incomplete >= 0 else status.list_peers
         numleech = status.num_peers - status.num_seeds
@@ -758,10 +826,11 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
         d['npieces'] = ((self.length + 1023) / 1024)
         return d
 
-    def network_create_spew_from_peerlist(self):
+    def network_create_spew_from_peerlist(self, peer_infos=None):
         plist = []
-        with self.dllock:
-            peer_infos = self.handle.get_peer_info()
+        if peer_infos is None:
+            with self.dllock:
+                peer_infos = self.handle.get_peer_info()
         for peer_info in peer_infos:
 
             # Only consider fully connected peers.
@@ -799,7 +868,7 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
         return plist
 
     @checkHandleAndSynchronize()
-    def network_tracker_status(self):
+    def network_tracker_status(self, peer_infos=None):
         # Make sure all trackers are in the tracker_status dict
         for announce_entry in self.handle.trackers():
             if announce_entry['url'] not in self.tracker_status:
@@ -811,7 +880,7 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
 
         # Count DHT and PeX peers
         dht_peers = pex_peers = 0
-        for peer_info in self.handle.get_peer_info():
+        for peer_info in (self.handle.get_peer_info() if peer_infos is None else peer_infos):
             if peer_info.source & peer_info.dht:
                 dht_peers += 1
             if peer_info.source & peer_info.pex:
@@ -888,7 +957,9 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
                 else:
                     self.set_vod_mode(False)
                     self.handle.pause()
-                    pstate.set('state', 'engineresumedata', self.handle.save_resume_data()
+                    # the pstate is checkpointed again once the up to date resume data arrives
+                    self.save_resume_data()
+                    pstate.set('state', 'engineresumedata', self.resume_data
                                if isinstance(self.tdef, TorrentDef) else None)
                 self.pstate_for_restart = pstate
             else:
@@ -959,9 +1030,36 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
 
     def checkpoint(self):
         """ Called by any thread """
-        (infohash, pstate) = self.network_checkpoint()
-        checkpoint = lambda: self.session.lm.save_download_pstate(infohash, pstate)
-        self.session.lm.threadpool.add_task(checkpoint, 0)
+        # a running download is checkpointed when its resume data arrives
+        if not self.save_resume_data():
+            (infohash, pstate) = self.network_checkpoint()
+            self.session.lm.save_download_pstate(infohash, pstate)
+
+    @checkHandleAndSynchronize(False)
+    def save_resume_data(self):
+        """
+        Asks libtorrent for the resume data of the download. The download is checkpointed when the
+        save_resume_data_alert arrives.
+        :return: True if the resume data was requested, False otherwise.
+        """
+        if isinstance(self.tdef, TorrentDef):
+            self.handle.save_resume_data()
+            self.resume_data_pending = True
+            return True
+        return False
+
+    def need_checkpoint(self):
+        """
+        Returns whether the state of the download changed since its last checkpoint.
+        """
+        with self.dllock:
+            if self.handle and self.handle.is_valid() and self.handle.need_save_resume_data():
+                return True
+            return self._checkpoint_key != self._get_checkpoint_key()
+
+    def _get_checkpoint_key(self):
+        config = [(section, self.dlconfig.items(section)) for section in self.dlconfig.sections()]
+        return (self.dlstate, self.progress, config)
 
     def network_checkpoint(self):
         """ Called by network thread """
@@ -972,8 +1070,9 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
                 if self.pstate_for_restart is not None:
                     resdata = self.pstate_for_restart.get('state', 'engineresumedata')
             elif isinstance(self.tdef, TorrentDef):
-                resdata = self.handle.save_resume_data()
+                resdata = self.resume_data
             pstate.set('state', 'engineresumedata', resdata)
+            self._checkpoint_key = self._get_checkpoint_key()
             return (self.tdef.get_infohash(), pstate)
 
     def network_get_persistent_state(self):
@@ -1,5 +1,6 @@
 # Written by Egbert Bouman
 import binascii
+import heapq
 import logging
 from urllib import url2pathname
 import tempfile
@@ -7,19 +8,21 @@ import threading
 import os
 import time
 from binascii import hexlify
-from copy import deepcopy
+from collections import defaultdict
+from itertools import count
 from shutil import rmtree
 
 from twisted.internet import reactor
 import libtorrent as lt
+from Tribler.Core.Libtorrent.metainfo_cache import MetainfoCache
 from Tribler.Core.Utilities.torrent_utils import get_info_from_handle
 from Tribler.Core.TorrentDef import TorrentDef, TorrentDefNoMetainfo
 
 from Tribler.Core.Utilities.utilities import parse_magnetlink, fix_torrent
 from Tribler.Core.Video.utils import videoextdefaults
 from Tribler.Core.exceptions import DuplicateDownloadException, TorrentFileException
-from Tribler.Core.simpledefs import (NTFY_INSERT, NTFY_MAGNET_CLOSE, NTFY_MAGNET_GOT_PEERS, NTFY_MAGNET_STARTED,
-                                     NTFY_REACHABLE, NTFY_TORRENTS)
+from Tribler.Core.simpledefs import (METAINFO_PRIORITY_DEFAULT, NTFY_INSERT, NTFY_MAGNET_CLOSE,
+                                     NTFY_MAGNET_GOT_PEERS, NTFY_MAGNET_STARTED, NTFY_REACHABLE, NTFY_TORRENTS)
 from Tribler.Core.version import version_id
 from Tribler.Main.globals import DefaultDownloadStartupConfig
 from Tribler.dispersy.taskmanager import LoopingCall, TaskManager
@@ -27,9 +30,19 @@ from Tribler.dispersy.util import blocking_call_on_reactor_thread, call_on_react
 
 
 LTSTATE_FILENAME = "lt.state"
-METAINFO_CACHE_PERIOD = 5 * 60
 DHT_CHECK_RETRIES = 1
 
+# the alert categories LibtorrentDownloadImpl has handlers for, the download states are kept up to date through
+# post_torrent_updates instead of stats alerts
+ALERT_MASK = lt.alert.category_t.error_notification | \
+    lt.alert.category_t.status_notification | \
+    lt.alert.category_t.storage_notification | \
+    lt.alert.category_t.performance_warning | \
+    lt.alert.category_t.tracker_notification
+
+# the maximum number of seconds to wait for outstanding resume data at shutdown
+RESUME_DATA_SHUTDOWN_TIMEOUT = 5
+
 
 class LibtorrentMgr(TaskManager):
 
@@ -54,7 +67,18 @@ class LibtorrentMgr(TaskManager):
         self.metadata_tmpdir = None
         self.metainfo_requests = {}
         self.metainfo_lock = threading.RLock()
-        self.metainfo_cache = {}
+        self.metainfo_cache = None
+
+        # requests waiting for a free slot, and a heap of (priority, sequence number, infohash) to take them from
+        self.max_metainfo_requests = trsession.get_libtorrent_max_metainfo_requests()
+        self.waiting_metainfo_requests = {}
+        self._metainfo_request_queue = []
+        self._metainfo_request_sequence = count()
+        self.metainfo_stats = {'requested': 0, 'started': 0, 'succeeded': 0, 'timed_out': 0, 'wait_time': 0.0}
+
+        # alert class -> alert type name, and alert type name -> number of alerts
+        self._alert_type_dict = {}
+        self.alert_counters = defaultdict(int)
 
     @blocking_call_on_reactor_thread
     def initialize(self):
@@ -64,6 +88,8 @@ class LibtorrentMgr(TaskManager):
         # make temporary directory for metadata collecting through DHT
         self.metadata_tmpdir = tempfile.mkdtemp(suffix=u'tribler_metainfo_tmpdir')
 
+        self.metainfo_cache = MetainfoCache(self.trsession.lm.torrent_store)
+
         # register tasks
         self.register_task(u'process_alerts', reactor.callLater(1, self._task_process_alerts))
         self.register_task(u'check_reachability', reactor.callLater(1, self._task_check_reachability))
@@ -76,6 +102,8 @@ class LibtorrentMgr(TaskManager):
     def shutdown(self):
         self.cancel_all_pending_tasks()
 
+        self._wait_for_resume_data()
+
         # remove all upnp mapping
         for upnp_handle in self.upnp_mapping_dict.itervalues():
             self.get_session().delete_port_mapping(upnp_handle)
@@ -98,6 +126,23 @@ class LibtorrentMgr(TaskManager):
 
         self.trsession = None
 
+    def _wait_for_resume_data(self, timeout=RESUME_DATA_SHUTDOWN_TIMEOUT):
+        """
+        Processes alerts until the resume data requested by the downloads arrived, so they are checkpointed with it,
+        or until the timeout passed.
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline and any(download.resume_data_pending
+                                             for download, _ in self.torrents.itervalues()):
+            for ltsession in self.ltsessions.itervalues():
+                if ltsession and ltsession.wait_for_alert(100):
+                    for alert in ltsession.pop_alerts():
+                        self.process_alert(alert)
+
+        nr_pending = sum(1 for download, _ in self.torrents.itervalues() if download.resume_data_pending)
+        if nr_pending:
+            self._logger.warning("shutting down without the resume data of %d torrents", nr_pending)
+
     def create_session(self, hops=0):
         settings = {}
 
@@ -131,12 +176,7 @@ class LibtorrentMgr(TaskManager):
             ltsession.add_extension(lt.create_smart_ban_plugin)
 
         ltsession.set_settings(settings)
-        ltsession.set_alert_mask(lt.alert.category_t.stats_notification |
-                                 lt.alert.category_t.error_notification |
-                                 lt.alert.category_t.status_notification |
-                                 lt.alert.category_t.storage_notification |
-                                 lt.alert.category_t.performance_warning |
-                                 lt.alert.category_t.tracker_notification)
+        ltsession.set_alert_mask(ALERT_MASK)
 
         # Load proxy settings
         if hops == 0:
@@ -262,9 +302,14 @@ class LibtorrentMgr(TaskManager):
 
             if infohash in self.metainfo_requests:
                 self._logger.info("killing get_metainfo request for %s", infohash)
-                handle = self.metainfo_requests.pop(infohash)['handle']
+                request_dict = self.metainfo_requests.pop(infohash)
+                handle = request_dict['handle']
                 if handle:
                     ltsession.remove_torrent(handle, 0)
+                self._call_timeout_callbacks(request_dict)
+                self._start_metainfo_requests()
+            if infohash in self.waiting_metainfo_requests:
+                self._call_timeout_callbacks(self.waiting_metainfo_requests.pop(infohash))
 
             handle = ltsession.add_torrent(encode_atp(atp))
             infohash = str(handle.info_hash())
@@ -306,26 +351,66 @@ class LibtorrentMgr(TaskManager):
             self._logger.warning("port mapping method not exposed in libtorrent")
 
     def process_alert(self, alert):
-        alert_type = str(type(alert)).split("'")[1].split(".")[-1]
+        alert_class = type(alert)
+        alert_type = self._alert_type_dict.get(alert_class)
+        if alert_type is None:
+            alert_type = self._alert_type_dict[alert_class] = alert_class.__name__
+        self.alert_counters[alert_type] += 1
+
+        if alert_class is lt.state_update_alert:
+            self._process_state_update(alert)
+            return
+
         handle = getattr(alert, 'handle', None)
         if handle:
-            if handle.is_valid():
-                infohash = str(handle.info_hash())
-                if infohash in self.torrents:
-                    self.torrents[infohash][0].process_alert(alert, alert_type)
-                elif infohash in self.metainfo_requests:
-                    if isinstance(alert, lt.metadata_received_alert):
-                        self.got_metainfo(infohash)
-                else:
-                    self._logger.debug("could not find torrent %s", infohash)
-            else:
+            infohash = self._get_infohash(handle)
+            if infohash is None:
                 self._logger.debug("alert for invalid torrent")
-
-    def get_metainfo(self, infohash_or_magnet, callback, timeout=30, timeout_callback=None, notify=True):
+            elif infohash in self.torrents:
+                self.torrents[infohash][0].process_alert(alert, alert_type)
+            elif infohash in self.metainfo_requests:
+                if alert_class is lt.metadata_received_alert:
+                    self.got_metainfo(infohash)
+            else:
+                self._logger.debug("could not find torrent %s", infohash)
+
+    def _process_state_update(self, alert):
+        """
+        Refreshes the downloads whose status changed since the previous call to post_torrent_updates.
+        """
+        for status in alert.status:
+            infohash = self._get_infohash(status.handle)
+            if infohash in self.torrents:
+                self.torrents[infohash][0].process_state_update(status)
+
+    @staticmethod
+    def _get_infohash(handle):
+        """
+        Returns the hex infohash of a torrent handle, or None if the handle is invalid.
+        """
+        return str(handle.info_hash()) if handle.is_valid() else None
+
+    def get_alert_stats(self):
+        """
+        Returns the number of alerts processed per alert type.
+        """
+        return dict(self.alert_counters)
+
+    def get_metainfo(self, infohash_or_magnet, callback, timeout=30, timeout_callback=None, notify=True,
+                     use_store=True, priority=METAINFO_PRIORITY_DEFAULT):
+        """
+        Retrieves the metainfo of a torrent from the cache, the torrent store or the swarm. At most
+        max_metainfo_requests torrents are fetched from the swarm at the same time, other requests wait in a queue
+        ordered by priority.
+        :param use_store: Whether the metainfo may come from the torrent store, in which case it has no swarm
+        information (initial peers, seeders and leechers).
+        :param priority: One of the METAINFO_PRIORITY constants.
+        """
         if not self.is_dht_ready() and timeout > 5:
             self._logger.info("DHT not ready, rescheduling get_metainfo")
             self.trsession.lm.threadpool.add_task(lambda i=infohash_or_magnet, c=callback, t=timeout - 5,
-                                                  tcb=timeout_callback, n=notify: self.get_metainfo(i, c, t, tcb, n), 5)
+                                                  tcb=timeout_callback, n=notify, s=use_store, p=priority:
+                                                  self.get_metainfo(i, c, t, tcb, n, s, p), 5)
             return
 
         magnet = infohash_or_magnet if infohash_or_magnet.startswith('magnet') else None
@@ -338,44 +423,125 @@ class LibtorrentMgr(TaskManager):
         with self.metainfo_lock:
             self._logger.debug('get_metainfo %s %s %s', infohash_or_magnet, callback, timeout)
 
-            cache_result = self._get_cached_metainfo(infohash)
+            cache_result = self.metainfo_cache.get(infohash, use_store=use_store)
             if cache_result:
-                self.trsession.lm.threadpool.call_in_thread(0, callback, deepcopy(cache_result))
-
-            elif infohash not in self.metainfo_requests:
-                # Flags = 4 (upload mode), should prevent libtorrent from creating files
-                atp = {'save_path': self.metadata_tmpdir, 'duplicate_is_error': True, 'paused': False,
-                       'auto_managed': False, 'upload_mode': True}
-                if magnet:
-                    atp['url'] = magnet
-                else:
-                    atp['info_hash'] = lt.big_number(infohash_bin)
-                try:
-                    handle = self.get_session().add_torrent(encode_atp(atp))
-                except TypeError as e:
-                    self._logger.warning("Failed to add torrent with infohash %s, "
-                                         "attempting to use it as it is and hoping for the best",
-                                         hexlify(infohash_bin))
-                    self._logger.warning("Error was: %s", e)
-                    atp['info_hash'] = infohash_bin
-                    handle = self.get_session().add_torrent(encode_atp(atp))
-
-                if notify:
-                    self.notifier.notify(NTFY_TORRENTS, NTFY_MAGNET_STARTED, infohash_bin)
-
-                self.metainfo_requests[infohash] = {'handle': handle,
-                                                    'callbacks': [callback],
-                                                    'timeout_callbacks': [timeout_callback] if timeout_callback else [],
-                                                    'notify': notify}
-                self.trsession.lm.threadpool.add_task(lambda: self.got_metainfo(infohash, timeout=True), timeout)
-
+                self.trsession.lm.threadpool.call_in_thread(0, callback, cache_result)
+                return
+
+            request_dict = self.metainfo_requests.get(infohash) or self.waiting_metainfo_requests.get(infohash)
+            if request_dict is None:
+                self.metainfo_stats['requested'] += 1
+                request_dict = {'magnet': magnet,
+                                'infohash_bin': infohash_bin,
+                                'timeout': timeout,
+                                'priority': priority,
+                                'time': time.time(),
+                                'callbacks': [callback],
+                                'timeout_callbacks': [timeout_callback] if timeout_callback else [],
+                                'notify': notify}
+                self.waiting_metainfo_requests[infohash] = request_dict
+                self._queue_metainfo_request(infohash, priority)
+                # a request does not wait for a free slot longer than its timeout
+                self.trsession.lm.threadpool.add_task(lambda: self._expire_metainfo_request(infohash, request_dict),
+                                                      timeout)
+                self._start_metainfo_requests()
+                return
+
+            request_dict['notify'] = request_dict['notify'] and notify
+            if timeout_callback and timeout_callback not in request_dict['timeout_callbacks']:
+                request_dict['timeout_callbacks'].append(timeout_callback)
+            if callback not in request_dict['callbacks']:
+                request_dict['callbacks'].append(callback)
             else:
-                self.metainfo_requests[infohash]['notify'] = self.metainfo_requests[infohash]['notify'] and notify
-                callbacks = self.metainfo_requests[infohash]['callbacks']
-                if callback not in callbacks:
-                    callbacks.append(callback)
-                else:
-                    self._logger.debug('get_metainfo duplicate detected, ignoring')
+                self._logger.debug('get_metainfo duplicate detected, ignoring')
+
+            # a waiting request moves up in the queue if it is requested with a higher priority
+            if infohash in self.waiting_metainfo_requests and priority < request_dict['priority']:
+                request_dict['priority'] = priority
+                self._queue_metainfo_request(infohash, priority)
+
+    def _queue_metainfo_request(self, infohash, priority):
+        # entries with an outdated priority are skipped when they are popped
+        heapq.heappush(self._metainfo_request_queue, (priority, next(self._metainfo_request_sequence), infohash))
+
+    def _start_metainfo_requests(self):
+        """
+        Starts fetching the metainfo of the most urgent waiting requests, as long as there are free slots.
+        """
+        with self.metainfo_lock:
+            while self._metainfo_request_queue and len(self.metainfo_requests) < self.max_metainfo_requests:
+                priority, _, infohash = heapq.heappop(self._metainfo_request_queue)
+                request_dict = self.waiting_metainfo_requests.get(infohash)
+                if request_dict is None or request_dict['priority'] != priority:
+                    continue
+
+                del self.waiting_metainfo_requests[infohash]
+                self._start_metainfo_request(infohash, request_dict)
+
+    def _expire_metainfo_request(self, infohash, request_dict):
+        """
+        Times out a request that is still waiting for a free slot.
+        """
+        with self.metainfo_lock:
+            if self.waiting_metainfo_requests.get(infohash) is not request_dict:
+                return
+
+            # the entry in the request queue is skipped when it is popped
+            del self.waiting_metainfo_requests[infohash]
+            self.metainfo_stats['timed_out'] += 1
+            self._call_timeout_callbacks(request_dict)
+
+    def _call_timeout_callbacks(self, request_dict):
+        for callback in request_dict['timeout_callbacks']:
+            self.trsession.lm.threadpool.call_in_thread(0, callback, request_dict['infohash_bin'])
+
+    def _start_metainfo_request(self, infohash, request_dict):
+        magnet = request_dict.pop('magnet')
+        infohash_bin = request_dict['infohash_bin']
+
+        # Flags = 4 (upload mode), should prevent libtorrent from creating files
+        atp = {'save_path': self.metadata_tmpdir, 'duplicate_is_error': True, 'paused': False,
+               'auto_managed': False, 'upload_mode': True}
+        if magnet:
+            atp['url'] = magnet
+        else:
+            atp['info_hash'] = lt.big_number(infohash_bin)
+        try:
+            handle = self.get_session().add_torrent(encode_atp(atp))
+        except TypeError as e:
+            self._logger.warning("Failed to add torrent with infohash %s, "
+                                 "attempting to use it as it is and hoping for the best",
+                                 hexlify(infohash_bin))
+            self._logger.warning("Error was: %s", e)
+            atp['info_hash'] = infohash_bin
+            handle = self.get_session().add_torrent(encode_atp(atp))
+
+        if request_dict['notify']:
+            self.notifier.notify(NTFY_TORRENTS, NTFY_MAGNET_STARTED, infohash_bin)
+
+        self.metainfo_stats['started'] += 1
+        self.metainfo_stats['wait_time'] += time.time() - request_dict['time']
+
+        request_dict['handle'] = handle
+        self.metainfo_requests[infohash] = request_dict
+        self.trsession.lm.threadpool.add_task(lambda: self.got_metainfo(infohash, timeout=True),
+                                              request_dict['timeout'])
+
+    def get_metainfo_stats(self):
+        """
+        Returns statistics about the metainfo requests.
+        :return: A dict with the number of requests, the number of running and waiting requests, the average time
+        requests waited for a free slot and the fraction of the finished requests that succeeded.
+        """
+        with self.metainfo_lock:
+            stats = dict(self.metainfo_stats)
+            stats['running'] = len(self.metainfo_requests)
+            stats['waiting'] = len(self.waiting_metainfo_requests)
+
+        finished = stats['succeeded'] + stats['timed_out']
+        stats['average_wait_time'] = stats['wait_time'] / stats['started'] if stats['started'] else 0.0
+        stats['success_rate'] = float(stats['succeeded']) / finished if finished else 0.0
+        return stats
 
     def got_metainfo(self, infohash, timeout=False):
         with self.metainfo_lock:
@@ -385,13 +551,17 @@ class LibtorrentMgr(TaskManager):
                 request_dict = self.metainfo_requests.pop(infohash)
                 handle = request_dict['handle']
                 callbacks = request_dict['callbacks']
-                timeout_callbacks = request_dict['timeout_callbacks']
                 notify = request_dict['notify']
 
                 self._logger.debug('got_metainfo %s %s %s', infohash, handle, timeout)
 
                 assert handle
                 if handle:
+                    if timeout:
+                        self.metainfo_stats['timed_out'] += 1
+                    else:
+                        self.metainfo_stats['succeeded'] += 1
+
                     if callbacks and not timeout:
                         metainfo = {"info": lt.bdecode(get_info_from_handle(handle).metadata())}
                         trackers = [tracker.url for tracker in get_info_from_handle(handle).trackers()]
@@ -417,46 +587,38 @@ class LibtorrentMgr(TaskManager):
                         metainfo["leechers"] = leechers
                         metainfo["seeders"] = seeders
 
-                        self._add_cached_metainfo(infohash, metainfo)
+                        metainfo_data = self.metainfo_cache.put(infohash, metainfo)
 
+                        # every callback gets its own copy, as TorrentDefs keep a reference to their metainfo
                         for callback in callbacks:
-                            self.trsession.lm.threadpool.call_in_thread(0, callback, deepcopy(metainfo))
+                            self.trsession.lm.threadpool.call_in_thread(0, callback, lt.bdecode(metainfo_data))
 
                         # let's not print the hashes of the pieces
-                        debuginfo = deepcopy(metainfo)
+                        debuginfo = dict(metainfo, info=dict(metainfo['info']))
                         del debuginfo['info']['pieces']
                         self._logger.debug('got_metainfo result %s', debuginfo)
 
-                    elif timeout_callbacks and timeout:
-                        for callback in timeout_callbacks:
-                            self.trsession.lm.threadpool.call_in_thread(0, callback, infohash_bin)
+                    elif timeout:
+                        self._call_timeout_callbacks(request_dict)
 
                 if handle:
                     self.get_session().remove_torrent(handle, 1)
                     if notify:
                         self.notifier.notify(NTFY_TORRENTS, NTFY_MAGNET_CLOSE, infohash_bin)
 
-    def _get_cached_metainfo(self, infohash):
-        if infohash in self.metainfo_cache:
-            return self.metainfo_cache[infohash]['meta_info']
-
-    def _add_cached_metainfo(self, infohash, metainfo):
-        self.metainfo_cache[infohash] = {'time': time.time(),
-                                         'meta_info': metainfo}
+                # a slot became available
+                self._start_metainfo_requests()
 
     def _task_cleanup_metainfo_cache(self):
-        oldest_time = time.time() - METAINFO_CACHE_PERIOD
-
-        for info_hash, values in self.metainfo_cache.items():
-            last_time, metainfo = values
-            if last_time < oldest_time:
-                del self.metainfo_cache[info_hash]
+        self.metainfo_cache.expire()
 
     def _task_process_alerts(self):
         for ltsession in self.ltsessions.itervalues():
             if ltsession:
                 for alert in ltsession.pop_alerts():
                     self.process_alert(alert)
+                # one state_update_alert with the status of all changed torrents, handled in the next round
+                ltsession.post_torrent_updates()
 
         self.register_task(u'process_alerts', reactor.callLater(1, self._task_process_alerts))
 
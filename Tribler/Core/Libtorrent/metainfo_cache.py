@@ -0,0 +1,116 @@
+import logging
+import time
+from collections import OrderedDict
+from threading import RLock
+
+import libtorrent as lt
+
+
+METAINFO_CACHE_PERIOD = 5 * 60  # swarm information (peers, seeders, leechers) is kept for this long
+METAINFO_CACHE_SIZE = 16 * 1024 * 1024  # the maximum size of the bencoded metainfo kept in memory
+
+
+class MetainfoCache(object):
+
+    """
+    LRU cache of the metainfo dictionaries retrieved by LibtorrentMgr, limited by their bencoded size. Entries are
+    stored bencoded, so they are immutable and can be shared, every lookup decodes a new dict. On a memory miss the
+    cache falls back on the torrent store, which it only reads from: torrents are added to the store through
+    RemoteTorrentHandler.save_torrent, which also adds them to the database. Torrents from the store come without
+    swarm information.
+    """
+
+    def __init__(self, torrent_store=None, max_size=METAINFO_CACHE_SIZE, expiration_time=METAINFO_CACHE_PERIOD):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._lock = RLock()
+
+        self._torrent_store = torrent_store
+        self._max_size = max_size
+        self._expiration_time = expiration_time
+
+        # hex infohash -> (insert time, bencoded metainfo), least recently used first
+        self._entries = OrderedDict()
+        self._size = 0
+
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, infohash):
+        return infohash in self._entries
+
+    @property
+    def size(self):
+        """
+        The total size of the bencoded metainfo in memory.
+        """
+        return self._size
+
+    def get(self, infohash, use_store=True):
+        """
+        Gets the metainfo of a torrent.
+        :param infohash: The hex infohash of the torrent.
+        :param use_store: Whether to look in the torrent store if the metainfo is not in memory.
+        :return: A new metainfo dict or None if the torrent is unknown.
+        """
+        with self._lock:
+            entry = self._entries.pop(infohash, None)
+            if entry is not None:
+                self._entries[infohash] = entry
+                self.hits += 1
+                return lt.bdecode(entry[1])
+
+            if use_store and self._torrent_store is not None:
+                torrent_data = self._torrent_store.get(infohash)
+                if torrent_data:
+                    self.store_hits += 1
+                    return lt.bdecode(torrent_data)
+
+            self.misses += 1
+            return None
+
+    def put(self, infohash, metainfo):
+        """
+        Adds the metainfo of a torrent to memory.
+        :param infohash: The hex infohash of the torrent.
+        :param metainfo: The metainfo dict.
+        :return: The bencoded metainfo.
+        """
+        data = lt.bencode(metainfo)
+
+        with self._lock:
+            self._remove(infohash)
+            if len(data) > self._max_size:
+                return data
+
+            self._entries[infohash] = (time.time(), data)
+            self._size += len(data)
+            while self._size > self._max_size:
+                self._remove(next(iter(self._entries)))
+
+        return data
+
+    def detach_torrent_store(self):
+        """
+        Stops using the torrent store, which has to be done before the store is closed.
+        """
+        with self._lock:
+            self._torrent_store = None
+
+    def expire(self):
+        """
+        Removes the entries with outdated swarm information from memory.
+        """
+        oldest_time = time.time() - self._expiration_time
+        with self._lock:
+            for infohash, (insert_time, _) in self._entries.items():
+                if insert_time < oldest_time:
+                    self._remove(infohash)
+
+    def _remove(self, infohash):
+        entry = self._entries.pop(infohash, None)
+        if entry is not None:
+            self._size -= len(entry[1])
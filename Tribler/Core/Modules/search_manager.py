@@ -86,11 +86,26 @@ class SearchManager(TaskManager):
         # (1) infohash, (2) name, (3) length, (4) num_files, (5) category, (6) creation_date, (7) num_seeders
         # (8) num_leechers, (9) channel_cid
 
+        # get and cache channels, the lookup runs on the database read pool
+        channel_cid_list = [result[-1] for result in results if result[-1] is not None]
+        deferred = self.channelcast_db.getChannelsByCID_async(channel_cid_list)
+        deferred.addCallback(self._process_torrent_search_results, keywords, results, candidate)
+        deferred.addErrback(lambda failure: self._logger.error("Failed to process torrent search results: %s",
+                                                               failure))
+
+    def _process_torrent_search_results(self, channel_cache_list, keywords, results, candidate):
+        """
+        Creates the result dictionaries of the torrent search results and notifies the listeners.
+        :param channel_cache_list: The channels of the search results, as returned by getChannelsByCID.
+        :param keywords: The keywords of the search.
+        :param results: The search results from SearchCommunity.
+        :param candidate: The candidate that sent the search results.
+        """
+        if self.session is None or keywords != self._current_keywords:
+            return
+
         remote_torrent_result_list = []
 
-        # get and cache channels
-        channel_cid_list = [result[-1] for result in results if result[-1] is not None]
-        channel_cache_list = self.channelcast_db.getChannelsByCID(channel_cid_list)
         channel_cache_dict = {}
         for channel in channel_cache_list:
             # index 1 is cid
@@ -24,10 +24,6 @@ class TrackerManager(object):
         # A "dead" tracker will be retired every this amount of time (in seconds)
         self._tracker_retry_interval = TRACKER_RETRY_INTERVAL
 
-        # we use round-robin for automatic tracker checking.
-        # this index points to the tracker we are going to check next.
-        self._tracker_check_idx = 0
-
     @blocking_call_on_reactor_thread
     def initialize(self):
         # load all tracker information into the memory
@@ -126,32 +122,3 @@ class TrackerManager(object):
         # this_interval = retry_interval * 2^failures
         next_check_time = tracker_info[u'last_check'] + self._tracker_retry_interval * (2**tracker_info[u'failures'])
         return next_check_time <= current_time
-
-    @call_on_reactor_thread
-    def get_next_tracker_for_auto_check(self):
-        """
-        Gets the next tracker for automatic tracker-checking.
-        :return: The next tracker for automatic tracker-checking.
-        """
-        if len(self._tracker_dict) == 0:
-            return
-
-        if self._tracker_check_idx >= len(self._tracker_dict):
-            self._tracker_dict = 0
-
-        next_tracker_url = None
-        next_tracker_info = None
-        for idx in xrange(self._tracker_check_idx, len(self._tracker_dict)):
-            tracker_url = self._tracker_dict.keys()[idx]
-            if tracker_url == u'DHT':
-                next_tracker_url = tracker_url
-                next_tracker_info = {u'is_alive': True, u'last_check': int(time.time())}
-                break
-            elif tracker_url != u'no-DHT' and self.should_check_tracker(tracker_url):
-                next_tracker_url = tracker_url
-                next_tracker_info = self._tracker_dict[next_tracker_url]
-                break
-
-        if next_tracker_url is None:
-            return
-        return next_tracker_url, next_tracker_info
@@ -16,7 +16,8 @@ from twisted.internet.task import LoopingCall
 
 from Tribler.Core.TFTP.handler import METADATA_PREFIX
 from Tribler.Core.TorrentDef import TorrentDef
-from Tribler.Core.simpledefs import INFOHASH_LENGTH, NTFY_TORRENTS
+from Tribler.Core.simpledefs import (INFOHASH_LENGTH, METAINFO_PRIORITY_BACKGROUND, METAINFO_PRIORITY_DEFAULT,
+                                     NTFY_TORRENTS)
 from Tribler.dispersy.taskmanager import TaskManager
 from Tribler.dispersy.util import call_on_reactor_thread
 
@@ -460,8 +461,10 @@ class MagnetRequester(Requester):
             self._logger.debug(u"requesting %s priority %s through magnet link %s",
                                infohash_str, self._priority, magnetlink)
 
+            priority = METAINFO_PRIORITY_DEFAULT if self._priority >= MAX_PRIORITY else METAINFO_PRIORITY_BACKGROUND
             self._session.lm.ltmgr.get_metainfo(magnetlink, self._success_callback,
-                                                timeout=self.TIMEOUT, timeout_callback=self._failure_callback)
+                                                timeout=self.TIMEOUT, timeout_callback=self._failure_callback,
+                                                priority=priority)
             self._running_requests.append(infohash)
 
     @call_on_reactor_thread
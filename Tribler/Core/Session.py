@@ -157,6 +157,7 @@ class Session(SessionConfigInterface):
 -        before we start everything else.
         """
         self.sqlite_db = SQLiteCacheDB(self)
+        self.sqlite_db.set_profile_sql(self.get_profile_sql())
         self.sqlite_db.initialize()
         self.sqlite_db.initial_begin()
         self.upgrader = TriblerUpgrader(self, self.sqlite_db)
@@ -444,6 +445,7 @@ class Session(SessionConfigInterface):
         self.checkpoint_shutdown(stop=True, checkpoint=checkpoint,
                                  gracetime=gracetime, hacksessconfcheckpoint=hacksessconfcheckpoint)
 
+        self.sqlite_db.dump_query_profile()
         self.sqlite_db.close()
         self.sqlite_db = None
 
@@ -264,6 +264,17 @@ class SessionConfigInterface(object):
         @return Boolean. """
         return self.sessconfig.get(u'general', u'megacache')
 
+    def set_profile_sql(self, value):
+        """ Enable the query profiler of the megacache database (default = False). The collected statistics are
+        written to query_profile.json in the database directory on shutdown.
+        @param value Boolean. """
+        self.sessconfig.set(u'general', u'profile_sql', value)
+
+    def get_profile_sql(self):
+        """ Returns whether the query profiler is enabled.
+        @return Boolean. """
+        return self.sessconfig.get(u'general', u'profile_sql')
+
     def set_libtorrent(self, value):
         """ Enable or disable LibTorrent (default = True).
         @param value Boolean.
@@ -330,6 +341,18 @@ class SessionConfigInterface(object):
         """
         return self.sessconfig.get(u'libtorrent', u'utp')
 
+    def set_libtorrent_max_metainfo_requests(self, value):
+        """ Sets the maximum number of torrents LibTorrent fetches the metainfo of at the same time (default = 50).
+        @param value Integer.
+        """
+        self.sessconfig.set(u'libtorrent', u'max_metainfo_requests', value)
+
+    def get_libtorrent_max_metainfo_requests(self):
+        """ Returns the maximum number of torrents LibTorrent fetches the metainfo of at the same time.
+        @return Integer.
+        """
+        return self.sessconfig.get(u'libtorrent', u'max_metainfo_requests')
+
     #
     # Torrent file store
     #
@@ -0,0 +1,167 @@
+import heapq
+import logging
+import math
+from itertools import count
+
+from Tribler.Core.TorrentChecker.session import MAX_TRACKER_MULTI_SCRAPE
+
+
+MAX_SCHEDULED_CHECKS = 5000  # the maximum number of (infohash, tracker) checks waiting in the queue
+MAX_ACTIVE_SESSIONS = 50  # the maximum number of tracker sessions running at the same time
+MAX_SESSIONS_PER_TRACKER = 2  # the maximum number of sessions running at the same time on one tracker
+MIN_TRACKER_SESSION_INTERVAL = 5  # the minimum number of seconds between starting two sessions on one tracker
+
+# a check moves this many seconds forward in the queue for every e-fold of peers the torrent had
+POPULARITY_BONUS = 600
+# and this many seconds backwards for every consecutive failure of its tracker
+TRACKER_FAILURE_PENALTY = 900
+
+
+class TorrentCheckScheduler(object):
+
+    """
+    Priority queue of (infohash, tracker) checks shared by all trackers. Checks are ordered by the time they are due,
+    moved forward for popular torrents and backwards for unreliable trackers. The checks are handed out in batches
+    of up to MAX_TRACKER_MULTI_SCRAPE infohashes per tracker, while limiting the number of sessions per tracker and
+    how often a tracker is contacted.
+    """
+
+    def __init__(self, max_scheduled_checks=MAX_SCHEDULED_CHECKS, max_active_sessions=MAX_ACTIVE_SESSIONS,
+                 max_sessions_per_tracker=MAX_SESSIONS_PER_TRACKER,
+                 min_tracker_session_interval=MIN_TRACKER_SESSION_INTERVAL):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._max_scheduled_checks = max_scheduled_checks
+        self._max_active_sessions = max_active_sessions
+        self._max_sessions_per_tracker = max_sessions_per_tracker
+        self._min_tracker_session_interval = min_tracker_session_interval
+
+        # min-heap of (priority, sequence number, infohash, tracker url)
+        self._check_heap = []
+        self._sequence = count()
+        # (infohash, tracker url) of the checks that are queued or running
+        self._scheduled_checks = set()
+
+        self._active_session_dict = {}
+        self._last_session_start_dict = {}
+
+    def __len__(self):
+        return len(self._check_heap)
+
+    @property
+    def nr_free_slots(self):
+        """
+        The number of checks that can still be added to the queue.
+        """
+        return max(self._max_scheduled_checks - len(self._check_heap), 0)
+
+    @property
+    def nr_active_sessions(self):
+        return sum(self._active_session_dict.itervalues())
+
+    @staticmethod
+    def get_priority(next_check, nr_peers, tracker_failures):
+        """
+        Calculates the priority of a check, lower is more urgent.
+        :param next_check: The time the torrent is due for a check.
+        :param nr_peers: The number of seeders and leechers the torrent had last time.
+        :param tracker_failures: The number of consecutive failures of the tracker.
+        :return: The priority.
+        """
+        return next_check - POPULARITY_BONUS * math.log1p(max(nr_peers, 0)) \
+            + TRACKER_FAILURE_PENALTY * tracker_failures
+
+    def add_check(self, infohash, tracker_url, priority):
+        """
+        Adds a check to the queue, unless it is already queued or running or the queue is full.
+        :return: True if the check was added, False otherwise.
+        """
+        key = (infohash, tracker_url)
+        if key in self._scheduled_checks or len(self._check_heap) >= self._max_scheduled_checks:
+            return False
+
+        heapq.heappush(self._check_heap, (priority, next(self._sequence), infohash, tracker_url))
+        self._scheduled_checks.add(key)
+        return True
+
+    def get_batches(self, current_time, can_check_tracker):
+        """
+        Takes the most urgent checks from the queue and groups them per tracker.
+        :param current_time: The current time.
+        :param can_check_tracker: Function that tells whether a tracker URL is alive, checks for dead trackers
+        are dropped.
+        :return: A list of (tracker url, [infohash, ...]) tuples, one per session to start.
+        """
+        batch_dict = {}
+        postponed = []
+        # trackers that cannot get a new session in this round, True if they are dead
+        skipped_tracker_dict = {}
+        nr_active_sessions = self.nr_active_sessions
+
+        while self._check_heap:
+            entry = heapq.heappop(self._check_heap)
+            _, _, infohash, tracker_url = entry
+
+            batch = batch_dict.get(tracker_url)
+            if batch is not None and len(batch) < MAX_TRACKER_MULTI_SCRAPE:
+                batch.append(infohash)
+                continue
+
+            if batch is None and tracker_url not in skipped_tracker_dict:
+                if not can_check_tracker(tracker_url):
+                    skipped_tracker_dict[tracker_url] = True
+                elif nr_active_sessions < self._max_active_sessions and \
+                        self._can_start_session(tracker_url, current_time):
+                    batch_dict[tracker_url] = [infohash]
+                    nr_active_sessions += 1
+                    continue
+                else:
+                    skipped_tracker_dict[tracker_url] = False
+
+            if skipped_tracker_dict.get(tracker_url):
+                # do not keep checks for dead trackers around
+                self._scheduled_checks.discard((infohash, tracker_url))
+            else:
+                postponed.append(entry)
+
+        for entry in postponed:
+            heapq.heappush(self._check_heap, entry)
+
+        for tracker_url in batch_dict:
+            self._active_session_dict[tracker_url] = self._active_session_dict.get(tracker_url, 0) + 1
+            self._last_session_start_dict[tracker_url] = current_time
+
+        return batch_dict.items()
+
+    def _can_start_session(self, tracker_url, current_time):
+        if self._active_session_dict.get(tracker_url, 0) >= self._max_sessions_per_tracker:
+            return False
+        last_start = self._last_session_start_dict.get(tracker_url, 0)
+        return current_time - last_start >= self._min_tracker_session_interval
+
+    def on_check_done(self, infohash, tracker_url):
+        """
+        Marks a check as done, so it can be scheduled again.
+        """
+        self._scheduled_checks.discard((infohash, tracker_url))
+
+    def on_session_done(self, tracker_url, infohash_list):
+        """
+        Marks a session started for a batch as done.
+        :param tracker_url: The tracker URL of the batch.
+        :param infohash_list: The infohashes in the batch.
+        """
+        for infohash in infohash_list:
+            self.on_check_done(infohash, tracker_url)
+
+        nr_sessions = self._active_session_dict.get(tracker_url, 0) - 1
+        if nr_sessions > 0:
+            self._active_session_dict[tracker_url] = nr_sessions
+        else:
+            self._active_session_dict.pop(tracker_url, None)
+
+    def clear(self):
+        self._check_heap = []
+        self._scheduled_checks.clear()
+        self._active_session_dict.clear()
+        self._last_session_start_dict.clear()
@@ -1,14 +1,17 @@
 import logging
 import random
-import socket
 import struct
 import time
 import urllib
 from abc import ABCMeta, abstractmethod, abstractproperty
 
 from libtorrent import bdecode
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol
+from twisted.web.client import getPage
 
 from Tribler.Core.Utilities.tracker_utils import parse_tracker_url
+from Tribler.Core.simpledefs import METAINFO_PRIORITY_BACKGROUND
 from Tribler.dispersy.util import call_on_reactor_thread
 
 
@@ -18,9 +21,11 @@ TRACKER_ACTION_CONNECT = 0
 TRACKER_ACTION_ANNOUNCE = 1
 TRACKER_ACTION_SCRAPE = 2
 
-MAX_INT32 = 2 ** 16 - 1
+# transaction ids are signed 32 bit integers in the UDP tracker protocol
+MAX_INT32 = 2 ** 31 - 1
 
 UDP_TRACKER_INIT_CONNECTION_ID = 0x41727101980
+UDP_TRACKER_CONNECTION_ID_LIFETIME = 60  # BEP 15: a connection id may be used for one minute
 UDP_TRACKER_RECHECK_INTERVAL = 15
 UDP_TRACKER_MAX_RETRIES = 8
 
@@ -33,25 +38,33 @@ DHT_TRACKER_MAX_RETRIES = 8
 MAX_TRACKER_MULTI_SCRAPE = 74
 
 
-def create_tracker_session(tracker_url, on_result_callback):
+def create_tracker_session(tracker_url, on_result_callback, on_finished_callback, udp_protocol):
     """
     Creates a tracker session with the given tracker URL.
     :param tracker_url: The given tracker URL.
     :param on_result_callback: The on_result callback.
+    :param on_finished_callback: Called with the session when it has finished or failed.
+    :param udp_protocol: The UdpTrackerProtocol used by UDP tracker sessions.
     :return: The tracker session.
     """
-    tracker_type, tracker_address, announce_page = parse_tracker_url(tracker_url)
+    # the host is resolved asynchronously by the session itself
+    tracker_type, tracker_address, announce_page = parse_tracker_url(tracker_url, resolve=False)
 
     if tracker_type == u'UDP':
-        return UdpTrackerSession(tracker_url, tracker_address, announce_page, on_result_callback)
+        return UdpTrackerSession(tracker_url, tracker_address, announce_page, on_result_callback,
+                                 on_finished_callback, udp_protocol)
     else:
-        return HttpTrackerSession(tracker_url, tracker_address, announce_page, on_result_callback)
+        return HttpTrackerSession(tracker_url, tracker_address, announce_page, on_result_callback,
+                                  on_finished_callback)
 
 
 class TrackerSession(object):
     __meta__ = ABCMeta
 
-    def __init__(self, tracker_type, tracker_url, tracker_address, announce_page, on_result_callback):
+    _reactor = reactor
+
+    def __init__(self, tracker_type, tracker_url, tracker_address, announce_page, on_result_callback,
+                 on_finished_callback=None):
         self._logger = logging.getLogger(self.__class__.__name__)
         self._tracker_type = tracker_type
         self._tracker_url = tracker_url
@@ -59,11 +72,12 @@ class TrackerSession(object):
         self._announce_page = announce_page
 
         self._infohash_list = []
-        self._socket = None
 
         self._on_result_callback = on_result_callback
+        self._on_finished_callback = on_finished_callback
 
         self._retries = 0
+        self._timeout_call = None
 
         self._last_contact = None
         self._action = None
@@ -72,7 +86,6 @@ class TrackerSession(object):
         self._is_initiated = False  # you cannot add requests to a session if it has been initiated
         self._is_finished = False
         self._is_failed = False
-        self._is_timed_out = False
 
     def __str__(self):
         return "Tracker[%s, %s]" % (self._tracker_type, self._tracker_url)
@@ -81,10 +94,10 @@ class TrackerSession(object):
         return u"Tracker[%s, %s]" % (self._tracker_type, self._tracker_url)
 
     def cleanup(self):
-        if self._socket is not None:
-            self._socket.close()
-            self._socket = None
+        self._cancel_timeout()
         self._infohash_list = None
+        self._on_result_callback = None
+        self._on_finished_callback = None
 
     def can_add_request(self):
         """
@@ -105,30 +118,50 @@ class TrackerSession(object):
         assert not self.has_request(infohash), u"Must not add duplicate requests"
         self._infohash_list.append(infohash)
 
-    def process_request(self):
-        if self._action == TRACKER_ACTION_CONNECT:
-            return self._handle_connection()
-        else:
-            return self._handle_response()
-
     @abstractmethod
-    def create_connection(self):
-        """Creates a connection to the tracker."""
+    def start(self):
+        """Starts scraping the tracker, no more requests can be added afterwards."""
         pass
 
-    def recreate_connection(self):
-        """Re-creates a connection to the tracker."""
-        self._is_timed_out = False
-
-    @abstractmethod
-    def _handle_connection(self):
-        """Does some work when a connection has been established."""
+    def _retry(self):
+        """Retries the scrape after a timeout."""
         pass
 
-    @abstractmethod
-    def _handle_response(self):
-        """Processes a response message."""
-        pass
+    def _schedule_timeout(self, delay):
+        self._cancel_timeout()
+        self._timeout_call = self._reactor.callLater(delay, self._on_timeout)
+
+    def _cancel_timeout(self):
+        if self._timeout_call is not None and self._timeout_call.active():
+            self._timeout_call.cancel()
+        self._timeout_call = None
+
+    def _on_timeout(self):
+        self._timeout_call = None
+        self._retries += 1
+        if self._retries > self.max_retries:
+            self._logger.debug(u"%s max retry count hit", self)
+            self._fail()
+        else:
+            self._logger.debug(u"%s retrying: %d/%d", self, self._retries, self.max_retries)
+            self._retry()
+
+    def _report_result(self, infohash, seeders, leechers):
+        if self._on_result_callback is not None:
+            self._on_result_callback(infohash, seeders, leechers)
+
+    def _finish(self):
+        self._is_finished = True
+        self._on_done()
+
+    def _fail(self):
+        self._is_failed = True
+        self._on_done()
+
+    def _on_done(self):
+        self._cancel_timeout()
+        if self._on_finished_callback is not None:
+            self._on_finished_callback(self)
 
     @abstractproperty
     def max_retries(self):
@@ -148,6 +181,10 @@ class TrackerSession(object):
     def tracker_url(self):
         return self._tracker_url
 
+    @property
+    def tracker_address(self):
+        return self._tracker_address
+
     @property
     def infohash_list(self):
         return self._infohash_list
@@ -156,10 +193,6 @@ class TrackerSession(object):
     def last_contact(self):
         return self._last_contact
 
-    @property
-    def socket(self):
-        return self._socket
-
     @property
     def action(self):
         return self._action
@@ -168,9 +201,6 @@ class TrackerSession(object):
     def retries(self):
         return self._retries
 
-    def increase_retries(self):
-        self._retries += 1
-
     @property
     def is_initiated(self):
         return self._is_initiated
@@ -183,232 +213,83 @@ class TrackerSession(object):
     def is_failed(self):
         return self._is_failed
 
-    @property
-    def is_timed_out(self):
-        return self._is_timed_out
-
 
 class HttpTrackerSession(TrackerSession):
 
-    def __init__(self, tracker_url, tracker_address, announce_page, on_result_callback):
+    def __init__(self, tracker_url, tracker_address, announce_page, on_result_callback, on_finished_callback=None):
         super(HttpTrackerSession, self).__init__(u'HTTP', tracker_url, tracker_address, announce_page,
-                                                 on_result_callback)
-        self._header_buffer = None
-        self._message_buffer = None
-        self._content_encoding = None
-        self._content_length = None
-        self._received_length = None
+                                                 on_result_callback, on_finished_callback)
 
+    @property
     def max_retries(self):
         return HTTP_TRACKER_MAX_RETRIES
 
+    @property
     def retry_interval(self):
         return HTTP_TRACKER_RECHECK_INTERVAL
 
-    def create_connection(self):
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.setblocking(0)
-
-        return self.recreate_connection()
-
-    def recreate_connection(self):
-        super(HttpTrackerSession, self).recreate_connection()
-
-        # an exception may be raised if the socket is non-blocking
-        try:
-            self._socket.connect(self._tracker_address)
-        except Exception as e:
-            # Error 115 means the operation is in progress.
-            # Error 10035 is WSAEWOULDBLOCK on Windows.
-            if e[0] not in (115, 10035):
-                self._logger.debug(u"%s Failed to connect to HTTP tracker [%s, %s]: %s",
-                                   self, self._tracker_url, self._tracker_address, e)
-                self._is_failed = True
-                return False
-
-        self._action = TRACKER_ACTION_CONNECT
+    def start(self):
+        # no more requests can be appended to this session
+        self._is_initiated = True
+        self._action = TRACKER_ACTION_SCRAPE
         self._last_contact = int(time.time())
-        return True
 
-    def _handle_connection(self):
-        # create the HTTP GET message
+        # getPage follows redirects and times out by itself, so there is no retry timer
+        deferred = getPage(self._get_scrape_url(), timeout=self.retry_interval)
+        deferred.addCallbacks(self._on_response, self._on_error)
+        self._logger.debug(u"%s HTTP SCRAPE message sent", self)
+
+    def _get_scrape_url(self):
         # Note: some trackers have strange URLs, e.g.,
         #       http://moviezone.ws/announce.php?passkey=8ae51c4b47d3e7d0774a720fa511cc2a
         #       which has some sort of 'key' as parameter, so we need to check
         #       if there is already a parameter available
-        message = 'GET '
-        message += '/' + self._announce_page.replace(u'announce', u'scrape')
-        if message.find('?') == -1:
-            message += '?'
-        else:
-            message += '&'
+        url = 'http://%s:%d/' % self._tracker_address
+        url += self._announce_page.replace(u'announce', u'scrape').encode('utf-8')
+        url += '&' if '?' in url else '?'
 
         # append the infohashes as parameters
-        for infohash in self._infohash_list:
-            message += 'info_hash='
-            message += urllib.quote(infohash)
-            message += '&'
-        message = message[:-1]  # remove the last AND '&'
-        message += ' HTTP/1.1\r\n'
-        message += '\r\n'
+        url += '&'.join('info_hash=' + urllib.quote(infohash) for infohash in self._infohash_list)
+        return url.encode('utf-8') if isinstance(url, unicode) else url
 
-        try:
-            self._socket.sendall(message)
-        except Exception as e:
-            self._logger.info(u"%s Failed to send HTTP SCRAPE message: %s", self, e)
-            self._is_failed = True
+    def _on_error(self, failure):
+        if self._infohash_list is None:
+            # the session has been cleaned up in the meantime
             return
+        self._logger.info(u"%s Failed to get HTTP SCRAPE response: %s", self, failure.getErrorMessage())
+        self._fail()
 
-        self._logger.debug(u"%s HTTP SCRAPE message sent", self)
-
-        # no more requests can be appended to this session
-        self._action = TRACKER_ACTION_SCRAPE
-        self._is_initiated = True
-
-    def _handle_response(self):
-        try:
-            # TODO: this buffer size may be changed
-            response = self._socket.recv(8192)
-        except Exception as e:
-            self._logger.info(u"%s Failed to receive HTTP SCRAPE response: %s", self, e)
-            self._is_failed = True
+    def _on_response(self, body):
+        if self._infohash_list is None:
             return
 
         self._logger.debug(u"%s Got response", self)
+        self._last_contact = int(time.time())
 
-        if not response:
-            self._is_failed = True
-            return
-
-        # for the header message, we need to parse the content length in case
-        # if the HTTP packets are partial.
-        if not self._message_buffer:
-            # append the header part
-            if not self._header_buffer:
-                self._header_buffer = response
-            else:
-                self._header_buffer += response
-
-            # check if the header part is over
-            if self._header_buffer.find('\r\n\r\n') != -1:
-                self._header_buffer, self._message_buffer = self._header_buffer.split('\r\n\r\n', 1)
-
-                self._received_length = len(self._message_buffer)
-                self._process_header()
-
-        # the remaining part
-        else:
-            self._message_buffer += response
-            self._received_length += len(response)
-
-        # check the read count
-        if self._received_length >= self._content_length:
-            # process the retrieved information
-            success = self._process_scrape_response()
-            if success:
-                self._is_finished = True
-            else:
-                self._is_failed = True
-
-        # wait for more
-        else:
-            pass
-
-    def _process_header(self):
-        # get and check HTTP response code
-        protocol, code, msg = self._header_buffer.split(' ', 2)
-        if code == '301' or code == '302':
-            idx = self._header_buffer.find('Location: ')
-            if idx == -1:
-                self._is_failed = True
-            else:
-                new_location = (self._header_buffer[idx:].split('\r\n')[0]).split(' ')[1]
-                try:
-                    idx = new_location.find('info_hash=')
-                    if idx != -1:
-                        new_location = new_location[:idx]
-                    if new_location[-1] != '/':
-                        new_location += "/"
-                    new_location += "announce"
-
-                    tracker_type, tracker_address, announce_page = parse_tracker_url(new_location)
-                    if tracker_type != self._tracker_type:
-                        raise RuntimeError(u"cannot redirect to a different tracker type: %s", new_location)
-
-                    else:
-                        self._logger.debug(u"%s being redirected to %s", self, new_location)
-
-                        self._tracker_address = tracker_address
-                        self._announce_page = announce_page
-                        self._socket.close()
-                        self._socket = None
-
-                        self.recreate_connection()
-
-                except RuntimeError as run_err:
-                    self._logger.info(u"%s: Runtime Error: %s, address: %s, announce: %s",
-                                      self, run_err, self._tracker_address, self._announce_page)
-                    self._is_failed = True
-
-                except Exception as err:
-                    self._logger.exception(u"Failed to process HTTP tracker header: [%s], Tracker: %s,"
-                                           u" Tracker Address: %s, Tracker Announce: %s",
-                                           err, self._tracker_url, self._tracker_address, self._announce_page)
-                    self._logger.debug(u"Header: %s", self._header_buffer)
-                    self._is_failed = True
-            return
-
-        if code != '200':
-            # error response code
-            self._logger.debug(u"%s HTTP SCRAPE error response code [%s, %s]", self, code, msg)
-            self._is_failed = True
-            return
-
-        # check the content type
-        idx = self._header_buffer.find('Content-Encoding: ')
-        if idx == -1:
-            # assuming it is plain text or something similar
-            self._content_encoding = 'plain'
-        else:
-            encoding = (self._header_buffer[idx:].split('\r\n')[0]).split(' ')[1]
-            self._content_encoding = encoding
-
-        # get the content length
-        idx = self._header_buffer.find('Content-Length: ')
-        if idx == -1:
-            # assume that the content is small
-
-            # process the retrieved information
-            success = self._process_scrape_response()
-            if success:
-                self._is_finished = True
-            else:
-                self._is_failed = True
-
+        if self._process_scrape_response(body):
+            self._finish()
         else:
-            idx += len('Content-Length: ')
-            self._content_length = int(self._header_buffer[idx:].split('\r\n', 1)[0].strip())
+            self._fail()
 
-    def _process_scrape_response(self):
+    def _process_scrape_response(self, body):
         # parse the retrieved results
-        if self._message_buffer is None:
+        if not body:
             return False
-        response_dict = bdecode(self._message_buffer)
+        response_dict = bdecode(body)
         if response_dict is None:
             return False
 
         unprocessed_infohash_list = self._infohash_list[:]
         if 'files' in response_dict and isinstance(response_dict['files'], dict):
             for infohash in response_dict['files']:
-                downloaded = response_dict['files'][infohash].get('downloaded', 0)
                 complete = response_dict['files'][infohash].get('complete', 0)
                 incomplete = response_dict['files'][infohash].get('incomplete', 0)
 
-                seeders = downloaded
+                seeders = complete
                 leechers = incomplete
 
                 # handle the retrieved information
-                self._on_result_callback(infohash, seeders, leechers)
+                self._report_result(infohash, seeders, leechers)
 
                 # remove this infohash in the infohash list of this session
                 if infohash in unprocessed_infohash_list:
@@ -423,151 +304,226 @@ class HttpTrackerSession(TrackerSession):
         for infohash in unprocessed_infohash_list:
             seeders, leechers = 0, 0
             # handle the retrieved information
-            self._on_result_callback(infohash, seeders, leechers)
+            self._report_result(infohash, seeders, leechers)
         return True
 
 
-class UdpTrackerSession(TrackerSession):
+class UdpTrackerProtocol(DatagramProtocol):
 
-    # A list of transaction IDs that have been used in order to avoid conflict.
-    _active_session_dict = dict()
+    """
+    The UDP endpoint shared by all UDP tracker sessions. Responses are handed to the session that sent the
+    request with the same transaction id.
+    """
 
-    def __init__(self, tracker_url, tracker_address, announce_page, on_result_callback):
-        super(UdpTrackerSession, self).__init__(u'UDP', tracker_url, tracker_address, announce_page, on_result_callback)
-        self._connection_id = 0
-        self._transaction_id = 0
+    def __init__(self):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._session_dict = {}
+        # tracker IP address -> (connection id, time it was received)
+        self._connection_id_dict = {}
 
-    @staticmethod
-    def generate_transaction_id(session):
-        while True:
-            # make sure there is no duplicated transaction IDs
+    def register_session(self, session):
+        """
+        Assigns a new transaction id to a session, replacing its previous one.
+        :param session: The UdpTrackerSession.
+        :return: The transaction id.
+        """
+        self.unregister_session(session)
+
+        transaction_id = random.randint(0, MAX_INT32)
+        while transaction_id in self._session_dict:
             transaction_id = random.randint(0, MAX_INT32)
-            if transaction_id not in UdpTrackerSession._active_session_dict.items():
-                UdpTrackerSession._active_session_dict[session] = transaction_id
-                session.transactionId = transaction_id
-                break
 
-    @staticmethod
-    def remove_transaction_id(session):
-        if session in UdpTrackerSession._active_session_dict:
-            del UdpTrackerSession._active_session_dict[session]
+        self._session_dict[transaction_id] = session
+        return transaction_id
+
+    def unregister_session(self, session):
+        if self._session_dict.get(session.transaction_id) is session:
+            del self._session_dict[session.transaction_id]
+
+    def get_connection_id(self, address):
+        """
+        Returns the connection id of a tracker if we got one from it less than a minute ago.
+        :param address: The (ip, port) of the tracker.
+        :return: The connection id or None.
+        """
+        connection_id, timestamp = self._connection_id_dict.get(address, (None, 0))
+        if time.time() - timestamp >= UDP_TRACKER_CONNECTION_ID_LIFETIME:
+            self._connection_id_dict.pop(address, None)
+            return None
+        return connection_id
+
+    def set_connection_id(self, address, connection_id):
+        self._connection_id_dict[address] = (connection_id, time.time())
+
+    def remove_connection_id(self, address):
+        self._connection_id_dict.pop(address, None)
+
+    def send(self, message, address):
+        if self.transport is None:
+            return False
+
+        try:
+            self.transport.write(message, address)
+        except Exception as e:
+            self._logger.debug(u"Failed to send message to %s: %s", address, e)
+            return False
+        return True
+
+    def datagramReceived(self, data, address):
+        if len(data) < 8:
+            self._logger.debug(u"Ignoring too short message from %s: %s", address, repr(data))
+            return
+
+        _, transaction_id = struct.unpack_from('!ii', data, 0)
+        session = self._session_dict.get(transaction_id)
+        if session is None or session.ip_address != address:
+            self._logger.debug(u"Ignoring message with unknown transaction id %d from %s", transaction_id, address)
+            return
+
+        session.handle_response(data)
+
+
+class UdpTrackerSession(TrackerSession):
+
+    def __init__(self, tracker_url, tracker_address, announce_page, on_result_callback, on_finished_callback=None,
+                 udp_protocol=None):
+        super(UdpTrackerSession, self).__init__(u'UDP', tracker_url, tracker_address, announce_page,
+                                                on_result_callback, on_finished_callback)
+        self._udp_protocol = udp_protocol
+        self._ip_address = None
+        self._connection_id = 0
+        self._is_cached_connection_id = False
+        self._transaction_id = None
+
+    @property
+    def transaction_id(self):
+        return self._transaction_id
 
     def cleanup(self):
-        UdpTrackerSession.remove_transaction_id(self)
+        self._udp_protocol.unregister_session(self)
         super(UdpTrackerSession, self).cleanup()
 
+    @property
     def max_retries(self):
         return UDP_TRACKER_MAX_RETRIES
 
+    @property
     def retry_interval(self):
-        return UDP_TRACKER_RECHECK_INTERVAL * (2 ** self._retries)
+        return UDP_TRACKER_RECHECK_INTERVAL
+
+    @property
+    def ip_address(self):
+        return self._ip_address
+
+    def start(self):
+        # no more requests can be appended to this session
+        self._is_initiated = True
 
-    def create_connection(self):
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self._socket.setblocking(0)
-        self._socket.connect(self._tracker_address)
+        # datagrams can only be sent to IP addresses, resolve the tracker host first
+        host, port = self._tracker_address
+        deferred = self._reactor.resolve(host)
+        deferred.addCallbacks(lambda ip: self._on_resolved((ip, port)), self._on_resolve_error)
 
-        return self.recreate_connection()
+    def _on_resolved(self, ip_address):
+        if self._infohash_list is None:
+            return
+        self._ip_address = ip_address
+
+        # skip the CONNECT round trip if we scraped this tracker less than a minute ago
+        connection_id = self._udp_protocol.get_connection_id(ip_address)
+        if connection_id is None:
+            self._send_connect()
+        else:
+            self._is_cached_connection_id = True
+            self._send_scrape(connection_id)
+
+    def _on_resolve_error(self, failure):
+        if self._infohash_list is None:
+            return
+        self._logger.info(u"%s Failed to resolve tracker host: %s", self, failure.getErrorMessage())
+        self._fail()
 
-    def recreate_connection(self):
-        super(UdpTrackerSession, self).recreate_connection()
+    def _retry(self):
+        # the tracker may not know our connection id anymore, get a new one
+        self._udp_protocol.remove_connection_id(self._ip_address)
+        self._send_connect()
 
+    def _send_connect(self):
         # prepare connection message
         self._connection_id = UDP_TRACKER_INIT_CONNECTION_ID
         self._action = TRACKER_ACTION_CONNECT
-        UdpTrackerSession.generate_transaction_id(self)
+        self._transaction_id = self._udp_protocol.register_session(self)
 
         message = struct.pack('!qii', self._connection_id, self._action, self._transaction_id)
-        try:
-            self._socket.send(message)
-        except Exception as e:
-            self._logger.debug(u"%s Failed to send message: %s", self, e)
-            self._is_failed = True
-            return False
+        self._send(message)
 
-        self._last_contact = int(time.time())
-        return True
-
-    def _handle_connection(self):
-        try:
-            # TODO: this number may be increased
-            response = self._socket.recv(32)
-        except Exception as e:
-            self._logger.info(u"%s Failed to receive UDP CONNECT response: %s", self, e)
-            self._is_failed = True
+    def _send(self, message):
+        if not self._udp_protocol.send(message, self._ip_address):
+            self._logger.debug(u"%s Failed to send message", self)
+            self._fail()
             return
 
-        # check message size
-        if len(response) < 16:
-            self._logger.info(u"%s Invalid response for UDP CONNECT: %s", self, repr(response))
-            self._is_failed = True
-            return
+        self._last_contact = int(time.time())
+        self._schedule_timeout(self.retry_interval)
+
+    def handle_response(self, response):
+        """
+        Processes a message from the tracker with the transaction id of this session.
+        :param response: The message.
+        """
+        if self._action == TRACKER_ACTION_CONNECT:
+            self._handle_connection(response)
+        else:
+            self._handle_response(response)
 
-        # check the response
-        action, transaction_id = struct.unpack_from('!ii', response, 0)
-        if action != self._action or transaction_id != self._transaction_id:
+    def _check_response(self, response, min_length):
+        # check message size and action, trackers reply with an error action on failure
+        action, = struct.unpack_from('!i', response, 0)
+        if len(response) < min_length or action != self._action:
             # get error message
             errmsg_length = len(response) - 8
             error_message = struct.unpack_from('!' + str(errmsg_length) + 's', response, 8)
 
-            self._logger.info(u"%s Error response for UDP CONNECT [%s]: %s",
-                              self, repr(response), repr(error_message))
-            self._is_failed = True
+            self._logger.info(u"%s Error response for action %d [%s]: %s",
+                              self, self._action, repr(response), repr(error_message))
+            return False
+        return True
+
+    def _handle_connection(self, response):
+        if not self._check_response(response, 16):
+            self._fail()
             return
 
+        connection_id = struct.unpack_from('!q', response, 8)[0]
+        self._udp_protocol.set_connection_id(self._ip_address, connection_id)
+        self._is_cached_connection_id = False
+        self._send_scrape(connection_id)
+
+    def _send_scrape(self, connection_id):
         # update action and IDs
-        self._connection_id = struct.unpack_from('!q', response, 8)[0]
+        self._connection_id = connection_id
         self._action = TRACKER_ACTION_SCRAPE
-        UdpTrackerSession.generate_transaction_id(self)
+        self._transaction_id = self._udp_protocol.register_session(self)
 
         # pack and send the message
         fmt = '!qii' + ('20s' * len(self._infohash_list))
         message = struct.pack(fmt, self._connection_id, self._action, self._transaction_id, *self._infohash_list)
-
-        try:
-            self._socket.send(message)
-        except Exception as e:
-            self._logger.debug(u"%s Failed to send UDP SCRAPE message: %s", self, e)
-            self._is_failed = True
-            return
-
-        # no more requests can be appended to this session
-        self._is_initiated = True
-        self._last_contact = int(time.time())
-
-    def _handle_response(self):
-        try:
-            # 74 infohashes are roughly 896 bytes
-            # TODO: the receive number may be changed
-            response = self._socket.recv(1024)
-        except Exception as e:
-            self._logger.info(u"%s Failed to receive UDP SCRAPE response: %s", self, e)
-            self._is_failed = True
-            return
-
-        # check message size
-        if len(response) < 8:
-            self._logger.info(u"%s Invalid response for UDP SCRAPE: %s", self, repr(response))
-            self._is_failed = True
-            return
-
-        # check response
-        action, transaction_id = struct.unpack_from('!ii', response, 0)
-        if action != self._action or transaction_id != self._transaction_id:
-            # get error message
-            errmsg_length = len(response) - 8
-            error_message = \
-                struct.unpack_from('!' + str(errmsg_length) + 's', response, 8)
-
-            self._logger.info(u"%s Error response for UDP SCRAPE: [%s] [%s]",
-                              self, repr(response), repr(error_message))
-            self._is_failed = True
+        self._send(message)
+
+    def _handle_response(self, response):
+        if not self._check_response(response, 8):
+            if self._is_cached_connection_id:
+                # the cached connection id may have expired on the tracker side, connect again
+                self._udp_protocol.remove_connection_id(self._ip_address)
+                self._send_connect()
+            else:
+                self._fail()
             return
 
         # get results
         if len(response) - 8 != len(self._infohash_list) * 12:
             self._logger.info(u"%s UDP SCRAPE response mismatch: %s", self, repr(response))
-            self._is_failed = True
+            self._fail()
             return
 
         offset = 8
@@ -576,11 +532,11 @@ class UdpTrackerSession(TrackerSession):
             offset += 12
 
             # handle the retrieved information
-            self._on_result_callback(infohash, seeders, leechers)
+            self._report_result(infohash, seeders, leechers)
 
-        # close this socket and remove its transaction ID from the list
-        UdpTrackerSession.remove_transaction_id(self)
-        self._is_finished = True
+        # remove the transaction ID of this session
+        self._udp_protocol.unregister_session(self)
+        self._finish()
 
 
 class FakeDHTSession(TrackerSession):
@@ -590,11 +546,10 @@ class FakeDHTSession(TrackerSession):
     def __init__(self, session, on_result_callback):
         super(FakeDHTSession, self).__init__(u'DHT', u'DHT', u'DHT', u'DHT', on_result_callback)
 
-        self._socket = None
         self._session = session
 
     def cleanup(self):
-        self._infohash_list = None
+        super(FakeDHTSession, self).cleanup()
         self._session = None
 
     def can_add_request(self):
@@ -603,24 +558,28 @@ class FakeDHTSession(TrackerSession):
     def add_request(self, infohash):
         @call_on_reactor_thread
         def on_metainfo_received(metainfo):
-            self._on_result_callback(infohash, metainfo['seeders'], metainfo['leechers'])
+            self._report_result(infohash, metainfo['seeders'], metainfo['leechers'])
 
         @call_on_reactor_thread
         def on_metainfo_timeout(result_info_hash):
-            self._on_result_callback(result_info_hash, seeders=0, leechers=0)
+            self._report_result(result_info_hash, 0, 0)
 
+        self._infohash_list.append(infohash)
         if self._session:
+            # the torrent store has no swarm information, ask the DHT
             self._session.lm.ltmgr.get_metainfo(infohash, callback=on_metainfo_received,
-                                                timeout_callback=on_metainfo_timeout)
+                                                timeout_callback=on_metainfo_timeout, use_store=False,
+                                                priority=METAINFO_PRIORITY_BACKGROUND)
 
-    def create_connection(self):
+    def start(self):
+        # requests are sent to the DHT as soon as they are added
         pass
 
-    def _handle_connection(self):
-        pass
-
-    def _handle_response(self):
-        pass
+    def _report_result(self, infohash, seeders, leechers):
+        # allow the torrent to be checked on the DHT again
+        if self._infohash_list is not None and infohash in self._infohash_list:
+            self._infohash_list.remove(infohash)
+        super(FakeDHTSession, self)._report_result(infohash, seeders, leechers)
 
     @property
     def max_retries(self):
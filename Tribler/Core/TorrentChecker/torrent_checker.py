@@ -1,8 +1,6 @@
 from binascii import hexlify
 from collections import deque
 import logging
-import select
-from threading import Thread
 import time
 
 from twisted.internet import reactor
@@ -11,8 +9,8 @@ from Tribler.dispersy.taskmanager import TaskManager
 from Tribler.dispersy.util import blocking_call_on_reactor_thread, call_on_reactor_thread
 
 from Tribler.Core.simpledefs import NTFY_TORRENTS
-from Tribler.Core.TorrentChecker.session import TRACKER_ACTION_CONNECT, create_tracker_session
-from Tribler.Core.Utilities.network_utils import InterruptSocket
+from Tribler.Core.TorrentChecker.check_scheduler import MIN_TRACKER_SESSION_INTERVAL, TorrentCheckScheduler
+from Tribler.Core.TorrentChecker.session import UdpTrackerProtocol, create_tracker_session
 
 from .session import FakeDHTSession
 
@@ -23,63 +21,18 @@ DEFAULT_TORRENT_CHECK_INTERVAL = 900  # base multiplier for the check delay
 DEFAULT_MAX_TORRENT_CHECK_RETRIES = 8  # max check delay increments when failed.
 DEFAULT_TORRENT_CHECK_RETRY_INTERVAL = 30  # interval when the torrent was successfully checked for the last time
 
+CHECK_RESULT_FLUSH_INTERVAL = 5  # check results are written to the database at least this often
+MAX_BUFFERED_CHECK_RESULTS = 500  # or as soon as this many results are waiting
+MAX_CACHED_CHECK_RETRIES = 10000  # the maximum number of torrents to remember the tracker_check_retries for
 
-class TorrentCheckerThread(Thread):
+
+class TorrentChecker(TaskManager):
 
     """
-    Thread used to monitor for data arriving on the scrape sockets.
+    Checks the health of torrents on their trackers and the DHT. All tracker sessions run on the reactor, UDP
+    trackers share a single port and are demultiplexed by transaction id.
     """
 
-    def __init__(self, tracker_checker):
-        super(TorrentCheckerThread, self).__init__(name=u"torrent_checker")
-        self._logger = logging.getLogger(self.__class__.__name__)
-        self._torrent_checker = tracker_checker
-
-        self._interrupt_socket = InterruptSocket()
-
-        self._session_dict = {}
-
-    def cleanup(self):
-        self._session_dict = None
-        self._interrupt_socket.close()
-        self._interrupt_socket = None
-
-    def interrupt(self):
-        self._interrupt_socket.interrupt()
-
-    def run(self):
-        """
-        Checks for data in the scrape sockets until it's time to stop.
-        Every time there's data on one of the sockets, TorrentChecker.check_sessions() will be called.
-        """
-        check_read_socket_list = []
-        check_write_socket_list = []
-        while not self._torrent_checker.should_stop:
-            check_read_socket_list.append(self._interrupt_socket.socket)
-
-            read_socket_list, write_socket_list, _ = select.select(check_read_socket_list,
-                                                                   check_write_socket_list,
-                                                                   [], 5)
-
-            if self._torrent_checker.should_stop:
-                break
-
-            if self._interrupt_socket.socket in read_socket_list:
-                self._interrupt_socket.clear()
-                read_socket_list = [sock for sock in read_socket_list if sock != self._interrupt_socket.socket]
-
-            result = self._torrent_checker.check_sessions(read_socket_list, write_socket_list, [])
-
-            if result is None:
-                break
-            check_read_socket_list, check_write_socket_list = result
-
-        self.cleanup()
-        self._logger.info(u"stopped")
-
-
-class TorrentChecker(TaskManager):
-
     def __init__(self, session):
         super(TorrentChecker, self).__init__()
         self._logger = logging.getLogger(self.__class__.__name__)
@@ -89,16 +42,28 @@ class TorrentChecker(TaskManager):
 
         self._should_stop = False
 
-        self._checker_thread = None
+        self._udp_protocol = UdpTrackerProtocol()
+        self._udp_port = None
 
         self._pending_request_queue = deque()
         self._pending_response_dict = {}
+        self._process_requests_call = None
+
+        self._check_scheduler = TorrentCheckScheduler()
+        self._scheduled_sessions = set()
+
+        # infohash -> (torrent_id, tracker_check_retries) of the torrents that are being checked
+        self._check_retries_dict = {}
+        self._check_result_buffer = []
+        self._flush_results_call = None
+        self._nr_flushed_results = 0
+        self._flush_time = 0.0
 
         self._torrent_check_interval = DEFAULT_TORRENT_CHECK_INTERVAL
         self._torrent_check_retry_interval = DEFAULT_TORRENT_CHECK_RETRY_INTERVAL
         self._max_torrent_check_retries = DEFAULT_MAX_TORRENT_CHECK_RETRIES
 
-        self._session_list = [FakeDHTSession(session, self._on_result_from_session), ]
+        self._session_list = [FakeDHTSession(session, self._on_result_from_dht), ]
         self._last_torrent_selection_time = 0
 
     @property
@@ -109,38 +74,38 @@ class TorrentChecker(TaskManager):
     def initialize(self):
         self._torrent_db = self._session.open_dbhandler(NTFY_TORRENTS)
 
-        self._reschedule_torrent_select()
+        self._udp_port = reactor.listenUDP(0, self._udp_protocol)
 
-        self._checker_thread = TorrentCheckerThread(self)
-        self._checker_thread.start()
+        self._reschedule_torrent_select()
 
+    @blocking_call_on_reactor_thread
     def shutdown(self):
         """
         Shutdown the torrent health checker.
 
         Once shut down it can't be started again.
         """
-        # stop the checking thread first because it can block on the reactor thread
-        join_timeout = 10.0  # 10 seconds should be way sufficient
-
         self._should_stop = True
-        self._checker_thread.interrupt()
-        self._checker_thread.join(join_timeout)  # do not block forever
-        if self._checker_thread.is_alive():
-            self._logger.critical("_checker_thread.join(%s) timed out.", join_timeout)
-        self._checker_thread = None
 
-        # it's now safe to block on the reactor thread
         self.cancel_all_pending_tasks()
+        self._flush_check_results()
 
         # kill all the tracker sessions
         for session in self._session_list:
             session.cleanup()
         self._session_list = None
 
+        if self._udp_port:
+            self._udp_port.stopListening()
+            self._udp_port = None
+
         self._pending_request_queue = None
         self._pending_response_dict = None
 
+        self._check_scheduler.clear()
+        self._scheduled_sessions = None
+        self._check_retries_dict = None
+
         self._torrent_db = None
         self._session = None
 
@@ -169,32 +134,26 @@ class TorrentChecker(TaskManager):
         # update the torrent selection interval
         self._reschedule_torrent_select()
 
-        # start selecting torrents
-        current_time = int(time.time())
-
-        result = self._session.lm.tracker_manager.get_next_tracker_for_auto_check()
-        if result is None:
-            self._logger.warn(u"No tracker to select from, skip")
+        # fill up the queue of checks with the torrents that are overdue the longest
+        nr_free_slots = self._check_scheduler.nr_free_slots
+        if nr_free_slots == 0:
+            self._logger.debug(u"check queue is full, skip selecting torrents")
             return
 
-        tracker_url, _ = result
-        self._logger.debug(u"Start selecting torrents on tracker %s.", tracker_url)
-
-        all_torrent_list = self._torrent_db.getTorrentsOnTracker(tracker_url, current_time)
-
-        # get the torrents that should be checked
-        scheduled_torrents = 0
-        for torrent_id, infohash, last_check in all_torrent_list:
-            # recheck interval is: interval * 2^(retries)
-            if current_time - last_check < self._torrent_check_interval:
-                continue
+        current_time = int(time.time())
+        torrent_list = self._torrent_db.getTorrentsToCheck(current_time, current_time - self._torrent_check_interval,
+                                                           nr_free_slots)
 
-            self._pending_request_queue.append((torrent_id, infohash, [tracker_url, ]))
-            scheduled_torrents += 1
+        scheduled_checks = 0
+        for torrent_id, infohash, tracker_url, next_check, nr_peers, tracker_failures, retries in torrent_list:
+            priority = self._check_scheduler.get_priority(next_check, nr_peers, tracker_failures)
+            if self._check_scheduler.add_check(infohash, tracker_url, priority):
+                self._cache_check_retries(infohash, torrent_id, retries)
+                scheduled_checks += 1
 
-        self._logger.debug(u"Selected %d new torrents to check on tracker: %s", scheduled_torrents, tracker_url)
-        if scheduled_torrents > 0:
-            self._checker_thread.interrupt()
+        self._logger.debug(u"Selected %d new checks, %d checks queued", scheduled_checks, len(self._check_scheduler))
+        if scheduled_checks > 0:
+            self._schedule_pending_requests()
 
     @call_on_reactor_thread
     def add_gui_request(self, infohash):
@@ -202,7 +161,8 @@ class TorrentChecker(TaskManager):
         Public API for adding a GUI request.
         :param infohash: Torrent infohash.
         """
-        result = self._torrent_db.getTorrent(infohash, (u'torrent_id', u'last_tracker_check'), False)
+        result = self._torrent_db.getTorrent(infohash, (u'torrent_id', u'last_tracker_check',
+                                                        u'tracker_check_retries'), False)
         if result is None:
             self._logger.warn(u"torrent info not found, skip. infohash: %s", hexlify(infohash))
             return
@@ -229,123 +189,90 @@ class TorrentChecker(TaskManager):
             # TODO: add code to handle torrents with no tracker
             return
 
+        self._cache_check_retries(infohash, torrent_id, result[u'tracker_check_retries'] or 0)
         self._pending_request_queue.append((torrent_id, infohash, tracker_set))
-        self._checker_thread.interrupt()
-
-    @blocking_call_on_reactor_thread
-    def check_sessions(self, read_socket_list, write_socket_list, _):
-        if self._should_stop:
-            return
-
-        current_time = int(time.time())
-
-        session_dict = {}
-        for session in self._session_list:
-            session_dict[session.socket] = session
-
-        # >> Step 1: Check the sockets
-        self._logger.debug(u"got %d writable sockets, %d readable sockets",
-                           len(write_socket_list), len(read_socket_list))
-        # check writable sockets (TCP connections)
-        for write_socket in write_socket_list:
-            session = session_dict[write_socket]
-            session.process_request()
-
-        # check readable sockets
-        for read_socket in read_socket_list:
-            session = session_dict[read_socket]
-            session.process_request()
-
-        # >> Step 2: Handle timed out UDP sessions
-        for session in session_dict.values():
-            diff = current_time - session.last_contact
-            if diff > session.retry_interval:
-                session._is_timed_out = True
-
-                for infohash in session.infohash_list:
-                    self._pending_response_dict[infohash][u'updated'] = True
-
-                session.increase_retries()
-
-                if session.retries > session.max_retries:
-                    session._is_failed = True
-                    self._logger.debug(u"%s max retry count hit", session)
-                else:
-                    # re-establish the connection
-                    # Do it in a callLater so the timed out flag is not cleared until we are done with it.
-                    self._logger.debug(u"%s retrying: %d/%d", session, session.retries, self._max_torrent_check_retries)
-                    reactor.callLater(0, session.recreate_connection)
-
-        # >> Step 3: Remove completed sessions and update tracker info
-        if self._session_list:
-            for i in range(len(self._session_list) - 1, -1, -1):
-                session = self._session_list[i]
-
-                if session.is_failed or session.is_finished:
-                    self._logger.debug(u"%s is %s", session, u'failed' if session.is_failed else u'finished')
+        self._schedule_pending_requests()
 
-                    # update tracker info
-                    self._session.lm.tracker_manager.update_tracker_info(session.tracker_url, not session.is_failed)
-
-                    # set torrent remaining responses
-                    for infohash in session.infohash_list:
-                        self._pending_response_dict[infohash][u'remaining_responses'] -= 1
+    def _schedule_pending_requests(self, delay=0):
+        """
+        Processes the pending requests after the given delay, by default in the next reactor iteration so requests
+        added in the meantime end up in the same tracker sessions.
+        """
+        if self._process_requests_call and self._process_requests_call.active():
+            if self._process_requests_call.getTime() <= reactor.seconds() + delay:
+                return
+            self.cancel_pending_task(u"torrent_checker process pending requests")
 
-                    session.cleanup()
-                    self._session_list.pop(i)
+        self._process_requests_call = self.register_task(u"torrent_checker process pending requests",
+                                                         reactor.callLater(delay, self._process_pending_requests))
 
-        # >> Step 4. check and update new results
-        for infohash, response in self._pending_response_dict.items():
-            if response[u'updated']:
-                response[u'updated'] = False
-                self._update_torrent_result(response)
+    def _process_pending_requests(self):
+        """
+        Processes all pending requests and starts the new sessions.
+        """
+        if self._should_stop:
+            return
 
-            if self._pending_response_dict[infohash][u'remaining_responses'] == 0:
-                del self._pending_response_dict[infohash]
+        new_sessions = []
+        while len(self._pending_request_queue) > 0:
+            _, infohash, tracker_set = self._pending_request_queue.popleft()
+            for tracker_url in tracker_set:
+                session = self._create_session_for_request(infohash, tracker_url)
+                if session:
+                    new_sessions.append(session)
+
+        # take the most urgent scheduled checks
+        batches = self._check_scheduler.get_batches(int(time.time()), self._should_check_tracker)
+        for tracker_url, infohash_list in batches:
+            session = self._create_session_for_batch(tracker_url, infohash_list)
+            if session:
+                new_sessions.append(session)
 
-        self._logger.debug(u"total sessions: %d", len(self._session_list))
-        for session in self._session_list:
-            self._logger.debug(u"%s, finished: %d, failed: %d", session, session.is_finished, session.is_failed)
+        for session in new_sessions:
+            session.start()
 
-        # ---------------------------------------------------
-        # Start processing pending requests and make select socket lists
+        self._logger.debug(u"total sessions: %d, queued checks: %d", len(self._session_list),
+                           len(self._check_scheduler))
 
-        # process all pending request
-        self._process_pending_requests()
+        # checks can be postponed by the tracker limits, try again later
+        if len(self._check_scheduler) > 0:
+            self._schedule_pending_requests(MIN_TRACKER_SESSION_INTERVAL)
 
-        # create read and write socket check list
-        # check non-blocking connection TCP sockets if they are writable
-        # check UDP and TCP response sockets if they are readable
-        check_read_socket_list = []
-        check_write_socket_list = []
+    def _should_check_tracker(self, tracker_url):
+        return tracker_url == u'DHT' or self._session.lm.tracker_manager.should_check_tracker(tracker_url)
 
-        session_dict = {}
-        for session in self._session_list:
-            session_dict[session.socket] = session
+    def _create_session_for_batch(self, tracker_url, infohash_list):
+        """
+        Creates a session for a batch of checks from the scheduler.
+        :param tracker_url: The tracker URL.
+        :param infohash_list: The infohashes to check on the tracker.
+        :return: The new session, or None if no new session is needed.
+        """
+        if tracker_url == u'DHT':
+            # the DHT session is always running and never reports back as a whole
+            self._check_scheduler.on_session_done(tracker_url, [])
+            for infohash in infohash_list:
+                if not self._session_list[0].has_request(infohash):
+                    self._session_list[0].add_request(infohash)
+                    self._update_pending_response(infohash)
+            return
 
-        for session_socket, session in session_dict.iteritems():
-            if session.tracker_type == u'DHT':
-                # FakeDHTSession doesn't really have a socket as it uses LibtorrentMgr's DHT
-                continue
-            if session.tracker_type == u'UDP':
-                check_read_socket_list.append(session_socket)
-            else:
-                if session.action == TRACKER_ACTION_CONNECT:
-                    check_write_socket_list.append(session_socket)
-                else:
-                    check_read_socket_list.append(session_socket)
+        try:
+            session = create_tracker_session(tracker_url, self._on_result_from_session, self._on_session_finished,
+                                             self._udp_protocol)
+        except RuntimeError as e:
+            self._logger.info(u"Failed to create session for tracker %s: %s", tracker_url, e)
+            self._check_scheduler.on_session_done(tracker_url, infohash_list)
+            self._session.lm.tracker_manager.update_tracker_info(tracker_url, False)
+            return
 
-        # return select socket lists
-        return check_read_socket_list, check_write_socket_list
+        for infohash in infohash_list:
+            session.add_request(infohash)
+            self._update_pending_response(infohash)
 
-    def _process_pending_requests(self):
-        """
-        Processes all pending requests.
-        """
-        while len(self._pending_request_queue) > 0:
-            _, infohash, tracker_set = self._pending_request_queue.popleft()
-            for tracker_url in tracker_set:
-                self._create_session_for_request(infohash, tracker_url)
+        self._session_list.append(session)
+        self._scheduled_sessions.add(session)
+        return session
 
     def _create_session_for_request(self, infohash, tracker_url):
         # skip no-DHT
@@ -382,30 +309,71 @@ class TorrentChecker(TaskManager):
             self._logger.warn(u"skipping recently failed tracker %s", tracker_url)
             return
 
-        session = None
         try:
-            session = create_tracker_session(tracker_url, self._on_result_from_session)
+            session = create_tracker_session(tracker_url, self._on_result_from_session, self._on_session_finished,
+                                             self._udp_protocol)
+        except RuntimeError as e:
+            self._logger.info(u"Failed to create session for tracker %s: %s", tracker_url, e)
+            self._session.lm.tracker_manager.update_tracker_info(tracker_url, False)
+            return
 
-            connection_established = session.create_connection()
-            if not connection_established:
-                raise RuntimeError(u"Could not establish connection")
+        session.add_request(infohash)
 
-            session.add_request(infohash)
+        self._session_list.append(session)
 
-            self._session_list.append(session)
+        # update the number of responses this torrent is expecting
+        self._update_pending_response(infohash)
 
-            # update the number of responses this torrent is expecting
-            self._update_pending_response(infohash)
+        self._logger.debug(u"Session created for infohash %s", hexlify(infohash))
+        return session
+
+    def _on_session_finished(self, session):
+        """
+        Called by a tracker session when it has finished or failed.
+        :param session: The tracker session.
+        """
+        if self._should_stop:
+            return
 
-            self._logger.debug(u"Session created for infohash %s", hexlify(infohash))
+        self._logger.debug(u"%s is %s", session, u'failed' if session.is_failed else u'finished')
 
-        except Exception as e:
-            self._logger.info(u"Failed to create session for tracker %s: %s", tracker_url, e)
+        # update tracker info
+        self._session.lm.tracker_manager.update_tracker_info(session.tracker_url, not session.is_failed)
 
-            if session:
-                session.cleanup()
+        for infohash in session.infohash_list:
+            self._on_request_done(infohash, session.is_failed)
 
-            self._session.lm.tracker_manager.update_tracker_info(tracker_url, False)
+        if session in self._scheduled_sessions:
+            self._scheduled_sessions.remove(session)
+            self._check_scheduler.on_session_done(session.tracker_url, session.infohash_list)
+            # the tracker can take another session
+            self._schedule_pending_requests()
+
+        self._session_list.remove(session)
+        session.cleanup()
+
+    def _on_request_done(self, infohash, failed=False):
+        """
+        Called when one of the sessions checking a torrent has finished, stores the best result so far.
+        :param infohash: The infohash of the torrent.
+        :param failed: Whether the session failed or timed out.
+        """
+        response = self._pending_response_dict.get(infohash)
+        if response is None:
+            return
+
+        response[u'remaining_responses'] -= 1
+        if failed and response[u'remaining_responses'] <= 0 and u'last_check' not in response:
+            # none of the sessions got a result, store a failed check so the next check is backed off
+            response[u'last_check'] = int(time.time())
+            response[u'updated'] = True
+
+        if response[u'updated']:
+            response[u'updated'] = False
+            self._update_torrent_result(response)
+
+        if response[u'remaining_responses'] <= 0:
+            del self._pending_response_dict[infohash]
 
     def _update_pending_response(self, infohash):
         if infohash in self._pending_response_dict:
@@ -421,6 +389,7 @@ class TorrentChecker(TaskManager):
     def _on_result_from_session(self, infohash, seeders, leechers):
         if self.should_stop:
             return
+
         response = self._pending_response_dict[infohash]
         response[u'last_check'] = int(time.time())
         if response[u'seeders'] < seeders or (response[u'seeders'] == seeders and response[u'leechers'] < leechers):
@@ -428,35 +397,96 @@ class TorrentChecker(TaskManager):
             response[u'leechers'] = leechers
             response[u'updated'] = True
 
+    def _on_result_from_dht(self, infohash, seeders, leechers):
+        # the DHT session never finishes, so every DHT result completes a request on its own
+        self._on_result_from_session(infohash, seeders, leechers)
+        if not self.should_stop:
+            self._on_request_done(infohash)
+            self._check_scheduler.on_check_done(infohash, u'DHT')
+
+    def _cache_check_retries(self, infohash, torrent_id, retries):
+        if len(self._check_retries_dict) >= MAX_CACHED_CHECK_RETRIES and infohash not in self._check_retries_dict:
+            # cache misses are looked up in bulk when the results are flushed
+            self._check_retries_dict.clear()
+        self._check_retries_dict[infohash] = (torrent_id, retries)
+
     def _update_torrent_result(self, response):
-        infohash = response[u'infohash']
-        seeders = response[u'seeders']
-        leechers = response[u'leechers']
-        last_check = response[u'last_check']
+        """
+        Buffers the result of a torrent check, the buffer is written to the database periodically.
+        """
+        self._logger.debug(u"Update result %s/%s for %s", response[u'seeders'], response[u'leechers'],
+                           hexlify(response[u'infohash']))
 
-        # the torrent status logic, TODO: do it in other way
-        self._logger.debug(u"Update result %s/%s for %s", seeders, leechers, hexlify(infohash))
+        self._check_result_buffer.append((response[u'infohash'], response[u'seeders'], response[u'leechers'],
+                                          response[u'last_check']))
 
-        result = self._torrent_db.getTorrent(infohash, (u'torrent_id', u'tracker_check_retries'), include_mypref=False)
-        torrent_id = result[u'torrent_id']
-        retries = result[u'tracker_check_retries']
+        if len(self._check_result_buffer) >= MAX_BUFFERED_CHECK_RESULTS:
+            self._flush_check_results()
+        elif not (self._flush_results_call and self._flush_results_call.active()):
+            self._flush_results_call = self.register_task(u"torrent_checker flush results",
+                                                          reactor.callLater(CHECK_RESULT_FLUSH_INTERVAL,
+                                                                            self._flush_check_results))
 
-        # the status logic
-        if seeders > 0:
-            retries = 0
-            status = u'good'
-        else:
-            retries += 1
-            if retries < self._max_torrent_check_retries:
-                status = u'unknown'
+    def _flush_check_results(self):
+        """
+        Writes the buffered check results to the database in one go.
+        """
+        self.cancel_pending_task(u"torrent_checker flush results")
+        if not self._check_result_buffer:
+            return
+
+        check_results, self._check_result_buffer = self._check_result_buffer, []
+        start_time = time.time()
+
+        missing_infohashes = set(infohash for infohash, _, _, _ in check_results
+                                 if infohash not in self._check_retries_dict)
+        if missing_infohashes:
+            self._check_retries_dict.update(self._torrent_db.getTorrentCheckRetriesByInfohash(missing_infohashes))
+
+        results = []
+        for infohash, seeders, leechers, last_check in check_results:
+            if infohash not in self._check_retries_dict:
+                self._logger.warn(u"torrent info not found, skip result. infohash: %s", hexlify(infohash))
+                continue
+            torrent_id, retries = self._check_retries_dict[infohash]
+
+            # the status logic
+            if seeders > 0:
+                retries = 0
+                status = u'good'
             else:
-                status = u'dead'
-                # prevent retries from exceeding the maximum
-                retries = self._max_torrent_check_retries
+                retries += 1
+                if retries < self._max_torrent_check_retries:
+                    status = u'unknown'
+                else:
+                    status = u'dead'
+                    # prevent retries from exceeding the maximum
+                    retries = self._max_torrent_check_retries
+
+            # calculate next check time: <last-time> + <interval> * (2 ^ <retries>)
+            next_check = last_check + self._torrent_check_retry_interval * (2 ** retries)
+
+            self._check_retries_dict[infohash] = (torrent_id, retries)
+            results.append((torrent_id, infohash, seeders, leechers, last_check, next_check, status, retries))
 
-        # calculate next check time: <last-time> + <interval> * (2 ^ <retries>)
-        next_check = last_check + self._torrent_check_retry_interval * (2 ** retries)
+        self._torrent_db.updateTorrentCheckResults(results)
 
-        self._torrent_db.updateTorrentCheckResult(torrent_id,
-                                                  infohash, seeders, leechers, last_check, next_check,
-                                                  status, retries)
+        elapsed = time.time() - start_time
+        self._nr_flushed_results += len(results)
+        self._flush_time += elapsed
+        self._logger.debug(u"Flushed %d check results in %.3f seconds, %d results at %.1f results/s in total",
+                           len(results), elapsed, self._nr_flushed_results, self.flushed_results_per_second)
+
+    @property
+    def nr_flushed_results(self):
+        """
+        The number of check results written to the database.
+        """
+        return self._nr_flushed_results
+
+    @property
+    def flushed_results_per_second(self):
+        """
+        The number of check results written to the database per second spent writing them.
+        """
+        return self._nr_flushed_results / self._flush_time if self._flush_time else 0.0
@@ -7,19 +7,27 @@
 # Author: Elric Milon
 # Maintainer:
 # Created: Thu Nov  6 18:13:34 2014 (+0100)
+import heapq
 import logging
 import os
 from binascii import hexlify
+from collections import defaultdict
+from operator import itemgetter
 from shutil import rmtree
 from sqlite3 import Connection
 
 from Tribler.Category.Category import Category
-from Tribler.Core.CacheDB.SqliteCacheDBHandler import TorrentDBHandler
+from Tribler.Core.CacheDB.SqliteCacheDBHandler import (TorrentDBHandler, MIN_AUTOCOMPLETE_TERM_LENGTH,
+                                                       MAX_AUTOCOMPLETE_TERMS, MAX_KEYWORD_LENGTH)
 from Tribler.Core.CacheDB.db_versions import LOWEST_SUPPORTED_DB_VERSION, LATEST_DB_VERSION
 from Tribler.Core.CacheDB.sqlitecachedb import str2bin
 from Tribler.Core.TorrentDef import TorrentDef
 
 
+# the number of recovered torrents that are added to the database at once
+REIMPORT_BATCH_SIZE = 1000
+
+
 class VersionNoLongerSupportedError(Exception):
     pass
 
@@ -81,6 +89,10 @@ class DBUpgrader(object):
         if self.db.version == 27:
             self._upgrade_27_to_28()
 
+        # version 28 -> 29
+        if self.db.version == 28:
+            self._upgrade_28_to_29()
+
         # check if we managed to upgrade to the latest DB version.
         if self.db.version == LATEST_DB_VERSION:
             self.status_update_func(u"Database upgrade finished.")
@@ -517,6 +529,35 @@ DROP TABLE IF EXISTS MetaDataTypes;
         # update database version
         self.db.write_version(28)
 
+    def _upgrade_28_to_29(self):
+        self.status_update_func(u"Upgrading database from v%s to v%s..." % (28, 29))
+
+        self.status_update_func(u"Creating autocompletion terms table...")
+        self.db.execute(u"""
+CREATE TABLE IF NOT EXISTS TermFrequency (
+  term                  text    PRIMARY KEY,
+  freq                  integer NOT NULL DEFAULT 0
+);
+""")
+
+        # count the terms of the swarmnames that have been indexed so far
+        term_frequencies = defaultdict(int)
+        for swarmname, in self.db.execute(u"SELECT swarmname FROM FullTextIndex"):
+            for term in set((swarmname or u"").split()):
+                if MIN_AUTOCOMPLETE_TERM_LENGTH <= len(term) <= MAX_KEYWORD_LENGTH:
+                    term_frequencies[term] += 1
+
+        most_frequent = heapq.nlargest(MAX_AUTOCOMPLETE_TERMS, term_frequencies.iteritems(), key=itemgetter(1))
+        if most_frequent:
+            self.db.executemany(u"INSERT INTO TermFrequency (term, freq) VALUES (?, ?)", most_frequent)
+
+        # the torrents to check are selected by next_tracker_check
+        self.status_update_func(u"Creating torrent check index...")
+        self.db.execute(u"CREATE INDEX IF NOT EXISTS TorNextCheckIndex ON Torrent(next_tracker_check);")
+
+        # update database version
+        self.db.write_version(29)
+
     def reimport_torrents(self):
         """Import all torrent files in the collected torrent dir, all the files already in the database will be ignored.
         """
@@ -527,15 +568,22 @@ DROP TABLE IF EXISTS MetaDataTypes;
 
         # TODO(emilon): It would be nice to drop the corrupted torrent data from the store as a bonus.
         self.status_update_func("Registering recovered torrents...")
+        def add_torrents(torrentdefs):
+            for infohash in torrent_db_handler.addExternalTorrents(torrentdefs):
+                self.status_update_func(u"Registered recovered torrent: %s" % hexlify(infohash))
+
         try:
+            torrentdefs = []
             for infoshash_str, torrent_data in self.torrent_store.itervalues():
                 self.status_update_func("> %s" % infoshash_str)
                 torrentdef = TorrentDef.load_from_memory(torrent_data)
                 if torrentdef.is_finalized():
-                    infohash = torrentdef.get_infohash()
-                    if not torrent_db_handler.hasTorrent(infohash):
-                        self.status_update_func(u"Registering recovered torrent: %s" % hexlify(infohash))
-                        torrent_db_handler._addTorrentToDB(torrentdef, extra_info={"filename": infoshash_str})
+                    torrentdefs.append(torrentdef)
+
+                if len(torrentdefs) >= REIMPORT_BATCH_SIZE:
+                    add_torrents(torrentdefs)
+                    torrentdefs = []
+            add_torrents(torrentdefs)
         finally:
             torrent_db_handler.close()
             Category.delInstance()
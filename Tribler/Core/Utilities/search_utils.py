@@ -2,10 +2,19 @@
 # see LICENSE.txt for license information
 
 import re
+from math import log
+from struct import unpack_from
 
 RE_KEYWORD_SPLIT = re.compile(r"[\W_]", re.UNICODE)
 DIALOG_STOPWORDS = {'an', 'and', 'by', 'for', 'from', 'of', 'the', 'to', 'with'}
 
+# weights of the swarmname, filenames and fileextensions columns of the FullTextIndex
+FTS_COLUMN_WEIGHTS = (1.0, 0.5, 0.25)
+# term frequency saturation of BM25
+BM25_K1 = 1.2
+# how much the (positive) votes of the channel of a torrent weigh in compared to its seeders
+CHANNEL_VOTES_WEIGHT = 0.5
+
 
 def split_into_keywords(string, to_filter_stopwords=False):
     """
@@ -25,3 +34,51 @@ def split_into_keywords(string, to_filter_stopwords=False):
 
 def filter_keywords(keywords):
     return [kw for kw in keywords if len(kw) > 0 and kw not in DIALOG_STOPWORDS]
+
+
+def get_fts_match_columns(matchinfo, nr_keywords):
+    """
+    Returns, per column of the FullTextIndex, which of the first nr_keywords phrases of the query matched.
+    Matchinfo is documented at: http://www.sqlite.org/fts3.html#matchinfo
+    :param matchinfo: The result of Matchinfo(FullTextIndex) using the default 'pcx' format.
+    :param nr_keywords: The number of phrases to look at.
+    :return: A list with a list of booleans per column.
+    """
+    matchinfo = str(matchinfo)
+    num_phrases, num_cols = unpack_from('II', matchinfo)
+    hits = unpack_from('I' * (3 * num_cols * num_phrases), matchinfo, 8)
+    return [[bool(hits[3 * (col + phrase * num_cols)]) for phrase in xrange(min(num_phrases, nr_keywords))]
+            for col in xrange(num_cols)]
+
+
+def fts_rank(matchinfo, nr_documents, num_seeders, channel_votes):
+    """
+    Scores a FullTextIndex match, used as SQL function so SQLite can sort and paginate the search results.
+
+    The keywords are scored BM25-style per column, using the hit counts of the default 'pcx' matchinfo format.
+    FTS3 doesn't provide the length of the columns, so there is no length normalisation. The score is boosted by
+    the number of seeders and the votes of the channel the torrent is in.
+    :param matchinfo: The result of Matchinfo(FullTextIndex).
+    :param nr_documents: The (approximate) number of documents in the FullTextIndex.
+    :param num_seeders: The number of seeders of the torrent, or None.
+    :param channel_votes: The number of favorite minus spam votes of the channel of the torrent, or None.
+    :return: The score, higher is better.
+    """
+    matchinfo = str(matchinfo)
+    num_phrases, num_cols = unpack_from('II', matchinfo)
+    hits = unpack_from('I' * (3 * num_cols * num_phrases), matchinfo, 8)
+    nr_documents = max(nr_documents or 0, 1)
+
+    score = 0.0
+    for phrase in xrange(num_phrases):
+        for col in xrange(min(num_cols, len(FTS_COLUMN_WEIGHTS))):
+            index = 3 * (col + phrase * num_cols)
+            term_frequency = hits[index]
+            if term_frequency:
+                docs_with_hits = hits[index + 2]
+                idf = log(1.0 + (max(nr_documents - docs_with_hits, 0) + 0.5) / (docs_with_hits + 0.5))
+                score += FTS_COLUMN_WEIGHTS[col] * idf * term_frequency * (BM25_K1 + 1) / (term_frequency + BM25_K1)
+
+    score *= 1.0 + log(1 + max(num_seeders or 0, 0))
+    score *= 1.0 + CHANNEL_VOTES_WEIGHT * log(1 + max(channel_votes or 0, 0))
+    return score
@@ -0,0 +1,111 @@
+from collections import defaultdict
+from threading import RLock
+
+
+def levenshtein(a, b, max_distance=None):
+    """
+    Calculates the Levenshtein distance between a and b.
+    :param max_distance: If given, stop as soon as the distance is known to exceed max_distance.
+    :return: The distance, or max_distance + 1 if the distance exceeds max_distance.
+    """
+    if len(a) > len(b):
+        # make sure a is the shortest, to use O(min(n, m)) space
+        a, b = b, a
+
+    if max_distance is not None and len(b) - len(a) > max_distance:
+        return max_distance + 1
+
+    current = range(len(a) + 1)
+    for i in xrange(1, len(b) + 1):
+        previous, current = current, [i] + [0] * len(a)
+        for j in xrange(1, len(a) + 1):
+            change = previous[j - 1] + (a[j - 1] != b[i - 1])
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, change)
+
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+
+    return current[len(a)]
+
+
+class SymmetricDeleteIndex(object):
+
+    """
+    Spelling correction index using the symmetric delete algorithm. Every term is stored under all strings that can
+    be made by deleting up to max_distance characters from its prefix, so a lookup only needs the deletes of the
+    misspelled word instead of comparing it with the whole vocabulary.
+    """
+
+    def __init__(self, max_distance=2, prefix_length=7, max_terms=10000):
+        """
+        :param max_distance: The maximum edit distance of a suggestion.
+        :param prefix_length: The number of characters of a term that are indexed, bounds the number of deletes.
+        :param max_terms: The maximum number of terms in the index, terms added after that are ignored.
+        """
+        self._lock = RLock()
+        self._max_distance = max_distance
+        self._prefix_length = prefix_length
+        self._max_terms = max_terms
+
+        self._frequencies = {}
+        self._deletes = defaultdict(list)
+
+    def __len__(self):
+        return len(self._frequencies)
+
+    def __contains__(self, term):
+        return term in self._frequencies
+
+    def add(self, term, frequency=1):
+        """
+        Adds a term to the index, or increases its frequency if it is already known.
+        :return: False if the index is full and the term was not added, True otherwise.
+        """
+        with self._lock:
+            if term in self._frequencies:
+                self._frequencies[term] += frequency
+                return True
+
+            if len(self._frequencies) >= self._max_terms:
+                return False
+
+            self._frequencies[term] = frequency
+            for delete in self._get_deletes(term[:self._prefix_length]):
+                self._deletes[delete].append(term)
+            return True
+
+    def lookup(self, word, max_results=5):
+        """
+        Returns the terms within max_distance edits of word, closest and then most frequent first.
+        :param word: The (misspelled) word.
+        :param max_results: The maximum number of terms to return.
+        :return: A list of terms, word itself is the first one if it is in the index.
+        """
+        with self._lock:
+            candidates = set()
+            for delete in self._get_deletes(word[:self._prefix_length]):
+                candidates.update(self._deletes.get(delete, ()))
+            frequencies = [(candidate, self._frequencies[candidate]) for candidate in candidates]
+
+        results = []
+        for candidate, frequency in frequencies:
+            distance = levenshtein(word, candidate, self._max_distance)
+            if distance <= self._max_distance:
+                results.append((distance, -frequency, candidate))
+
+        results.sort()
+        return [candidate for _, _, candidate in results[:max_results]]
+
+    def _get_deletes(self, word):
+        deletes = {word}
+        edits = [word]
+        for _ in xrange(self._max_distance):
+            new_edits = []
+            for edit in edits:
+                for i in xrange(len(edit)):
+                    delete = edit[:i] + edit[i + 1:]
+                    if delete not in deletes:
+                        deletes.add(delete)
+                        new_edits.append(delete)
+            edits = new_edits
+        return deletes
@@ -78,7 +78,13 @@ def get_uniformed_tracker_url(tracker_url):
         return uniformed_url
 
 
-def parse_tracker_url(tracker_url):
+def parse_tracker_url(tracker_url, resolve=True):
+    """
+    Splits a tracker URL into its type, address and announce page.
+    :param tracker_url: The tracker URL.
+    :param resolve: Whether to resolve the hostname, this blocks so do not use it on the reactor thread.
+    :return: A (tracker type, (host, port), announce page) tuple.
+    """
     # get tracker type
     if tracker_url.startswith(u'http'):
         tracker_type = u'HTTP'
@@ -112,10 +118,10 @@ def parse_tracker_url(tracker_url):
     else:
         raise RuntimeError(u'No port number for UDP tracker URL.')
 
-    # TODO(emilon): A URL parser shoudn't have a blocking host resolution on it.
-    try:
-        hostname = socket.gethostbyname(hostname)
-    except:
-        raise RuntimeError(u'Cannot resolve tracker URL.')
+    if resolve:
+        try:
+            hostname = socket.gethostbyname(hostname)
+        except:
+            raise RuntimeError(u'Cannot resolve tracker URL.')
 
     return tracker_type, (hostname, port), announce_page
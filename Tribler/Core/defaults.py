@@ -57,6 +57,7 @@ sessdefaults['general']['timeout'] = 300.0
 sessdefaults['general']['timeout_check_interval'] = 60.0
 sessdefaults['general']['eckeypairfilename'] = None
 sessdefaults['general']['megacache'] = True
+sessdefaults['general']['profile_sql'] = False
 sessdefaults['general']['nickname'] = 'Tribler User'
 sessdefaults['general']['mugshot'] = None
 sessdefaults['general']['videoanalyserpath'] = None
@@ -114,6 +115,7 @@ sessdefaults['libtorrent']['lt_proxytype'] = 0  # no proxy server is used by def
 sessdefaults['libtorrent']['lt_proxyserver'] = None
 sessdefaults['libtorrent']['lt_proxyauth'] = None
 sessdefaults['libtorrent']['utp'] = True
+sessdefaults['libtorrent']['max_metainfo_requests'] = 50
 
 # Anonymous libtorrent
 sessdefaults['libtorrent']['anon_listen_port'] = -1
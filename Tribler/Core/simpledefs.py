@@ -28,6 +28,11 @@ DOWNLOAD = 'down'
 DLMODE_NORMAL = 0
 DLMODE_VOD = 1
 
+# Priorities of metainfo requests to LibtorrentMgr, lower is more urgent
+METAINFO_PRIORITY_USER = 0
+METAINFO_PRIORITY_DEFAULT = 1
+METAINFO_PRIORITY_BACKGROUND = 2
+
 PERSISTENTSTATE_CURRENTVERSION = 5
 """
 V1 = SwarmPlayer 1.0.0
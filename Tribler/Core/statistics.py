@@ -34,6 +34,15 @@ class TriblerStatistics(object):
         dispersy.statistics.update()
 
         data_dict = {u'communities': self._create_community_data(dispersy)}
+
+        if self._session.sqlite_db is not None:
+            query_profile = self._session.sqlite_db.get_query_profile()
+            if query_profile is not None:
+                data_dict[u'database'] = query_profile
+
+        if self._session.lm.ltmgr is not None:
+            data_dict[u'metainfo requests'] = self._session.lm.ltmgr.get_metainfo_stats()
+            data_dict[u'libtorrent alerts'] = self._session.lm.ltmgr.get_alert_stats()
         return data_dict
 
     def _create_community_data(self, dispersy):
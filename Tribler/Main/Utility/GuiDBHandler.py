@@ -12,6 +12,7 @@ from traceback import extract_stack, format_exc, print_exc, print_stack
 
 import wx
 from twisted.internet import reactor
+from twisted.internet.defer import Deferred
 from twisted.python.threadable import isInIOThread
 from wx.lib.delayedresult import AbortedException, SenderCallAfter, SenderNoWx, SenderWxEvent
 
@@ -128,6 +129,21 @@ class GUIDBProducer(object):
                 sender.sendException(exc, originalTb)
                 return
 
+            # workerFn can be one of the *_async DBHandler methods, in which case the result is sent once the
+            # Deferred fires instead of blocking this thread
+            if isinstance(result, Deferred):
+                def on_failure(failure):
+                    sender.sendException(failure.value, failure.getTraceback())
+
+                # Deferreds are not thread safe, they should only be touched on the reactor thread
+                if isInIOThread():
+                    result.addCallbacks(lambda result: deliver(result, t2), on_failure)
+                else:
+                    reactor.callFromThread(result.addCallbacks, lambda result: deliver(result, t2), on_failure)
+            else:
+                deliver(result, t2)
+
+        def deliver(result, t2):
             t3 = time()
             self._logger.debug(
                 "GUIDBHandler: Task(%s) took to be called %.1f (expected %.1f), actual task took %.1f %s", name, t2 - t1, delay, t3 - t2, workerType)
@@ -16,6 +16,7 @@ from Tribler.Main.vwxGUI.widgets import _set_font, NotebookPanel, SimpleNotebook
 from Tribler.Category.Category import Category
 from Tribler.Core.TorrentDef import TorrentDef
 from Tribler.Core.CacheDB.sqlitecachedb import forceDBThread
+from Tribler.Core.simpledefs import METAINFO_PRIORITY_USER
 
 from Tribler.Main.vwxGUI import (CHANNEL_MAX_NON_FAVORITE, warnWxThread, LIST_GREY, LIST_LIGHTBLUE, LIST_DESELECTED,
                                  DEFAULT_BACKGROUND, format_time, showError)
@@ -979,7 +980,8 @@ class ManageChannelFilesManager(BaseManager):
     def startDownloadFromMagnet(self, url, *args, **kwargs):
         try:
             callback = lambda meta_info: self.AddTDef(TorrentDef.load_from_dict(meta_info))
-            self.guiutility.utility.session.lm.ltmgr.get_metainfo(url, callback, timeout=300)
+            self.guiutility.utility.session.lm.ltmgr.get_metainfo(url, callback, timeout=300,
+                                                                  priority=METAINFO_PRIORITY_USER)
             return True
 
         except:
@@ -0,0 +1,55 @@
+from Tribler.Core.TorrentChecker.check_scheduler import TorrentCheckScheduler
+from Tribler.Core.TorrentChecker.session import MAX_TRACKER_MULTI_SCRAPE
+from Tribler.Test.Core.base_test import TriblerCoreTest
+
+
+class TriblerCoreTestCheckScheduler(TriblerCoreTest):
+
+    def test_priority(self):
+        get_priority = TorrentCheckScheduler.get_priority
+        self.assertLess(get_priority(100, 0, 0), get_priority(200, 0, 0))
+        self.assertLess(get_priority(100, 50, 0), get_priority(100, 0, 0))
+        self.assertLess(get_priority(100, 0, 0), get_priority(100, 0, 1))
+
+    def test_add_check(self):
+        scheduler = TorrentCheckScheduler(max_scheduled_checks=2)
+        self.assertTrue(scheduler.add_check('a' * 20, u'udp://tracker:80', 1))
+        self.assertFalse(scheduler.add_check('a' * 20, u'udp://tracker:80', 1))
+        self.assertTrue(scheduler.add_check('a' * 20, u'DHT', 1))
+        self.assertFalse(scheduler.add_check('b' * 20, u'DHT', 1))
+        self.assertEqual(scheduler.nr_free_slots, 0)
+
+    def test_get_batches(self):
+        scheduler = TorrentCheckScheduler(max_sessions_per_tracker=1, min_tracker_session_interval=5)
+        for i in xrange(MAX_TRACKER_MULTI_SCRAPE + 1):
+            scheduler.add_check(str(i), u'udp://tracker:80', i)
+        scheduler.add_check('x', u'udp://dead:80', 0)
+
+        batches = scheduler.get_batches(100, lambda tracker_url: tracker_url != u'udp://dead:80')
+        self.assertEqual(len(batches), 1)
+        tracker_url, infohash_list = batches[0]
+        self.assertEqual(tracker_url, u'udp://tracker:80')
+        self.assertEqual(infohash_list, [str(i) for i in xrange(MAX_TRACKER_MULTI_SCRAPE)])
+        self.assertEqual(len(scheduler), 1)
+
+        # the tracker is busy
+        self.assertEqual(scheduler.get_batches(200, lambda _: True), [])
+
+        # and is not contacted again too soon
+        scheduler.on_session_done(tracker_url, infohash_list)
+        self.assertEqual(scheduler.get_batches(101, lambda _: True), [])
+        self.assertEqual(scheduler.get_batches(105, lambda _: True),
+                         [(u'udp://tracker:80', [str(MAX_TRACKER_MULTI_SCRAPE)])])
+
+        # finished checks can be scheduled again
+        self.assertTrue(scheduler.add_check('0', u'udp://tracker:80', 0))
+        self.assertFalse(scheduler.add_check(str(MAX_TRACKER_MULTI_SCRAPE), u'udp://tracker:80', 0))
+
+    def test_max_active_sessions(self):
+        scheduler = TorrentCheckScheduler(max_active_sessions=2)
+        for tracker_url in (u'udp://a:80', u'udp://b:80', u'udp://c:80'):
+            scheduler.add_check('a' * 20, tracker_url, 0)
+
+        self.assertEqual(len(scheduler.get_batches(100, lambda _: True)), 2)
+        self.assertEqual(scheduler.nr_active_sessions, 2)
+        self.assertEqual(len(scheduler), 1)
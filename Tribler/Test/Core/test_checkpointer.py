@@ -0,0 +1,66 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from twisted.internet.task import Clock
+
+from Tribler.Core.APIImplementation.checkpointer import DownloadCheckpointer
+from Tribler.Core.Utilities.configparser import CallbackConfigParser
+from Tribler.Test.Core.base_test import TriblerCoreTest
+
+
+class ClockedDownloadCheckpointer(DownloadCheckpointer):
+    _reactor = Clock()
+
+
+class TriblerCoreTestDownloadCheckpointer(TriblerCoreTest):
+
+    def setUp(self):
+        self.pstate_dir = mkdtemp(prefix=__name__)
+        self.checkpointer = ClockedDownloadCheckpointer(self.pstate_dir, write_interval=1, writes_per_round=2)
+
+    def tearDown(self):
+        self.checkpointer.cancel_all_pending_tasks()
+        rmtree(self.pstate_dir)
+
+    @staticmethod
+    def create_pstate(value):
+        pstate = CallbackConfigParser()
+        pstate.add_section('state')
+        pstate.set('state', 'value', value)
+        return pstate
+
+    def read_value(self, infohash):
+        pstate = CallbackConfigParser()
+        pstate.read_file(self.checkpointer.get_pstate_filename(infohash))
+        return pstate.get('state', 'value')
+
+    def test_spread_writes(self):
+        for i in xrange(5):
+            self.checkpointer.schedule_write(str(i) * 20, self.create_pstate(i))
+        self.assertEqual(len(self.checkpointer), 5)
+
+        self.checkpointer._reactor.advance(1)
+        self.assertEqual(self.checkpointer.nr_written, 2)
+        self.assertEqual(self.read_value("0" * 20), 0)
+
+        self.checkpointer._reactor.advance(2)
+        self.assertEqual(self.checkpointer.nr_written, 5)
+        self.assertEqual(len(self.checkpointer), 0)
+        self.assertFalse([filename for filename in os.listdir(self.pstate_dir) if filename.endswith('.tmp')])
+
+    def test_replace_pending_write(self):
+        self.checkpointer.schedule_write("a" * 20, self.create_pstate(1))
+        self.checkpointer.schedule_write("a" * 20, self.create_pstate(2))
+        self.assertEqual(len(self.checkpointer), 1)
+        self.assertEqual(self.checkpointer.nr_replaced, 1)
+
+        self.checkpointer.flush()
+        self.assertEqual(self.checkpointer.nr_written, 1)
+        self.assertEqual(self.read_value("a" * 20), 2)
+
+    def test_cancel_write(self):
+        self.checkpointer.schedule_write("a" * 20, self.create_pstate(1))
+        self.checkpointer.cancel_write("a" * 20)
+        self.checkpointer.shutdown()
+        self.assertFalse(os.path.exists(self.checkpointer.get_pstate_filename("a" * 20)))
@@ -0,0 +1,86 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import RLock
+
+from twisted.internet.task import Clock
+
+from Tribler.Core.APIImplementation.LaunchManyCore import (TriblerLaunchMany, RESUME_ADD_BATCH_INTERVAL,
+                                                           RESUME_ADD_BATCH_SIZE)
+from Tribler.Core.TorrentDef import TorrentDefNoMetainfo
+from Tribler.Core.Utilities.configparser import CallbackConfigParser
+from Tribler.Core.simpledefs import DLSTATUS_DOWNLOADING, DLSTATUS_SEEDING, DLSTATUS_STOPPED, DLSTATUS_STOPPED_ON_ERROR
+from Tribler.Test.Core.base_test import TriblerCoreTest
+
+
+class TriblerCoreTestLaunchManyCheckpoints(TriblerCoreTest):
+
+    def setUp(self):
+        self.pstate_dir = mkdtemp(prefix=__name__)
+        self.lm = TriblerLaunchMany()
+        self.lm._reactor = Clock()
+        self.lm.sesslock = RLock()
+
+        self.resumed = []
+        self.lm._resume_download = lambda filename, *args: self.resumed.append(filename)
+
+    def tearDown(self):
+        self.lm.cancel_all_pending_tasks()
+        rmtree(self.pstate_dir)
+
+    @staticmethod
+    def create_pstate(status):
+        pstate = CallbackConfigParser()
+        pstate.add_section('state')
+        pstate.set('state', 'dlstate', {'status': status})
+        return pstate
+
+    def write_pstate(self, infohash, status):
+        pstate = self.create_pstate(status)
+        pstate.set('state', 'metainfo', {'infohash': infohash, 'name': 'test'})
+        filename = os.path.join(self.pstate_dir, infohash.encode('hex') + '.state')
+        pstate.write_file(filename)
+        return filename
+
+    def test_get_resume_priority(self):
+        get_priority = TriblerLaunchMany._get_resume_priority
+        self.assertEqual(get_priority(self.create_pstate(DLSTATUS_DOWNLOADING), None), 0)
+        self.assertEqual(get_priority(self.create_pstate(DLSTATUS_SEEDING), None), 1)
+        self.assertEqual(get_priority(self.create_pstate(DLSTATUS_STOPPED), None), 2)
+        self.assertEqual(get_priority(self.create_pstate(DLSTATUS_STOPPED_ON_ERROR), None), 2)
+
+        # downloads that are started stopped come last, whatever their state
+        self.assertEqual(get_priority(self.create_pstate(DLSTATUS_DOWNLOADING), DLSTATUS_STOPPED), 2)
+
+        # invalid pstates are resumed first, so resume_download can fall back on the torrent store
+        self.assertEqual(get_priority(None, None), 0)
+        self.assertEqual(get_priority(CallbackConfigParser(), None), 0)
+
+    def test_read_checkpoints(self):
+        filename = self.write_pstate("a" * 20, DLSTATUS_SEEDING)
+        invalid_filename = os.path.join(self.pstate_dir, "b" * 40 + '.state')
+        with open(invalid_filename, 'w') as invalid_file:
+            invalid_file.write("invalid")
+
+        (filename1, tdef, dscfg, pstate), (filename2, tdef2, dscfg2, _) = \
+            self.lm._read_checkpoints([filename, invalid_filename])
+        self.assertEqual((filename1, filename2), (filename, invalid_filename))
+        self.assertIsInstance(tdef, TorrentDefNoMetainfo)
+        self.assertEqual(tdef.get_infohash(), "a" * 20)
+        self.assertEqual(TriblerLaunchMany._get_resume_priority(pstate, None), 1)
+        self.assertIsNotNone(dscfg)
+        self.assertIsNone(tdef2)
+        self.assertIsNone(dscfg2)
+
+    def test_resume_checkpoints(self):
+        nr_downloads = RESUME_ADD_BATCH_SIZE * 2 + 1
+        resume_list = [(0, str(i), None, None, None) for i in xrange(nr_downloads)]
+        self.lm._resume_checkpoints(resume_list, None, {}, 0)
+        self.assertEqual(self.resumed, [str(i) for i in xrange(RESUME_ADD_BATCH_SIZE)])
+
+        # the other batches are resumed in later reactor iterations, in order
+        self.lm._reactor.advance(RESUME_ADD_BATCH_INTERVAL)
+        self.assertEqual(len(self.resumed), RESUME_ADD_BATCH_SIZE * 2)
+        self.lm._reactor.advance(RESUME_ADD_BATCH_INTERVAL)
+        self.assertEqual(self.resumed, [str(i) for i in xrange(nr_downloads)])
+        self.assertFalse(self.lm._reactor.getDelayedCalls())
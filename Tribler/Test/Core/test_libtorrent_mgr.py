@@ -0,0 +1,163 @@
+from binascii import hexlify
+
+from Tribler.Core.Libtorrent.LibtorrentMgr import LibtorrentMgr
+from Tribler.Core.simpledefs import METAINFO_PRIORITY_BACKGROUND, METAINFO_PRIORITY_USER
+from Tribler.Test.Core.base_test import TriblerCoreTest
+
+
+class MockThreadPool(object):
+
+    def __init__(self):
+        self.tasks = []
+
+    def add_task(self, task, delay=0):
+        self.tasks.append((delay, task))
+
+    def call_in_thread(self, delay, func, *args):
+        func(*args)
+
+
+class MockNotifier(object):
+
+    def notify(self, *args):
+        pass
+
+
+class MockLaunchManager(object):
+
+    def __init__(self):
+        self.threadpool = MockThreadPool()
+
+
+class MockSession(object):
+
+    def __init__(self, max_metainfo_requests):
+        self.notifier = MockNotifier()
+        self.lm = MockLaunchManager()
+        self.max_metainfo_requests = max_metainfo_requests
+
+    def get_libtorrent_max_metainfo_requests(self):
+        return self.max_metainfo_requests
+
+
+class MockHandle(object):
+
+    def __init__(self, infohash):
+        self.infohash = infohash
+
+    def is_valid(self):
+        return True
+
+    def info_hash(self):
+        return self.infohash
+
+
+class MockLtSession(object):
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+
+    def add_torrent(self, atp):
+        handle = MockHandle(atp['ti'].info_hash() if 'ti' in atp else None)
+        self.added.append(handle)
+        return handle
+
+    def remove_torrent(self, handle, option):
+        self.removed.append(handle)
+
+
+class MockTorrentInfo(object):
+
+    def __init__(self, infohash):
+        self.infohash = infohash
+
+    def info_hash(self):
+        return self.infohash
+
+
+class MockMetainfoCache(object):
+
+    def get(self, infohash, use_store=True):
+        return None
+
+
+class TriblerCoreTestMetainfoRequests(TriblerCoreTest):
+
+    def setUp(self):
+        self.session = MockSession(2)
+        self.ltmgr = LibtorrentMgr(self.session)
+        self.ltmgr.ltsessions[0] = self.ltsession = MockLtSession()
+        self.ltmgr.metainfo_cache = MockMetainfoCache()
+        self.ltmgr.dht_ready = True
+        self.timed_out = []
+
+    def get_metainfo(self, char, priority=METAINFO_PRIORITY_BACKGROUND, callback=None):
+        self.ltmgr.get_metainfo(char * 20, callback or (lambda _: None), timeout=30,
+                                timeout_callback=self.timed_out.append, priority=priority)
+
+    def test_slots(self):
+        for char in "abc":
+            self.get_metainfo(char)
+        self.assertEqual(sorted(self.ltmgr.metainfo_requests), [hexlify("a" * 20), hexlify("b" * 20)])
+        self.assertEqual(self.ltmgr.waiting_metainfo_requests.keys(), [hexlify("c" * 20)])
+
+        # a finished request frees its slot for the waiting one
+        self.ltmgr.got_metainfo(hexlify("a" * 20), timeout=True)
+        self.assertEqual(sorted(self.ltmgr.metainfo_requests), [hexlify("b" * 20), hexlify("c" * 20)])
+        self.assertEqual(self.timed_out, ["a" * 20])
+
+        stats = self.ltmgr.get_metainfo_stats()
+        self.assertEqual((stats['requested'], stats['started'], stats['running'], stats['waiting']), (3, 3, 2, 0))
+        self.assertEqual(len(self.ltsession.added), 3)
+        self.assertEqual(len(self.ltsession.removed), 1)
+
+    def test_priority_bump(self):
+        for char in "abcd":
+            self.get_metainfo(char)
+
+        # d is requested again with a higher priority and overtakes c
+        self.get_metainfo("d", priority=METAINFO_PRIORITY_USER)
+        self.ltmgr.got_metainfo(hexlify("a" * 20), timeout=True)
+        self.assertIn(hexlify("d" * 20), self.ltmgr.metainfo_requests)
+        self.assertEqual(self.ltmgr.waiting_metainfo_requests.keys(), [hexlify("c" * 20)])
+
+    def test_merged_callbacks(self):
+        callback1 = lambda _: None
+        callback2 = lambda _: None
+        self.get_metainfo("a", callback=callback1)
+        self.get_metainfo("a", callback=callback2)
+        self.get_metainfo("a", callback=callback2)
+
+        self.assertEqual(len(self.ltsession.added), 1)
+        self.assertEqual(self.ltmgr.metainfo_requests[hexlify("a" * 20)]['callbacks'], [callback1, callback2])
+        self.ltmgr.got_metainfo(hexlify("a" * 20), timeout=True)
+        self.assertEqual(self.timed_out, ["a" * 20])
+
+    def test_waiting_timeout(self):
+        for char in "abc":
+            self.get_metainfo(char)
+
+        # every request schedules a timeout for the time it waits for a slot
+        self.assertEqual([delay for delay, _ in self.session.lm.threadpool.tasks], [30, 30, 30, 30, 30])
+        tasks = [task for _, task in self.session.lm.threadpool.tasks]
+
+        # the requests that got a slot are not affected
+        tasks[0]()
+        self.assertIn(hexlify("a" * 20), self.ltmgr.metainfo_requests)
+
+        tasks[-1]()
+        self.assertFalse(self.ltmgr.waiting_metainfo_requests)
+        self.assertEqual(self.timed_out, ["c" * 20])
+        self.assertEqual(self.ltmgr.get_metainfo_stats()['timed_out'], 1)
+
+    def test_add_torrent_drops_requests(self):
+        for char in "abc":
+            self.get_metainfo(char)
+
+        self.ltmgr.add_torrent(None, {'ti': MockTorrentInfo(hexlify("c" * 20))})
+        self.ltmgr.add_torrent(None, {'ti': MockTorrentInfo(hexlify("a" * 20))})
+        self.assertEqual(sorted(self.timed_out), ["a" * 20, "c" * 20])
+        self.assertEqual(self.ltmgr.metainfo_requests.keys(), [hexlify("b" * 20)])
+        self.assertFalse(self.ltmgr.waiting_metainfo_requests)
+        self.assertEqual(sorted(self.ltmgr.torrents), [hexlify("a" * 20), hexlify("c" * 20)])
@@ -0,0 +1,62 @@
+from libtorrent import bdecode, bencode
+
+from Tribler.Core.Libtorrent.metainfo_cache import MetainfoCache
+from Tribler.Test.Core.base_test import TriblerCoreTest
+
+
+class TriblerCoreTestMetainfoCache(TriblerCoreTest):
+
+    METAINFO = {"info": {"name": "test", "piece length": 16384, "pieces": "a" * 20, "length": 100},
+                "announce": "http://tracker.example.com/announce",
+                "initial peers": ["127.0.0.1"], "seeders": 1, "leechers": 0}
+
+    def test_get_put(self):
+        cache = MetainfoCache()
+        self.assertIsNone(cache.get("a" * 40))
+
+        self.assertEqual(bdecode(cache.put("a" * 40, self.METAINFO)), self.METAINFO)
+        metainfo = cache.get("a" * 40)
+        self.assertEqual(metainfo, self.METAINFO)
+
+        # every lookup returns a new dict
+        metainfo["info"]["name"] = "changed"
+        self.assertEqual(cache.get("a" * 40), self.METAINFO)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_size_limit(self):
+        cache = MetainfoCache(max_size=1000)
+        for i in xrange(10):
+            cache.put(str(i) * 40, self.METAINFO)
+            cache.get("0" * 40)
+
+        self.assertLessEqual(cache.size, 1000)
+        self.assertLess(len(cache), 10)
+        # the most recently used entries are kept
+        self.assertIn("0" * 40, cache)
+        self.assertIn("9" * 40, cache)
+        self.assertNotIn("1" * 40, cache)
+
+    def test_expire(self):
+        cache = MetainfoCache(expiration_time=-1)
+        cache.put("a" * 40, self.METAINFO)
+        cache.expire()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_torrent_store(self):
+        torrent_store = {"a" * 40: bencode({"info": self.METAINFO["info"]})}
+        cache = MetainfoCache(torrent_store, expiration_time=-1)
+
+        # torrents from the store come without the swarm information
+        metainfo = cache.get("a" * 40)
+        self.assertEqual(metainfo["info"], self.METAINFO["info"])
+        self.assertNotIn("seeders", metainfo)
+        self.assertEqual(cache.store_hits, 1)
+        self.assertIsNone(cache.get("a" * 40, use_store=False))
+
+        # the cache never writes to the store, that is left to RemoteTorrentHandler.save_torrent
+        cache.put("b" * 40, self.METAINFO)
+        self.assertEqual(torrent_store.keys(), ["a" * 40])
+
+        cache.detach_torrent_store()
+        self.assertIsNone(cache.get("a" * 40))
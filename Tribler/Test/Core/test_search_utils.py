@@ -1,4 +1,6 @@
-from Tribler.Core.Utilities.search_utils import split_into_keywords, filter_keywords
+from struct import pack
+
+from Tribler.Core.Utilities.search_utils import split_into_keywords, filter_keywords, fts_rank, get_fts_match_columns
 from Tribler.Test.Core.base_test import TriblerCoreTest
 
 
@@ -17,3 +19,28 @@ class TriblerCoreTestSearchUtils(TriblerCoreTest):
         result = filter_keywords(["to", "be", "or", "not", "to", "be"])
         self.assertIsInstance(result, list)
         self.assertEqual(len(result), 4)
+
+    @staticmethod
+    def create_matchinfo(hits):
+        """ Creates a 'pcx' matchinfo blob for one phrase with (hits in row, hits in all rows, docs with hits)
+            per column.
+        """
+        values = [1, len(hits)] + [value for column_hits in hits for value in column_hits]
+        return buffer(pack('I' * len(values), *values))
+
+    def test_get_fts_match_columns(self):
+        matchinfo = self.create_matchinfo([(1, 10, 5), (0, 3, 2), (2, 2, 1)])
+        self.assertEqual(get_fts_match_columns(matchinfo, 1), [[True], [False], [True]])
+        self.assertEqual(get_fts_match_columns(matchinfo, 0), [[], [], []])
+
+    def test_fts_rank(self):
+        in_name = self.create_matchinfo([(1, 10, 5), (0, 0, 0), (0, 0, 0)])
+        in_files = self.create_matchinfo([(0, 0, 0), (1, 10, 5), (0, 0, 0)])
+        self.assertGreater(fts_rank(in_name, 1000, 0, 0), fts_rank(in_files, 1000, 0, 0))
+
+        rare = self.create_matchinfo([(1, 2, 2), (0, 0, 0), (0, 0, 0)])
+        self.assertGreater(fts_rank(rare, 1000, 0, 0), fts_rank(in_name, 1000, 0, 0))
+
+        self.assertGreater(fts_rank(in_name, 1000, 10, 0), fts_rank(in_name, 1000, 0, 0))
+        self.assertGreater(fts_rank(in_name, 1000, 0, 10), fts_rank(in_name, 1000, None, None))
+        self.assertEqual(fts_rank(in_name, 1000, -1, -5), fts_rank(in_name, 1000, 0, 0))
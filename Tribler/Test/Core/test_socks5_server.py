@@ -0,0 +1,134 @@
+import logging
+import time
+
+from Tribler.community.tunnel import CIRCUIT_STATE_READY, CIRCUIT_TYPE_DATA
+from Tribler.community.tunnel.Socks5 import conversion
+from Tribler.community.tunnel.Socks5.server import Socks5Server, SocksUDPConnection
+from Tribler.Test.Core.base_test import TriblerCoreTest
+
+
+class MockCircuit(object):
+
+    def __init__(self, circuit_id):
+        self.circuit_id = circuit_id
+        self.state = CIRCUIT_STATE_READY
+        self.ctype = CIRCUIT_TYPE_DATA
+        self.goal_hops = 1
+        self.nr_sent = 0
+
+    def tunnel_data(self, destination, payload):
+        self.nr_sent += 1
+
+
+class MockSelectionStrategy(object):
+
+    def __init__(self, circuits):
+        self.circuits = circuits
+        self.index = -1
+
+    def has_options(self, hops):
+        return True
+
+    def select(self, destination, hops):
+        self.index = (self.index + 1) % len(self.circuits)
+        return self.circuits[self.index]
+
+
+class MockCommunity(object):
+
+    def __init__(self, circuits):
+        self.selection_strategy = MockSelectionStrategy(circuits)
+
+
+class MockTransport(object):
+
+    def __init__(self):
+        self.nr_written = 0
+
+    def write(self, data, address=None):
+        self.nr_written += 1
+
+    def loseConnection(self):
+        pass
+
+
+class TriblerCoreTestSocks5Server(TriblerCoreTest):
+
+    def setUp(self):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.circuits = [MockCircuit(circuit_id) for circuit_id in xrange(4)]
+        self.server = Socks5Server(MockCommunity(self.circuits), [])
+        self.sessions = [self.server.buildProtocol(None, 1) for _ in xrange(10)]
+        for session in self.sessions:
+            session.transport = MockTransport()
+
+        self.udp_connection = SocksUDPConnection(self.sessions[0], ("127.0.0.1", 1234))
+        self.udp_connection.transport = MockTransport()
+        self.sessions[0]._udp_socket = self.udp_connection
+
+    def tearDown(self):
+        self.udp_connection.close()
+
+    @staticmethod
+    def encode_datagram(port):
+        return conversion.encode_udp_packet(0, 0, conversion.ADDRESS_TYPE_IPV4, "1.2.3.4", port, "x" * 1024)
+
+    def test_indexes(self):
+        session = self.sessions[0]
+        for port in xrange(8):
+            session.select(("1.2.3.4", port))
+
+        self.assertEqual(session.circuit_destinations[self.circuits[0]], {("1.2.3.4", 0), ("1.2.3.4", 4)})
+        self.assertEqual(self.server.circuit_sessions[self.circuits[0]], {session})
+        self.assertEqual(self.server.get_destination_counts()[0], 2)
+
+        # a destination that receives data over another circuit moves to that circuit
+        session.on_incoming_from_tunnel(None, self.circuits[1], ("1.2.3.4", 0), "data")
+        self.assertEqual(session.destinations[("1.2.3.4", 0)], self.circuits[1])
+        self.assertEqual(session.circuit_destinations[self.circuits[0]], {("1.2.3.4", 4)})
+
+        self.assertEqual(self.server.circuit_dead(self.circuits[0]), {("1.2.3.4", 4)})
+        self.assertNotIn(self.circuits[0], session.circuit_destinations)
+        self.assertNotIn(self.circuits[0], self.server.circuit_sessions)
+
+        self.server.connectionLost(session)
+        self.assertFalse(self.server.circuit_sessions)
+
+    def test_incoming_unknown_circuit(self):
+        self.sessions[0].select(("1.2.3.4", 1))
+        self.server.on_incoming_from_tunnel(None, self.circuits[1], ("1.2.3.4", 1), "data")
+        self.assertEqual(self.udp_connection.transport.nr_written, 0)
+
+        self.server.on_incoming_from_tunnel(None, self.circuits[0], ("1.2.3.4", 1), "data")
+        self.assertEqual(self.udp_connection.transport.nr_written, 1)
+
+    def test_datagram_throughput(self):
+        """
+        Benchmark of the socks5 path: sends datagrams from libtorrent into the tunnel and back through
+        SocksUDPConnection, and reports how many datagrams per second are handled.
+        """
+        nr_datagrams = 20000
+        nr_destinations = 1000
+        datagrams = [self.encode_datagram(port) for port in xrange(nr_destinations)]
+
+        # destinations on circuits of other sessions should not slow down the lookup
+        for session in self.sessions[1:]:
+            for port in xrange(nr_destinations):
+                session.select(("5.6.7.8", port))
+
+        start_time = time.time()
+        for i in xrange(nr_datagrams):
+            self.udp_connection.datagramReceived(datagrams[i % nr_destinations], ("127.0.0.1", 1234))
+        outgoing_duration = max(time.time() - start_time, 0.001)
+
+        start_time = time.time()
+        for i in xrange(nr_datagrams):
+            session = self.sessions[0]
+            destination = ("1.2.3.4", i % nr_destinations)
+            self.server.on_incoming_from_tunnel(None, session.destinations[destination], destination, "x" * 1024)
+        incoming_duration = max(time.time() - start_time, 0.001)
+
+        self._logger.info("%.0f datagrams/second into the tunnel, %.0f datagrams/second out of the tunnel",
+                          nr_datagrams / outgoing_duration, nr_datagrams / incoming_duration)
+        self.assertEqual(sum(circuit.nr_sent for circuit in self.circuits), nr_datagrams)
+        self.assertEqual(self.udp_connection.transport.nr_written, nr_datagrams)
@@ -0,0 +1,39 @@
+from Tribler.Core.Utilities.spelling_utils import levenshtein, SymmetricDeleteIndex
+from Tribler.Test.Core.base_test import TriblerCoreTest
+
+
+class TriblerCoreTestSpellingUtils(TriblerCoreTest):
+
+    def test_levenshtein(self):
+        self.assertEqual(levenshtein(u"kitten", u"sitting"), 3)
+        self.assertEqual(levenshtein(u"", u"abc"), 3)
+        self.assertEqual(levenshtein(u"abc", u"abc"), 0)
+        self.assertEqual(levenshtein(u"kitten", u"sitting", max_distance=1), 2)
+        self.assertEqual(levenshtein(u"a", u"abcdef", max_distance=2), 3)
+
+    def test_lookup(self):
+        index = SymmetricDeleteIndex()
+        index.add(u"ubuntu", 10)
+        index.add(u"kubuntu", 2)
+        index.add(u"debian", 5)
+
+        self.assertEqual(index.lookup(u"ubuntu"), [u"ubuntu", u"kubuntu"])
+        self.assertEqual(index.lookup(u"ubunto"), [u"ubuntu", u"kubuntu"])
+        self.assertEqual(index.lookup(u"debain"), [u"debian"])
+        self.assertEqual(index.lookup(u"fedora"), [])
+        self.assertEqual(index.lookup(u"ubunto", max_results=1), [u"ubuntu"])
+
+    def test_long_terms(self):
+        index = SymmetricDeleteIndex(prefix_length=4)
+        index.add(u"documentary")
+        self.assertEqual(index.lookup(u"documentery"), [u"documentary"])
+        self.assertEqual(index.lookup(u"dokumentary"), [u"documentary"])
+
+    def test_max_terms(self):
+        index = SymmetricDeleteIndex(max_terms=1)
+        self.assertTrue(index.add(u"ubuntu"))
+        self.assertTrue(index.add(u"ubuntu"))
+        self.assertFalse(index.add(u"debian"))
+        self.assertEqual(len(index), 1)
+        self.assertIn(u"ubuntu", index)
+        self.assertNotIn(u"debian", index)
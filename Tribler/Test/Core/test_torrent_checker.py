@@ -0,0 +1,218 @@
+import struct
+
+from libtorrent import bencode
+from twisted.internet.defer import succeed
+from twisted.internet.task import Clock
+
+from Tribler.Core.TorrentChecker.session import (HttpTrackerSession, UdpTrackerProtocol, UdpTrackerSession,
+                                                 TRACKER_ACTION_CONNECT, TRACKER_ACTION_SCRAPE,
+                                                 UDP_TRACKER_MAX_RETRIES, UDP_TRACKER_RECHECK_INTERVAL)
+from Tribler.Core.TorrentChecker.torrent_checker import TorrentChecker, DEFAULT_TORRENT_CHECK_RETRY_INTERVAL
+from Tribler.Test.Core.base_test import TriblerCoreTest
+
+
+class MockReactor(Clock):
+
+    def resolve(self, host):
+        return succeed("127.0.0.1")
+
+
+class MockTransport(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def write(self, message, address):
+        self.messages.append((message, address))
+
+
+class MockFailure(object):
+
+    def getErrorMessage(self):
+        return "connection refused"
+
+
+class MockTrackerManager(object):
+
+    def __init__(self):
+        self.tracker_info = []
+
+    def should_check_tracker(self, tracker_url):
+        return True
+
+    def update_tracker_info(self, tracker_url, is_successful):
+        self.tracker_info.append((tracker_url, is_successful))
+
+
+class MockTorrentDBHandler(object):
+
+    def __init__(self):
+        self.results = []
+
+    def getTorrentCheckRetriesByInfohash(self, infohashes):
+        return {infohash: (1, 0) for infohash in infohashes}
+
+    def updateTorrentCheckResults(self, results):
+        self.results.extend(results)
+
+
+class MockLaunchManager(object):
+
+    def __init__(self):
+        self.tracker_manager = MockTrackerManager()
+
+
+class MockSession(object):
+
+    def __init__(self):
+        self.lm = MockLaunchManager()
+
+
+class TriblerCoreTestTrackerSession(TriblerCoreTest):
+
+    def setUp(self):
+        self.results = []
+        self.finished = []
+        self.protocol = UdpTrackerProtocol()
+        self.protocol.transport = MockTransport()
+
+    def create_udp_session(self, infohashes):
+        session = UdpTrackerSession(u"udp://localhost:80/announce", ("localhost", 80), u"/announce",
+                                    self.on_result, self.finished.append, self.protocol)
+        session._reactor = MockReactor()
+        for infohash in infohashes:
+            session.add_request(infohash)
+        return session
+
+    def on_result(self, infohash, seeders, leechers):
+        self.results.append((infohash, seeders, leechers))
+
+    def get_last_message(self):
+        message, address = self.protocol.transport.messages[-1]
+        connection_id, action, transaction_id = struct.unpack_from('!qii', message)
+        return connection_id, action, transaction_id, address
+
+    def test_udp_scrape(self):
+        session = self.create_udp_session(["a" * 20, "b" * 20])
+        session.start()
+        _, action, transaction_id, address = self.get_last_message()
+        self.assertEqual(action, TRACKER_ACTION_CONNECT)
+        self.assertEqual(address, ("127.0.0.1", 80))
+
+        self.protocol.datagramReceived(struct.pack('!iiq', TRACKER_ACTION_CONNECT, transaction_id, 1234), address)
+        connection_id, action, transaction_id, _ = self.get_last_message()
+        self.assertEqual((connection_id, action), (1234, TRACKER_ACTION_SCRAPE))
+
+        self.protocol.datagramReceived(struct.pack('!iiiiiiii', TRACKER_ACTION_SCRAPE, transaction_id,
+                                                   5, 0, 3, 1, 0, 0), address)
+        self.assertEqual(self.results, [("a" * 20, 5, 3), ("b" * 20, 1, 0)])
+        self.assertEqual(self.finished, [session])
+        self.assertTrue(session.is_finished)
+        self.assertEqual(self.protocol.get_connection_id(address), 1234)
+
+    def test_udp_demultiplex(self):
+        session1 = self.create_udp_session(["a" * 20])
+        session2 = self.create_udp_session(["b" * 20])
+        session1.start()
+        _, _, transaction_id1, address = self.get_last_message()
+        session2.start()
+        _, _, transaction_id2, _ = self.get_last_message()
+        self.assertNotEqual(transaction_id1, transaction_id2)
+
+        # replies from other addresses or with unknown transaction ids are ignored
+        self.protocol.datagramReceived(struct.pack('!iiq', TRACKER_ACTION_CONNECT, transaction_id2, 1), ("1.2.3.4", 80))
+        self.protocol.datagramReceived(struct.pack('!iiq', TRACKER_ACTION_CONNECT, transaction_id2 + 1, 1), address)
+        self.protocol.datagramReceived("short", address)
+        self.assertEqual(len(self.protocol.transport.messages), 2)
+
+        self.protocol.datagramReceived(struct.pack('!iiq', TRACKER_ACTION_CONNECT, transaction_id2, 1), address)
+        self.assertEqual(session2.action, TRACKER_ACTION_SCRAPE)
+        self.assertEqual(session1.action, TRACKER_ACTION_CONNECT)
+
+    def test_udp_timeout_retry_fail(self):
+        session = self.create_udp_session(["a" * 20])
+        session.start()
+
+        session._reactor.advance(UDP_TRACKER_RECHECK_INTERVAL)
+        self.assertEqual(session.retries, 1)
+        self.assertEqual(len(self.protocol.transport.messages), 2)
+        self.assertFalse(session.is_failed)
+
+        session._reactor.advance(UDP_TRACKER_RECHECK_INTERVAL * UDP_TRACKER_MAX_RETRIES)
+        self.assertTrue(session.is_failed)
+        self.assertEqual(self.finished, [session])
+        self.assertEqual(len(self.protocol.transport.messages), UDP_TRACKER_MAX_RETRIES + 1)
+        self.assertEqual(self.results, [])
+
+    def test_http_scrape_response(self):
+        session = HttpTrackerSession(u"http://localhost/announce?passkey=1", ("localhost", 80),
+                                     u"announce?passkey=1", self.on_result, self.finished.append)
+        session.add_request("a" * 20)
+        session.add_request("b" * 20)
+        self.assertEqual(session._get_scrape_url(), "http://localhost:80/scrape?passkey=1&info_hash=%s&info_hash=%s"
+                         % ("a" * 20, "b" * 20))
+
+        session._on_response(bencode({'files': {"a" * 20: {'complete': 5, 'incomplete': 2}}}))
+        self.assertEqual(self.results, [("a" * 20, 5, 2), ("b" * 20, 0, 0)])
+        self.assertTrue(session.is_finished)
+        self.assertEqual(self.finished, [session])
+
+    def test_http_failure(self):
+        session = HttpTrackerSession(u"http://localhost/announce", ("localhost", 80), u"announce",
+                                     self.on_result, self.finished.append)
+        session.add_request("a" * 20)
+        session._on_response(bencode({'failure reason': 'not allowed'}))
+        self.assertTrue(session.is_failed)
+
+        session = HttpTrackerSession(u"http://localhost/announce", ("localhost", 80), u"announce",
+                                     self.on_result, self.finished.append)
+        session.add_request("a" * 20)
+        session._on_error(MockFailure())
+        self.assertTrue(session.is_failed)
+        self.assertEqual(len(self.finished), 2)
+        self.assertEqual(self.results, [])
+
+
+class TriblerCoreTestTorrentChecker(TriblerCoreTest):
+
+    def setUp(self):
+        self.session = MockSession()
+        self.torrent_checker = TorrentChecker(self.session)
+        self.torrent_checker._torrent_db = MockTorrentDBHandler()
+
+    def tearDown(self):
+        self.torrent_checker.cancel_all_pending_tasks()
+
+    def create_session(self, tracker_url, infohashes):
+        session = self.torrent_checker._create_session_for_batch(tracker_url, infohashes)
+        session._reactor = MockReactor()
+        return session
+
+    def test_failed_session(self):
+        session = self.create_session(u"udp://localhost:80/announce", ["a" * 20])
+        session.start()
+        session._reactor.advance(UDP_TRACKER_RECHECK_INTERVAL * (UDP_TRACKER_MAX_RETRIES + 1))
+        self.assertTrue(session.is_failed)
+        self.assertNotIn(session, self.torrent_checker._session_list)
+        self.assertEqual(self.session.lm.tracker_manager.tracker_info, [(u"udp://localhost:80/announce", False)])
+
+        # the failed check is written, so the torrent is not selected again right away
+        self.torrent_checker._flush_check_results()
+        (torrent_id, infohash, seeders, leechers, last_check, next_check, status, retries), = \
+            self.torrent_checker._torrent_db.results
+        self.assertEqual((infohash, seeders, leechers, status, retries), ("a" * 20, -2, -2, u'unknown', 1))
+        self.assertEqual(next_check, last_check + DEFAULT_TORRENT_CHECK_RETRY_INTERVAL * 2)
+
+    def test_failed_session_with_result(self):
+        session1 = self.create_session(u"udp://localhost:80/announce", ["a" * 20])
+        session2 = self.create_session(u"udp://localhost:81/announce", ["a" * 20])
+        self.torrent_checker._on_result_from_session("a" * 20, 10, 2)
+        session1._finish()
+        session2._fail()
+
+        # only the result of the successful session is written
+        self.torrent_checker._flush_check_results()
+        results = self.torrent_checker._torrent_db.results
+        self.assertEqual([(seeders, leechers, status) for _, _, seeders, leechers, _, _, status, _ in results],
+                         [(10, 2, u'good')])
+        self.assertFalse(self.torrent_checker._pending_response_dict)
@@ -0,0 +1,67 @@
+from Tribler.community.tunnel.metrics import RTT_BUCKETS, TunnelMetrics, sample_duration
+from Tribler.Test.Core.base_test import TriblerCoreTest
+
+
+class TimedObject(object):
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    @sample_duration('timed')
+    def timed(self, value):
+        return value
+
+
+class TriblerCoreTestTunnelMetrics(TriblerCoreTest):
+
+    def setUp(self):
+        self.metrics = TunnelMetrics(history_size=2, sample_rate=2)
+
+    def test_traffic(self):
+        self.metrics.add_traffic('bytes_up', 1, ('1.2.3.4', 1234), 100)
+        self.metrics.add_traffic('bytes_relay_down', 2, ('1.2.3.4', 1234), 300, num_packets=3)
+        self.metrics.add_traffic('bytes_up', 1, ('1.2.3.4', 1234), 50)
+
+        window = self.metrics.roll()
+        self.assertEqual(window.circuits[1], [2, 150, 0, 0])
+        self.assertEqual(window.circuits[2], [0, 0, 3, 300])
+        self.assertEqual(window.peers['bytes_up', ('1.2.3.4', 1234)], 150)
+
+        summary = self.metrics.get_summary()
+        self.assertEqual(summary['packets_orig'], 2)
+        self.assertEqual(summary['packets_relay'], 3)
+        self.assertEqual(summary['packets_exit'], 0)
+
+        # the new window starts empty
+        self.assertFalse(self.metrics.current.circuits)
+
+    def test_rtt(self):
+        self.metrics.add_rtt(1, 0.01)
+        self.metrics.add_rtt(1, 0.03)
+        self.metrics.add_rtt(2, 10)
+        self.metrics.roll()
+
+        window = self.metrics.get_history()[-1]
+        self.assertEqual(window['circuits'][1]['rtt_histogram'][:2], [1, 1])
+        self.assertEqual(window['circuits'][1]['packets_up'], 0)
+        self.assertEqual(window['rtt_histogram'][0], 1)
+        self.assertEqual(window['rtt_histogram'][1], 1)
+        self.assertEqual(window['rtt_histogram'][len(RTT_BUCKETS)], 1)
+        self.assertEqual(window['summary']['rtt_avg'], int(1000 * 10.04 / 3))
+
+    def test_drops(self):
+        self.metrics.add_drop('crypto_error')
+        self.metrics.add_drop('send_failed', 2)
+        self.metrics.roll()
+        self.assertEqual(self.metrics.get_summary()['packets_dropped'], 3)
+
+    def test_history_size(self):
+        for _ in xrange(3):
+            self.metrics.roll()
+        self.assertEqual(len(self.metrics.get_history()), 2)
+
+    def test_sample_duration(self):
+        timed_object = TimedObject(self.metrics)
+        for value in xrange(5):
+            self.assertEqual(timed_object.timed(value), value)
+        self.assertEqual(self.metrics.current.durations['timed'][0], 2)
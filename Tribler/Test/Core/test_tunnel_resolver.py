@@ -0,0 +1,62 @@
+from twisted.internet.defer import Deferred, fail, succeed
+
+from Tribler.community.tunnel.resolver import CachingResolver
+from Tribler.Test.Core.base_test import TriblerCoreTest
+
+
+class FakeResolverReactor(object):
+
+    def __init__(self):
+        self.lookups = []
+
+    def resolve(self, hostname, timeout=None):
+        deferred = Deferred()
+        self.lookups.append((hostname, deferred))
+        return deferred
+
+
+class TriblerCoreTestCachingResolver(TriblerCoreTest):
+
+    def setUp(self):
+        self.resolver = CachingResolver(max_size=2)
+        self.resolver._reactor = FakeResolverReactor()
+        self.results = []
+
+    def test_waiting_callbacks(self):
+        self.resolver.resolve("tracker.example.com", self.results.append)
+        self.resolver.resolve("tracker.example.com", self.results.append)
+        self.assertEqual(len(self.resolver._reactor.lookups), 1)
+        self.assertEqual(self.results, [])
+
+        self.resolver._reactor.lookups[0][1].callback("1.2.3.4")
+        self.assertEqual(self.results, ["1.2.3.4", "1.2.3.4"])
+
+        # the result is cached
+        self.resolver.resolve("tracker.example.com", self.results.append)
+        self.assertEqual(len(self.resolver._reactor.lookups), 1)
+        self.assertEqual(self.results[-1], "1.2.3.4")
+        self.assertEqual(self.resolver.hits, 1)
+
+    def test_failed_lookup(self):
+        self.resolver._reactor.resolve = lambda hostname, timeout=None: fail(ValueError("no such host"))
+        self.resolver.resolve("unknown.example.com", self.results.append)
+        self.assertEqual(self.results, [None])
+
+        # failures are cached as well
+        self.resolver._reactor.resolve = lambda hostname, timeout=None: succeed("1.2.3.4")
+        self.resolver.resolve("unknown.example.com", self.results.append)
+        self.assertEqual(self.results, [None, None])
+
+    def test_expiration(self):
+        self.resolver = CachingResolver(positive_ttl=-1)
+        self.resolver._reactor = FakeResolverReactor()
+        self.resolver._reactor.resolve = lambda hostname, timeout=None: succeed("1.2.3.4")
+        self.resolver.resolve("tracker.example.com", self.results.append)
+        self.resolver.resolve("tracker.example.com", self.results.append)
+        self.assertEqual(self.resolver.misses, 2)
+
+    def test_max_size(self):
+        self.resolver._reactor.resolve = lambda hostname, timeout=None: succeed("1.2.3.4")
+        for hostname in ("a.example.com", "b.example.com", "c.example.com"):
+            self.resolver.resolve(hostname, self.results.append)
+        self.assertEqual(len(self.resolver), 2)
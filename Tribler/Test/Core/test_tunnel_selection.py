@@ -0,0 +1,86 @@
+from Tribler.community.tunnel import CIRCUIT_STATE_BROKEN, CIRCUIT_STATE_READY
+from Tribler.community.tunnel.metrics import TunnelMetrics
+from Tribler.community.tunnel.tunnel_community import LoadBalancer, SELECTION_POLICY_LEAST_LOADED
+from Tribler.Test.Core.base_test import TriblerCoreTest
+
+
+class MockCircuit(object):
+
+    def __init__(self, circuit_id, rtt=None, hops=1):
+        self.circuit_id = circuit_id
+        self.rtt = rtt
+        self.hops = [None] * hops
+        self.state = CIRCUIT_STATE_READY
+
+
+class MockSocksServer(object):
+
+    def __init__(self):
+        self.destination_counts = {}
+        self.dead_circuits = []
+
+    def get_destination_counts(self):
+        return dict(self.destination_counts)
+
+    def circuit_dead(self, circuit):
+        self.dead_circuits.append(circuit)
+
+
+class MockCommunity(object):
+
+    def __init__(self, circuits):
+        self.circuits = {circuit.circuit_id: circuit for circuit in circuits}
+        self.socks_server = MockSocksServer()
+        self.replaced_circuits = set()
+        self.tunnel_logger = self
+
+    def active_data_circuits(self, hops=None):
+        return {circuit_id: circuit for circuit_id, circuit in self.circuits.iteritems()
+                if circuit.state == CIRCUIT_STATE_READY and (hops is None or hops == len(circuit.hops))}
+
+    def info(self, *args):
+        pass
+
+
+class TriblerCoreTestLoadBalancer(TriblerCoreTest):
+
+    def setUp(self):
+        self.circuits = [MockCircuit(1, rtt=0.1), MockCircuit(2, rtt=0.15), MockCircuit(3, rtt=2.0)]
+        self.community = MockCommunity(self.circuits)
+        self.strategy = LoadBalancer(self.community, policy=SELECTION_POLICY_LEAST_LOADED)
+
+    def test_select_fastest(self):
+        self.assertEqual(self.strategy.select(("1.2.3.4", 1234), 1), self.circuits[0])
+        self.assertIsNone(self.strategy.select(("1.2.3.4", 1234), 2))
+
+    def test_spread_destinations(self):
+        selected = [self.strategy.select(("1.2.3.4", port), 1).circuit_id for port in xrange(3)]
+        self.assertEqual(selected, [1, 2, 1])
+
+    def test_broken_circuit(self):
+        self.assertTrue(self.strategy.has_options(1))
+        self.circuits[0].state = CIRCUIT_STATE_BROKEN
+        self.assertEqual(self.strategy.select(("1.2.3.4", 1234), 1), self.circuits[1])
+
+    def test_replaced_circuit(self):
+        self.community.replaced_circuits.add(1)
+        self.assertEqual(self.strategy.select(("1.2.3.4", 1234), 1), self.circuits[1])
+
+        self.community.replaced_circuits.update([2, 3])
+        self.strategy.circuits_changed()
+        self.assertEqual(self.strategy.select(("1.2.3.4", 1234), 1), self.circuits[0])
+
+    def test_two_choices(self):
+        strategy = LoadBalancer(self.community)
+        for port in xrange(5):
+            self.assertNotEqual(strategy.select(("1.2.3.4", port), 1), self.circuits[2])
+
+    def test_rebalance(self):
+        metrics = TunnelMetrics()
+        metrics.add_traffic('bytes_up', 1, ("1.2.3.4", 1234), 10 * 1024 * 1024)
+        self.community.socks_server.destination_counts = {1: 1, 3: 2}
+        self.strategy.update(metrics.roll())
+
+        self.assertEqual(self.community.socks_server.dead_circuits, [self.circuits[2]])
+        self.assertEqual(self.strategy.destinations, {1: 1})
+        self.assertGreater(self.strategy.throughputs[1], 0)
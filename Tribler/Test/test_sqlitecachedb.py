@@ -1,4 +1,9 @@
+import os
+
+from twisted.internet.threads import blockingCallFromThread
+
 from Tribler.Test.test_as_server import AbstractServer
+from Tribler.Core.Utilities.twisted_thread import reactor
 from Tribler.Core.Session import Session
 from Tribler.Core.SessionConfig import SessionStartupConfig
 from Tribler.Core.CacheDB.sqlitecachedb import SQLiteCacheDB
@@ -23,9 +28,12 @@ class TestSqliteCacheDB(AbstractServer):
         self.session = Session(self.config, ignore_singleton=True)
 
         self.sqlite_test = SQLiteCacheDB(self.session)
-        self.db_path = u":memory:"
+        self.db_path = self.get_db_path()
         self.sqlite_test.initialize(self.db_path)
 
+    def get_db_path(self):
+        return u":memory:"
+
     def tearDown(self):
         super(TestSqliteCacheDB, self).tearDown()
         self.sqlite_test.close()
@@ -104,3 +112,132 @@ class TestSqliteCacheDB(AbstractServer):
         self.sqlite_test.update('person', "lastname == '4'", firstname=654, lastname=44)
         one = self.sqlite_test.fetchone("select firstname from person where lastname == 44")
         assert one == 654, one
+
+    @blocking_call_on_reactor_thread
+    def test_write_queue(self):
+        self.test_create_db()
+
+        for i in range(100):
+            self.sqlite_test.execute_write(u"INSERT INTO person VALUES (?, ?)", (str(i), str(i ** 2)))
+        self.sqlite_test.executemany_write(u"UPDATE person SET firstname = ? WHERE lastname = ?", [(u'x', u'1')])
+        assert self.sqlite_test.get_write_statistics()[u"queue_rows"] == 101
+
+        # reads flush the queue first
+        assert self.sqlite_test.size('person') == 100
+        assert self.sqlite_test.fetchone(u"SELECT firstname FROM person WHERE lastname == '1'") == u'x'
+
+        stats = self.sqlite_test.get_write_statistics()
+        assert stats[u"queue_rows"] == 0
+        assert stats[u"flushes"] == 1
+        assert stats[u"flushed_rows"] == 101
+        assert stats[u"flushed_statements"] == 2
+
+    @blocking_call_on_reactor_thread
+    def test_write_queue_error(self):
+        self.sqlite_test.execute(u"CREATE TABLE unique_person(lastname PRIMARY KEY);")
+        results = []
+
+        sql = u"INSERT INTO unique_person VALUES (?)"
+        for args_list in ([(u'a',), (u'b',)], [(u'c',), (u'a',)], [(u'd',)]):
+            deferred = self.sqlite_test.executemany_write(sql, args_list)
+            deferred.addCallbacks(lambda _: results.append(True), lambda _: results.append(False))
+
+        # only the writes of the call that failed are rolled back
+        assert self.sqlite_test.fetchall(u"SELECT lastname FROM unique_person ORDER BY lastname") == \
+            [(u'a',), (u'b',), (u'd',)]
+        assert results == [True, False, True], results
+
+        # failures that the caller did not handle are consumed once they have been logged
+        deferred = self.sqlite_test.execute_write(sql, (u'a',))
+        self.sqlite_test.size('unique_person')
+        deferred.addBoth(results.append)
+        assert results[-1] is None, results
+
+    @blocking_call_on_reactor_thread
+    def test_query_shapes(self):
+        self.test_insertmany()
+
+        assert self.sqlite_test.getOne('person', 'firstname', lastname='2') == '4'
+        assert self.sqlite_test.getOne('person', 'firstname', lastname='3') == '9'
+        assert len(self.sqlite_test.getAll('person', ('lastname', 'firstname'), limit=10, offset=5)) == 10
+
+        shapes = dict((sql, count) for sql, count, _ in self.sqlite_test.get_query_shape_statistics())
+        assert shapes[u"SELECT firstname FROM person WHERE lastname = ?"] == 2, shapes
+        assert shapes[u"SELECT lastname,firstname FROM person LIMIT ? OFFSET ?"] == 1, shapes
+
+        # the writes of insert are counted once the write queue is flushed
+        insert_sql = u"INSERT INTO person (firstname,lastname) VALUES (?,?);"
+        self.sqlite_test.insert('person', lastname='a', firstname='b')
+        self.sqlite_test.insert('person', lastname='c', firstname='d')
+        assert insert_sql not in dict((sql, count) for sql, count, _ in self.sqlite_test.get_query_shape_statistics())
+        assert self.sqlite_test.size('person') == 102
+        shapes = dict((sql, count) for sql, count, _ in self.sqlite_test.get_query_shape_statistics())
+        assert shapes[insert_sql] == 2, shapes
+
+    def test_query_profile(self):
+        assert self.sqlite_test.get_query_profile() is None
+
+        self.sqlite_test.set_profile_sql(True, max_slow_queries=5)
+        self.test_insertmany()
+        for i in xrange(10):
+            self.sqlite_test.fetchone(u"SELECT firstname FROM person WHERE lastname = ?", (unicode(i),))
+
+        profile = self.sqlite_test.get_query_profile()
+        statements = dict((stats[u"sql"], stats) for stats in profile[u"statements"])
+        select_stats = statements[u"SELECT firstname FROM person WHERE lastname = ?"]
+        assert select_stats[u"count"] == 10
+        assert sum(select_stats[u"histogram"]) == 10
+        assert len(profile[u"slow_queries"]) == 5
+
+        file_path = self.sqlite_test.dump_query_profile(os.path.join(self.getStateDir(), u"query_profile.json"))
+        assert os.path.exists(file_path)
+
+        self.sqlite_test.set_profile_sql(False)
+        assert self.sqlite_test.get_query_profile() is None
+
+    def test_query_profile_multiple_statements(self):
+        self.sqlite_test.set_profile_sql(True)
+        self.test_create_db()
+
+        # getting the query plan must not execute the second statement again
+        sql = u"INSERT INTO person VALUES ('a', 'b'); INSERT INTO person VALUES ('c', 'd');"
+        self.sqlite_test.execute(sql)
+        assert self.sqlite_test.size('person') == 2
+
+        slow_queries = dict((query[u"sql"], query) for query in self.sqlite_test.get_query_profile()[u"slow_queries"])
+        assert slow_queries[sql][u"plan"] is None
+
+
+class TestSqliteCacheDBReadPool(TestSqliteCacheDB):
+
+    def get_db_path(self):
+        return os.path.join(self.getStateDir(), u"test_read_pool.sdb")
+
+    def test_fetchall_async(self):
+        self.test_insertmany()
+
+        all = blockingCallFromThread(reactor, self.sqlite_test.fetchall_async, u"SELECT * FROM person")
+        assert len(all) == 100
+
+        all = blockingCallFromThread(reactor, self.sqlite_test.fetchall_async,
+                                     u"SELECT * FROM person WHERE lastname == ?", (u'101',))
+        assert all == []
+
+    def test_fetchone_async(self):
+        self.test_insert()
+
+        one = blockingCallFromThread(reactor, self.sqlite_test.fetchone_async, u"SELECT * FROM person")
+        assert one == ('a', 'b')
+
+        one = blockingCallFromThread(reactor, self.sqlite_test.fetchone_async,
+                                     u"SELECT lastname FROM person WHERE firstname == 'c'")
+        assert one is None
+
+    def test_fetch_async_in_memory_fallback(self):
+        self.sqlite_test.close()
+        self.sqlite_test = SQLiteCacheDB(self.session)
+        self.sqlite_test.initialize(u":memory:")
+        self.test_insert()
+
+        one = blockingCallFromThread(reactor, self.sqlite_test.fetchone_async, u"SELECT lastname FROM person")
+        assert one == 'a'
@@ -6,6 +6,7 @@ from time import time
 from unittest.case import skip
 
 from twisted.internet import reactor
+from twisted.internet.threads import blockingCallFromThread
 
 from Tribler.Category.Category import Category
 from Tribler.Core.CacheDB.SqliteCacheDBHandler import (TorrentDBHandler, MyPreferenceDBHandler, BasicDBHandler,
@@ -192,6 +193,128 @@ class TestTorrentDBHandler(AbstractDB):
         fake_infoahsh = 'fake_infohash_100000'
         assert self.tdb.hasTorrent(fake_infoahsh) == False
 
+    def test_getTorrent_async(self):
+        infohash = str2bin('AA8cTG7ZuPsyblbRE7CyxsrKUCg=')
+        torrent = blockingCallFromThread(reactor, self.tdb.getTorrent_async, infohash)
+        assert torrent == self.tdb.getTorrent(infohash), torrent
+        assert torrent['infohash'] == infohash
+
+    @blocking_call_on_reactor_thread
+    def test_getTorrentsToCheck(self):
+        current_time = int(time())
+        self.tdb._db.execute_write(u"UPDATE Torrent SET next_tracker_check = 0, last_tracker_check = 0")
+        torrent_list = self.tdb.getTorrentsToCheck(current_time, current_time, 10)
+        assert 0 < len(torrent_list) <= 10, len(torrent_list)
+        assert all(torrent[2] != u'no-DHT' for torrent in torrent_list)
+
+        # trackers that failed recently are skipped
+        tracker_url = torrent_list[0][2]
+        self.tdb._db.execute_write(u"UPDATE TrackerInfo SET last_check = ?, failures = 1 WHERE tracker = ?",
+                                   (current_time - 100, tracker_url))
+        assert all(torrent[2] != tracker_url for torrent in self.tdb.getTorrentsToCheck(current_time, current_time,
+                                                                                         10, 60))
+        assert any(torrent[2] == tracker_url for torrent in self.tdb.getTorrentsToCheck(current_time, current_time,
+                                                                                         1000, 40))
+
+        # recently checked torrents are skipped
+        self.tdb._db.execute_write(u"UPDATE Torrent SET last_tracker_check = ?", (current_time,))
+        assert self.tdb.getTorrentsToCheck(current_time, current_time - 900, 10) == []
+
+    @blocking_call_on_reactor_thread
+    def test_updateTorrentCheckResults(self):
+        infohash = str2bin('AA8cTG7ZuPsyblbRE7CyxsrKUCg=')
+        torrent_id = self.tdb.getTorrentID(infohash)
+        self.tdb.updateTorrentCheckResults([(torrent_id, infohash, 10, 5, 1000, 1030, u'good', 0),
+                                            (torrent_id, infohash, 0, 0, 2000, 2060, u'unknown', 1)])
+
+        torrent = self.tdb.getTorrent(infohash, (u'num_seeders', u'num_leechers', u'last_tracker_check',
+                                                 u'next_tracker_check', u'status'), include_mypref=False)
+        assert torrent[u'num_seeders'] == 0 and torrent[u'num_leechers'] == 0, torrent
+        assert torrent[u'last_tracker_check'] == 2000 and torrent[u'next_tracker_check'] == 2060, torrent
+        assert torrent[u'status'] == u'unknown', torrent
+        assert self.tdb.getTorrentCheckRetries(torrent_id) == 1
+        assert self.tdb.getTorrentCheckRetriesByInfohash([infohash, 'fake_infohash_100000']) == \
+            {infohash: (torrent_id, 1)}
+
+    @blocking_call_on_reactor_thread
+    def test_getAutoCompleteTerms(self):
+        # the test database predates the TermFrequency table
+        self.sqlitedb.execute(u"CREATE TABLE IF NOT EXISTS TermFrequency (term text PRIMARY KEY, freq integer);")
+
+        self.tdb._addTermFrequencies([[u'ubuntu', u'linux', u'ubuntu']])
+        self.tdb._addTermFrequencies([[u'ubuntu', u'unix', u'u']])
+        assert self.tdb.getAutoCompleteTerms(u'U', max_terms=5) == [u'ubuntu', u'unix']
+        assert self.tdb.getAutoCompleteTerms(u'u', max_terms=1) == [u'ubuntu']
+        assert self.tdb.getAutoCompleteTerms(u'ubuntu', max_terms=5) == []
+
+    @blocking_call_on_reactor_thread
+    def test_getSearchSuggestion(self):
+        # the test database predates the TermFrequency table
+        self.sqlitedb.execute(u"CREATE TABLE IF NOT EXISTS TermFrequency (term text PRIMARY KEY, freq integer);")
+
+        self.tdb._addTermFrequencies([[u'ubuntu', u'linux']])
+        assert self.tdb.getSearchSuggestion([u'ubunto', u'linux']) == [u'ubuntu linux']
+        assert self.tdb.getSearchSuggestion([u'ubuntu', u'linux']) == []
+
+        # terms of torrents indexed after the spelling index was built are suggested as well
+        self.tdb._addTermFrequencies([[u'debian']])
+        assert self.tdb.getSearchSuggestion([u'debain'], limit=3) == [u'debian']
+
+    @blocking_call_on_reactor_thread
+    def test_addExternalTorrents(self):
+        # the test database predates the TermFrequency table
+        self.sqlitedb.execute(u"CREATE TABLE IF NOT EXISTS TermFrequency (term text PRIMARY KEY, freq integer);")
+        old_size = self.tdb.size()
+
+        single_tdef = TorrentDef.load(S_TORRENT_PATH_BACKUP)
+        multiple_tdef = TorrentDef.load(M_TORRENT_PATH_BACKUP)
+        infohashes = self.tdb.addExternalTorrents([single_tdef, multiple_tdef, single_tdef])
+        assert infohashes == [single_tdef.get_infohash(), multiple_tdef.get_infohash()], infohashes
+        assert self.tdb.size() == old_size + 2, self.tdb.size() - old_size
+
+        multiple_torrent_id = self.tdb.getTorrentID(multiple_tdef.get_infohash())
+        assert self.tdb.getOne('name', torrent_id=multiple_torrent_id) == 'Tribler_4.1.7_src'
+        swarmname = self.tdb._db.fetchone(u"SELECT swarmname FROM FullTextIndex WHERE rowid = ?",
+                                          (multiple_torrent_id,))
+        assert swarmname == u'tribler 4 1 7 src', swarmname
+        assert self.tdb._db.fetchone(u"SELECT COUNT(*) FROM TorrentTrackerMapping WHERE torrent_id = ?",
+                                     (multiple_torrent_id,)) > 0
+        assert u'tribler' in self.tdb.getAutoCompleteTerms(u'trib', max_terms=5)
+
+        # torrents that are known but not collected are updated
+        term_frequencies = self.tdb._db.fetchall(u"SELECT term, freq FROM TermFrequency ORDER BY term")
+        infohashes = self.tdb.addExternalTorrents([single_tdef], {'is_collected': 1})
+        assert infohashes == [single_tdef.get_infohash()], infohashes
+        # without counting the terms of the torrent again
+        assert self.tdb._db.fetchall(u"SELECT term, freq FROM TermFrequency ORDER BY term") == term_frequencies
+        assert self.tdb.size() == old_size + 2
+        assert self.tdb.hasTorrent(single_tdef.get_infohash())
+
+        # and collected torrents are skipped
+        assert self.tdb.addExternalTorrents([single_tdef]) == []
+        assert self.tdb.size() == old_size + 2
+
+    @blocking_call_on_reactor_thread
+    def test_addTorrentsToDB_concurrent_insert(self):
+        self.sqlitedb.execute(u"CREATE TABLE IF NOT EXISTS TermFrequency (term text PRIMARY KEY, freq integer);")
+        old_size = self.tdb.size()
+
+        single_tdef = TorrentDef.load(S_TORRENT_PATH_BACKUP)
+        multiple_tdef = TorrentDef.load(M_TORRENT_PATH_BACKUP)
+        torrents = [(tdef.get_infohash(), self.tdb._get_database_dict(tdef, {}),
+                     self.tdb._get_index_values(tdef.get_name_as_unicode(), tdef.get_files_as_unicode()),
+                     self.tdb._get_tracker_set(tdef)) for tdef in (single_tdef, multiple_tdef)]
+
+        # the single torrent is added after its torrent_id was looked up, which should not discard the other insert
+        self.tdb.addExternalTorrent(single_tdef)
+        torrents = self.tdb._addTorrentsToDB(torrents, {single_tdef.get_infohash(): None,
+                                                        multiple_tdef.get_infohash(): None})
+        assert [infohash for infohash, _, _, _ in torrents] == [single_tdef.get_infohash(),
+                                                                 multiple_tdef.get_infohash()]
+        assert self.tdb.size() == old_size + 2
+        assert self.tdb._db.fetchone(u"SELECT COUNT(*) FROM FullTextIndex WHERE rowid NOT IN "
+                                     u"(SELECT torrent_id FROM Torrent)") == 0
+
     @blocking_call_on_reactor_thread
     def test_add_update_Torrent(self):
         self.addTorrent()
@@ -365,3 +488,7 @@ class TestMyPreferenceDBHandler(AbstractDB):
         for k in res:
             data = res[k]
             assert isinstance(data, basestring), "data is not destination_path: %s" % type(data)
+
+    def test_getMyPrefStats_async(self):
+        res = blockingCallFromThread(reactor, self.mdb.getMyPrefStats_async)
+        assert res == self.mdb.getMyPrefStats(), res
@@ -5,6 +5,7 @@ import time
 # This needs to be imported before anything from tribler so the reactor gets initalied on the right thread
 from Tribler.Test.test_tunnel_base import TestTunnelBase
 
+from Tribler.community.tunnel import CIRCUIT_STATE_READY, CIRCUIT_TYPE_IP
 from Tribler.community.tunnel.hidden_community import HiddenTunnelCommunity
 
 
@@ -47,6 +48,62 @@ class TestTunnelCommunityPositive(TestTunnelBase):
 
         self.startTest(replace_socks)
 
+    def test_relay_throughput(self):
+        """
+        Benchmark of the relay path: sends packets through a 3-hop circuit and reports how many packets per second
+        reach the exit node.
+        """
+        nr_packets = 2000
+        received = []
+
+        def exit_data(circuit_id, sock_addr, destination, data):
+            received.append(time.time())
+
+        def report(start_time):
+            duration = max(received[-1] - start_time, 0.001)
+            self._logger.info("relayed %d/%d packets through 3 hops in %.2f seconds (%.0f packets/second)",
+                              len(received), nr_packets, duration, len(received) / duration)
+            self.quit()
+
+        def start_test(tunnel_communities):
+            circuit = tunnel_communities[-1].active_data_circuits().values()[0]
+            start_time = time.time()
+            for _ in xrange(nr_packets):
+                circuit.tunnel_data(("127.0.0.1", 12345), "x" * 1024)
+            self.CallConditional(30, lambda: len(received) >= nr_packets * 0.9, lambda: report(start_time),
+                                 "At least 90% of the packets should reach the exit node")
+
+        def replace_exit(tunnel_communities):
+            for tunnel_community in tunnel_communities:
+                tunnel_community.exit_data = exit_data
+            tunnel_communities[-1].circuits_needed[3] = 1
+            self.CallConditional(20, lambda: tunnel_communities[-1].active_data_circuits(),
+                                 lambda: start_test(tunnel_communities))
+
+        self.startTest(replace_exit)
+
+    def test_pooled_circuit(self):
+        claimed = []
+
+        def start_test(tunnel_community, pooled_circuit):
+            circuit_id = tunnel_community.create_circuit(2, CIRCUIT_TYPE_IP, claimed.append, info_hash='a' * 20)
+            self.assertEqual(circuit_id, pooled_circuit.circuit_id)
+            self.assertEqual(claimed, [pooled_circuit])
+            self.assertFalse(tunnel_community.pooled_circuits(2, CIRCUIT_TYPE_IP))
+            self.quit()
+
+        def fill_pool(tunnel_communities):
+            tunnel_community = tunnel_communities[-1]
+            tunnel_community.circuit_demand[2, CIRCUIT_TYPE_IP] = 1
+            tunnel_community.do_pool()
+
+            ready_circuits = lambda: [c for c in tunnel_community.pooled_circuits(2, CIRCUIT_TYPE_IP)
+                                      if c.state == CIRCUIT_STATE_READY]
+            self.CallConditional(20, ready_circuits, lambda: start_test(tunnel_community, ready_circuits()[0]),
+                                 "A pooled circuit should be built")
+
+        self.startTest(fill_pool)
+
     def test_anon_download(self):
         def take_second_screenshot():
             self.screenshot('Network graph after an anonymous libtorrent download ')
@@ -1,4 +1,5 @@
 import logging
+from collections import defaultdict
 
 from twisted.internet import reactor
 from twisted.internet.protocol import Protocol, DatagramProtocol, connectionDone, Factory
@@ -98,7 +99,9 @@ class Socks5Connection(Protocol):
         self.state = ConnectionState.BEFORE_METHOD_REQUEST
         self.buffer = ''
 
+        # destination -> circuit, and the reverse index circuit -> destinations
         self.destinations = {}
+        self.circuit_destinations = {}
 
     def dataReceived(self, data):
         self.buffer = self.buffer + data
@@ -244,11 +247,32 @@ class Socks5Connection(Protocol):
             if not selected_circuit:
                 return None
 
-            self.destinations[destination] = selected_circuit
+            self.set_destination(destination, selected_circuit)
             self._logger.info("SELECT circuit {0} for {1}".format(self.destinations[destination].circuit_id,
                                                                   destination))
         return self.destinations[destination]
 
+    def set_destination(self, destination, circuit):
+        old_circuit = self.destinations.get(destination)
+        if old_circuit is circuit:
+            return
+        if old_circuit is not None:
+            self._remove_from_index(destination, old_circuit)
+
+        self.destinations[destination] = circuit
+        circuit_destinations = self.circuit_destinations.get(circuit)
+        if circuit_destinations is None:
+            circuit_destinations = self.circuit_destinations[circuit] = set()
+            self.socksserver.add_circuit_session(circuit, self)
+        circuit_destinations.add(destination)
+
+    def _remove_from_index(self, destination, circuit):
+        circuit_destinations = self.circuit_destinations[circuit]
+        circuit_destinations.discard(destination)
+        if not circuit_destinations:
+            del self.circuit_destinations[circuit]
+            self.socksserver.remove_circuit_session(circuit, self)
+
     def circuit_dead(self, broken_circuit):
         """
         When a circuit breaks and it affects our operation we should re-add the
@@ -257,22 +281,19 @@ class Socks5Connection(Protocol):
         @param Circuit broken_circuit: the circuit that has been broken
         @return Set with destinations using this circuit
         """
-        affected_destinations = set(
-            destination for destination, tunnel_circuit in self.destinations.iteritems() if tunnel_circuit == broken_circuit)
-        counter = 0
+        affected_destinations = self.circuit_destinations.pop(broken_circuit, set())
         for destination in affected_destinations:
-            if destination in self.destinations:
-                del self.destinations[destination]
-                counter += 1
+            del self.destinations[destination]
 
-        if counter > 0:
-            self._logger.debug("Deleted %d peers from destination list", counter)
+        if affected_destinations:
+            self.socksserver.remove_circuit_session(broken_circuit, self)
+            self._logger.debug("Deleted %d peers from destination list", len(affected_destinations))
 
         return affected_destinations
 
     def on_incoming_from_tunnel(self, community, circuit, origin, data, force=False):
-        if circuit in self.destinations.values() or force:
-            self.destinations[origin] = circuit
+        if circuit in self.circuit_destinations or force:
+            self.set_destination(origin, circuit)
 
             if self._udp_socket:
                 socks5_data = conversion.encode_udp_packet(
@@ -302,6 +323,8 @@ class Socks5Server(object):
         self.socks5_ports = socks5_ports
         self.twisted_ports = []
         self.sessions = []
+        # circuit -> sessions that have destinations on the circuit
+        self.circuit_sessions = defaultdict(set)
 
     def start(self):
         for i, port in enumerate(self.socks5_ports):
@@ -314,6 +337,7 @@ class Socks5Server(object):
             for session in self.sessions:
                 session.close('stopping')
             self.sessions = []
+            self.circuit_sessions.clear()
 
             for twisted_port in self.twisted_ports:
                 twisted_port.stopListening()
@@ -328,12 +352,34 @@ class Socks5Server(object):
         self._logger.debug("SOCKS5 TCP connection lost")
         if socks5connection in self.sessions:
             self.sessions.remove(socks5connection)
+            for circuit in socks5connection.circuit_destinations.keys():
+                self.remove_circuit_session(circuit, socks5connection)
 
         socks5connection.close()
 
+    def get_destination_counts(self):
+        """
+        Returns the number of destinations that use each circuit, by circuit_id.
+        """
+        counts = defaultdict(int)
+        for circuit, sessions in self.circuit_sessions.iteritems():
+            for session in sessions:
+                counts[circuit.circuit_id] += len(session.circuit_destinations[circuit])
+        return counts
+
+    def add_circuit_session(self, circuit, session):
+        self.circuit_sessions[circuit].add(session)
+
+    def remove_circuit_session(self, circuit, session):
+        sessions = self.circuit_sessions.get(circuit)
+        if sessions is not None:
+            sessions.discard(session)
+            if not sessions:
+                del self.circuit_sessions[circuit]
+
     def circuit_dead(self, circuit):
         affected_destinations = set()
-        for session in self.sessions:
+        for session in list(self.circuit_sessions.get(circuit, ())):
             affected_destinations.update(session.circuit_dead(circuit))
 
         return affected_destinations
@@ -343,6 +389,8 @@ class Socks5Server(object):
             origin = (community.circuit_id_to_ip(circuit.circuit_id), CIRCUIT_ID_PORT)
         session_hops = circuit.goal_hops if circuit.ctype != CIRCUIT_TYPE_RENDEZVOUS else circuit.goal_hops - 1
 
+        # only sessions that sent data over the circuit accept data from it, unless forced
+        sessions = self.sessions if force else self.circuit_sessions.get(circuit, ())
         if not any([session.on_incoming_from_tunnel(community, circuit, origin, data, force)
-                    for session in self.sessions if session.hops == session_hops]):
+                    for session in sessions if session.hops == session_hops]):
             self._logger.warning("No session accepted this data from %s:%d", *origin)
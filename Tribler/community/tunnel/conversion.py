@@ -2,6 +2,7 @@ from struct import pack, unpack_from
 from socket import inet_ntoa, inet_aton, error as socket_error
 from libtorrent import bdecode
 
+from Tribler.community.tunnel.metrics import SUMMARY_KEYS
 from Tribler.dispersy.conversion import BinaryConversion
 from Tribler.dispersy.message import DropPacket
 from Tribler.dispersy.endpoint import TUNNEL_PREFIX, TUNNEL_PREFIX_LENGHT
@@ -274,7 +275,11 @@ class TunnelConversion(BinaryConversion):
                     'bytes_enter', 'bytes_exit']:
             stats_list.append(message.payload.stats.get(key, 0))
 
-        return pack('!HIQQQQQQ', *([message.payload.identifier] + stats_list)),
+        # the metrics summary is appended, older peers ignore it
+        metrics_list = [message.payload.stats.get(key, 0) for key in SUMMARY_KEYS]
+
+        return pack('!HIQQQQQQ' + 'I' * len(SUMMARY_KEYS), *([message.payload.identifier] + stats_list +
+                                                             metrics_list)),
 
     def _decode_stats_response(self, placeholder, offset, data):
         identifier, = unpack_from('!H', data, offset)
@@ -286,6 +291,10 @@ class TunnelConversion(BinaryConversion):
             zip(['uptime', 'bytes_up', 'bytes_down', 'bytes_relay_up', 'bytes_relay_down',
                  'bytes_enter', 'bytes_exit'], stats_list))
 
+        # older peers do not send a metrics summary
+        if len(data) - offset >= 4 * len(SUMMARY_KEYS):
+            stats_dict.update(zip(SUMMARY_KEYS, unpack_from('!' + 'I' * len(SUMMARY_KEYS), data, offset)))
+
         # Ignore the rest
         offset += len(data[offset:])
 
@@ -4,12 +4,30 @@ from cryptowrapper import crypto_box_beforenm, crypto_auth, crypto_auth_verify,
 from Tribler.dispersy.crypto import ECCrypto, LibNaCLPK
 
 
+# the maximum number of AES keys of which the cipher algorithm is cached
+MAX_CACHED_KEYS = 1000
+
+
 class CryptoException(Exception):
     pass
 
 
 class TunnelCrypto(ECCrypto):
 
+    def __init__(self, *args, **kwargs):
+        super(TunnelCrypto, self).__init__(*args, **kwargs)
+        self._backend = default_backend()
+        # session key -> algorithms.AES, every packet of a circuit is encrypted with the same keys
+        self._algorithm_cache = {}
+
+    def _get_algorithm(self, key):
+        algorithm = self._algorithm_cache.get(key)
+        if algorithm is None:
+            if len(self._algorithm_cache) >= MAX_CACHED_KEYS:
+                self._algorithm_cache.clear()
+            algorithm = self._algorithm_cache[key] = algorithms.AES(key)
+        return algorithm
+
     def initialize(self, community):
         self.community = community
         self.key = self.community.my_member._ec
@@ -64,9 +82,9 @@ class TunnelCrypto(ECCrypto):
     def encrypt_str(self, content, key, salt, salt_explicit):
         # return the encrypted content prepended with the
         # gcm tag and salt_explicit
-        cipher = Cipher(algorithms.AES(key),
+        cipher = Cipher(self._get_algorithm(key),
                         modes.GCM(initialization_vector=self._bulid_iv(salt, salt_explicit)),
-                        backend=default_backend()
+                        backend=self._backend
                         ).encryptor()
         ciphertext = cipher.update(content) + cipher.finalize()
         return struct.pack('!q16s', salt_explicit, cipher.tag) + ciphertext
@@ -74,9 +92,9 @@ class TunnelCrypto(ECCrypto):
     def decrypt_str(self, content, key, salt):
         # content contains the gcm tag and salt_explicit in plaintext
         salt_explicit, gcm_tag = struct.unpack_from('!q16s', content)
-        cipher = Cipher(algorithms.AES(key),
+        cipher = Cipher(self._get_algorithm(key),
                         modes.GCM(initialization_vector=self._bulid_iv(salt, salt_explicit), tag=gcm_tag),
-                        backend=default_backend()
+                        backend=self._backend
                         ).decryptor()
         return cipher.update(content[24:]) + cipher.finalize()
 
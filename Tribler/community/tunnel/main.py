@@ -14,6 +14,7 @@ from twisted.internet.stdio import StandardIO
 from twisted.protocols.basic import LineReceiver
 from twisted.internet.threads import blockingCallFromThread
 
+from Tribler.community.tunnel.metrics import SUMMARY_KEYS
 from Tribler.community.tunnel.tunnel_community import TunnelSettings
 from Tribler.Core.SessionConfig import SessionStartupConfig
 from Tribler.Core.Session import Session
@@ -190,6 +191,9 @@ class Tunnel(object):
                         'bytes_relay': ('bytes_relay_up', 'bytes_relay_down')}
         for key_to, key_from in keys_to_from.iteritems():
             result[key_to] = sum([stats.get(k, 0) for k in key_from])
+        for key in SUMMARY_KEYS:
+            if key in stats:
+                result[key] = stats[key]
         return result
 
     def get_stats(self):
@@ -211,6 +215,18 @@ class Tunnel(object):
         else:
             return json.dumps(list(self.history_stats))
 
+    def get_metrics(self):
+        return self.community.metrics.get_history() if self.community else []
+
+    @cherrypy.expose
+    def metrics(self, *args, **kwargs):
+        # Return the metrics windows of our own tunnel community.
+        metrics = blockingCallFromThread(reactor, self.get_metrics)
+        if 'callback' in kwargs:
+            return kwargs['callback'] + '(' + json.dumps(metrics) + ');'
+        else:
+            return json.dumps(metrics)
+
 
 class LineHandler(LineReceiver):
 
@@ -262,6 +278,14 @@ class LineHandler(LineReceiver):
                                                              info_hash,
                                                              circuit.ctype)
 
+        elif line == 'm':
+            print "=======\nMetrics\n=======\nwindow\torig\trelay\texit\tdropped\trtt (ms)\tcrypto (us)"
+            for window in anon_tunnel.community.metrics.get_history()[-10:]:
+                summary = window['summary']
+                print "%d\t%d\t%d\t%d\t%d\t%d\t\t%d" % tuple(summary[key] for key in SUMMARY_KEYS)
+            for reason, count in anon_tunnel.community.metrics.current.drops.iteritems():
+                print "%d packets dropped in the current window: %s" % (count, reason)
+
         elif line.startswith('s'):
             cur_path = os.getcwd()
             line_split = line.split(' ')
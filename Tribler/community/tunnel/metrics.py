@@ -0,0 +1,199 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+from functools import wraps
+
+
+METRICS_WINDOW_SIZE = 10  # the number of seconds covered by one window
+METRICS_HISTORY_SIZE = 180  # the number of completed windows that are kept
+METRICS_SAMPLE_RATE = 64  # one out of this many calls of a timed function is actually timed
+RTT_BUCKETS = (0.025, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)  # upper bounds of the rtt histogram buckets, in seconds
+
+# the traffic keys, which match the keys of TunnelCommunity.stats, and whether they count outgoing traffic
+TRAFFIC_KEYS = {'bytes_up': True, 'bytes_down': False,
+                'bytes_relay_up': True, 'bytes_relay_down': False,
+                'bytes_exit': True, 'bytes_enter': False}
+
+# the keys of the summary that is sent in stats-response messages
+SUMMARY_KEYS = ['window', 'packets_orig', 'packets_relay', 'packets_exit', 'packets_dropped', 'rtt_avg',
+                'crypto_time']
+
+# indices in the per-circuit counters
+PACKETS_UP, BYTES_UP, PACKETS_DOWN, BYTES_DOWN = range(4)
+
+
+class MetricsWindow(object):
+
+    """
+    The metrics of the tunnel community over a fixed period of time.
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.end = None
+
+        # traffic key -> number of packets/bytes
+        self.packets = defaultdict(int)
+        self.bytes = defaultdict(int)
+        # (traffic key, sock_addr) -> number of bytes
+        self.peers = defaultdict(int)
+        # circuit_id -> [packets up, bytes up, packets down, bytes down]
+        self.circuits = {}
+        # circuit_id -> number of rtts per bucket, the last bucket counts the rtts above RTT_BUCKETS[-1]
+        self.rtts = {}
+        self.rtt_total = 0.0
+        self.rtt_count = 0
+        # name -> [number of samples, total duration]
+        self.durations = defaultdict(lambda: [0, 0.0])
+        # reason -> number of dropped packets
+        self.drops = defaultdict(int)
+
+    def get_summary(self):
+        """
+        Returns the main figures of this window as integers, so they can be sent to crawlers.
+        """
+        nr_samples = sum(samples for samples, _ in self.durations.itervalues())
+        total_duration = sum(duration for _, duration in self.durations.itervalues())
+        return {'window': int(round((self.end or time.time()) - self.start)),
+                'packets_orig': self.packets['bytes_up'] + self.packets['bytes_down'],
+                'packets_relay': self.packets['bytes_relay_up'] + self.packets['bytes_relay_down'],
+                'packets_exit': self.packets['bytes_exit'] + self.packets['bytes_enter'],
+                'packets_dropped': sum(self.drops.itervalues()),
+                # in milliseconds
+                'rtt_avg': int(1000 * self.rtt_total / self.rtt_count) if self.rtt_count else 0,
+                # in microseconds per operation
+                'crypto_time': int(1000000 * total_duration / nr_samples) if nr_samples else 0}
+
+    def get_circuit(self, circuit_id):
+        counters = self.circuits.get(circuit_id, [0, 0, 0, 0])
+        return {'packets_up': counters[PACKETS_UP],
+                'bytes_up': counters[BYTES_UP],
+                'packets_down': counters[PACKETS_DOWN],
+                'bytes_down': counters[BYTES_DOWN],
+                'rtt_histogram': self.rtts.get(circuit_id)}
+
+    def to_dict(self):
+        rtt_histogram = [0] * (len(RTT_BUCKETS) + 1)
+        for histogram in self.rtts.itervalues():
+            for index, count in enumerate(histogram):
+                rtt_histogram[index] += count
+
+        return {'start': self.start,
+                'end': self.end,
+                'summary': self.get_summary(),
+                'packets': dict(self.packets),
+                'bytes': dict(self.bytes),
+                'circuits': {circuit_id: self.get_circuit(circuit_id)
+                             for circuit_id in set(self.circuits) | set(self.rtts)},
+                'rtt_buckets': list(RTT_BUCKETS),
+                'rtt_histogram': rtt_histogram,
+                'durations': {name: {'samples': samples, 'total': duration}
+                              for name, (samples, duration) in self.durations.iteritems()},
+                'drops': dict(self.drops)}
+
+
+class TunnelMetrics(object):
+
+    """
+    Aggregates the traffic, round trip times, crypto durations and drops of the tunnel community in fixed windows.
+    Recording only updates a few counters of the current window, so it can be done for every packet. The owner calls
+    roll every window_size seconds, which closes the current window and adds it to the history.
+    """
+
+    def __init__(self, window_size=METRICS_WINDOW_SIZE, history_size=METRICS_HISTORY_SIZE,
+                 sample_rate=METRICS_SAMPLE_RATE):
+        self.window_size = window_size
+        self.sample_rate = sample_rate
+
+        self.current = MetricsWindow(time.time())
+        self.history = deque(maxlen=history_size)
+
+        self._nr_calls = defaultdict(int)
+
+    def add_traffic(self, key, circuit_id, sock_addr, num_bytes, num_packets=1):
+        """
+        Records packets sent or received for a circuit, relay or exit socket.
+        :param key: One of TRAFFIC_KEYS.
+        :param circuit_id: The circuit id of the circuit, relay or exit socket.
+        :param sock_addr: The address of the peer the packets were sent to or received from.
+        """
+        window = self.current
+        window.packets[key] += num_packets
+        window.bytes[key] += num_bytes
+        window.peers[key, sock_addr] += num_bytes
+
+        counters = window.circuits.get(circuit_id)
+        if counters is None:
+            counters = window.circuits[circuit_id] = [0, 0, 0, 0]
+        if TRAFFIC_KEYS[key]:
+            counters[PACKETS_UP] += num_packets
+            counters[BYTES_UP] += num_bytes
+        else:
+            counters[PACKETS_DOWN] += num_packets
+            counters[BYTES_DOWN] += num_bytes
+
+    def add_rtt(self, circuit_id, rtt):
+        window = self.current
+        histogram = window.rtts.get(circuit_id)
+        if histogram is None:
+            histogram = window.rtts[circuit_id] = [0] * (len(RTT_BUCKETS) + 1)
+        histogram[bisect_left(RTT_BUCKETS, rtt)] += 1
+        window.rtt_total += rtt
+        window.rtt_count += 1
+
+    def add_drop(self, reason, num_packets=1):
+        self.current.drops[reason] += num_packets
+
+    def should_sample(self, name):
+        """
+        Returns True once every sample_rate calls for the given name.
+        """
+        self._nr_calls[name] += 1
+        return self._nr_calls[name] % self.sample_rate == 0
+
+    def add_duration(self, name, duration):
+        samples = self.current.durations[name]
+        samples[0] += 1
+        samples[1] += duration
+
+    def roll(self):
+        """
+        Closes the current window and starts a new one.
+        :return: The closed window.
+        """
+        window = self.current
+        window.end = time.time()
+        self.history.append(window)
+        self.current = MetricsWindow(window.end)
+        return window
+
+    def get_summary(self):
+        """
+        Returns the summary of the last completed window, or of the current window if none has been completed yet.
+        """
+        return (self.history[-1] if self.history else self.current).get_summary()
+
+    def get_history(self):
+        """
+        Returns the completed windows, oldest first, as a time series of dictionaries.
+        """
+        return [window.to_dict() for window in self.history]
+
+
+def sample_duration(name):
+    """
+    Decorator for methods of objects with a metrics attribute, which times some of the calls of the method.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not self.metrics.should_sample(name):
+                return func(self, *args, **kwargs)
+
+            start = time.time()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self.metrics.add_duration(name, time.time() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,87 @@
+import logging
+import time
+from collections import OrderedDict
+
+from twisted.internet import reactor
+
+
+DNS_CACHE_SIZE = 1000  # the maximum number of hostnames in the cache
+DNS_POSITIVE_TTL = 300  # the number of seconds a resolved ip address is cached
+DNS_NEGATIVE_TTL = 30  # the number of seconds a failed lookup is cached
+DNS_TIMEOUT = (2, 5)  # the timeouts of the lookup attempts, see IResolverSimple.getHostByName
+MAX_WAITING_CALLBACKS = 100  # the maximum number of callbacks waiting for the lookup of a hostname
+
+
+class CachingResolver(object):
+
+    """
+    Resolves hostnames through the reactor's resolver, which does not block the reactor, and caches the results.
+    Failed lookups are cached for a shorter time, so a hostname that does not resolve is not looked up for every
+    datagram sent to it. Callers asking for a hostname that is being looked up wait for the same lookup.
+    """
+    _reactor = reactor
+
+    def __init__(self, max_size=DNS_CACHE_SIZE, positive_ttl=DNS_POSITIVE_TTL, negative_ttl=DNS_NEGATIVE_TTL):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._max_size = max_size
+        self._positive_ttl = positive_ttl
+        self._negative_ttl = negative_ttl
+
+        # hostname -> (expiration time, ip address or None), least recently used first
+        self._cache = OrderedDict()
+        # hostname -> [callback, ...] of the lookups that are running
+        self._waiting_callbacks = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def resolve(self, hostname, callback):
+        """
+        Resolves a hostname.
+        :param hostname: The hostname to resolve.
+        :param callback: Function called with the ip address, or None if the hostname could not be resolved. It is
+        called right away if the hostname is in the cache.
+        :return: False if too many callbacks are waiting for the hostname already and the callback is dropped, True
+        otherwise.
+        """
+        entry = self._cache.pop(hostname, None)
+        if entry is not None and entry[0] > time.time():
+            self._cache[hostname] = entry
+            self.hits += 1
+            callback(entry[1])
+            return True
+
+        self.misses += 1
+        callbacks = self._waiting_callbacks.get(hostname)
+        if callbacks is not None:
+            if len(callbacks) >= MAX_WAITING_CALLBACKS:
+                return False
+            callbacks.append(callback)
+            return True
+
+        self._waiting_callbacks[hostname] = [callback]
+        self._reactor.resolve(hostname, timeout=DNS_TIMEOUT).addCallbacks(
+            lambda ip_address: self._on_resolved(hostname, ip_address),
+            lambda failure: self._on_resolve_failed(hostname, failure))
+        return True
+
+    def _on_resolved(self, hostname, ip_address):
+        self._logger.info("Resolved ip address %s for hostname %s", ip_address, hostname)
+        self._add(hostname, ip_address, self._positive_ttl)
+
+    def _on_resolve_failed(self, hostname, failure):
+        self._logger.error("Can't resolve ip address for hostname %s: %s", hostname, failure.getErrorMessage())
+        self._add(hostname, None, self._negative_ttl)
+
+    def _add(self, hostname, ip_address, ttl):
+        self._cache.pop(hostname, None)
+        self._cache[hostname] = (time.time() + ttl, ip_address)
+        while len(self._cache) > self._max_size:
+            self._cache.popitem(last=False)
+
+        for callback in self._waiting_callbacks.pop(hostname, []):
+            callback(ip_address)
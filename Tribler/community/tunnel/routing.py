@@ -8,6 +8,8 @@ import logging
 
 __author__ = 'chris'
 
+RTT_SMOOTHING = 0.25  # the weight of a new rtt measurement in the smoothed rtt of a circuit
+
 
 class Circuit(object):
 
@@ -41,6 +43,7 @@ class Circuit(object):
         self.last_incoming = time.time()
         self.unverified_hop = None
         self.bytes_up = self.bytes_down = 0
+        self.rtt = None
 
         self.proxy = proxy
         self.ctype = ctype
@@ -88,6 +91,13 @@ class Circuit(object):
         """
         self.last_incoming = time.time()
 
+    def add_rtt(self, rtt):
+        """
+        Updates the smoothed round trip time of the circuit
+        @param float rtt: the measured round trip time in seconds
+        """
+        self.rtt = rtt if self.rtt is None else (1 - RTT_SMOOTHING) * self.rtt + RTT_SMOOTHING * rtt
+
     def tunnel_data(self, destination, payload):
         """
         Convenience method to tunnel data over this circuit
@@ -101,7 +111,7 @@ class Circuit(object):
                            self.circuit_id, destination)
 
         num_bytes = self.proxy.send_data([Candidate(self.first_hop, False)], self.circuit_id, destination, ('0.0.0.0', 0), payload)
-        self.proxy.increase_bytes_sent(self.circuit_id, num_bytes)
+        self.proxy.increase_bytes_sent(self, num_bytes)
 
         return num_bytes > 0
 
@@ -1,9 +1,10 @@
 # Written by Egbert Bouman
 
+import math
 import random
-import socket
 import time
 from collections import defaultdict
+from threading import Lock
 from cryptography.exceptions import InvalidTag
 
 from twisted.internet import reactor
@@ -14,15 +15,17 @@ from Tribler import dispersy
 from Tribler.Core.Utilities.encoding import decode, encode
 from Tribler.community.bartercast4.statistics import BartercastStatisticTypes, _barter_statistics
 from Tribler.community.tunnel import (CIRCUIT_ID_PORT, CIRCUIT_STATE_EXTENDING, CIRCUIT_STATE_READY, CIRCUIT_TYPE_DATA,
-                                      CIRCUIT_TYPE_RENDEZVOUS, CIRCUIT_TYPE_RP, EXIT_NODE, EXIT_NODE_SALT, ORIGINATOR,
-                                      ORIGINATOR_SALT, PING_INTERVAL)
+                                      CIRCUIT_TYPE_IP, CIRCUIT_TYPE_RENDEZVOUS, CIRCUIT_TYPE_RP, EXIT_NODE,
+                                      EXIT_NODE_SALT, ORIGINATOR, ORIGINATOR_SALT, PING_INTERVAL)
 from Tribler.community.tunnel.Socks5.server import Socks5Server
 from Tribler.community.tunnel.conversion import TunnelConversion
 from Tribler.community.tunnel.crypto.tunnelcrypto import CryptoException, TunnelCrypto
+from Tribler.community.tunnel.metrics import BYTES_DOWN, BYTES_UP, TunnelMetrics, sample_duration
 from Tribler.community.tunnel.payload import (CellPayload, CreatePayload, CreatedPayload, DestroyPayload, ExtendPayload,
                                               ExtendedPayload, PingPayload, PongPayload, StatsRequestPayload,
                                               StatsResponsePayload, TunnelIntroductionRequestPayload,
                                               TunnelIntroductionResponsePayload)
+from Tribler.community.tunnel.resolver import CachingResolver
 from Tribler.community.tunnel.routing import Circuit, Hop, RelayRoute
 from Tribler.dispersy.authentication import MemberAuthentication, NoAuthentication
 from Tribler.dispersy.candidate import Candidate
@@ -37,6 +40,19 @@ from Tribler.dispersy.resolution import PublicResolution
 from Tribler.dispersy.util import call_on_reactor_thread
 import logging
 
+# the bartercast statistic types of the traffic keys, which are reported once per metrics window
+BARTERCAST_TRAFFIC_TYPES = {'bytes_up': BartercastStatisticTypes.TUNNELS_BYTES_SENT,
+                            'bytes_down': BartercastStatisticTypes.TUNNELS_BYTES_RECEIVED,
+                            'bytes_relay_up': BartercastStatisticTypes.TUNNELS_RELAY_BYTES_SENT,
+                            'bytes_relay_down': BartercastStatisticTypes.TUNNELS_RELAY_BYTES_RECEIVED,
+                            'bytes_exit': BartercastStatisticTypes.TUNNELS_EXIT_BYTES_SENT,
+                            'bytes_enter': BartercastStatisticTypes.TUNNELS_EXIT_BYTES_RECEIVED}
+
+# the circuit types that are built in advance, without knowing the infohash they will be used for
+POOLED_CIRCUIT_TYPES = (CIRCUIT_TYPE_IP, CIRCUIT_TYPE_RP)
+POOL_DEMAND_SMOOTHING = 0.2  # the weight of the requests of one do_circuits round in the demand for pooled circuits
+MIN_POOL_DEMAND = 0.05  # no circuits are pooled for a lower demand
+
 class CircuitRequestCache(NumberCache):
 
     def __init__(self, community, circuit):
@@ -85,6 +101,7 @@ class PingRequestCache(RandomNumberCache):
         self.tunnel_logger = logging.getLogger('TunnelLogger')
         self.circuit = circuit
         self.community = community
+        self.sent_time = time.time()
 
     @property
     def timeout_delay(self):
@@ -134,28 +151,42 @@ class TunnelExitSocket(DatagramProtocol):
         if self.check_num_packets(destination, False):
             if TunnelConversion.is_allowed(data):
                 if dispersy.util.is_valid_address(destination):
-                    ip_address = destination[0]
+                    self.write(data, destination)
                 else:
-                    try:
-                        ip_address = socket.gethostbyname(destination[0])
-                        self.tunnel_logger.info("Resolved ip address %s for hostname %s",
-                                                 ip_address,
-                                                 destination[0])
-                    except:
-                        self.tunnel_logger.error("Can't resolve ip address for hostname %s", destination[0])
-
-                try:
-                    self.transport.write(data, (ip_address, destination[1]))
-                except Exception, e:
-                    self.tunnel_logger.error("Failed to write data to transport: %s. Destination: %s",
-                                             e[1],
-                                             repr(destination))
-                    raise
-
-                self.community.increase_bytes_sent(self, len(data))
+                    # the datagram waits until the hostname is resolved, without blocking the reactor
+                    on_resolved = lambda ip_address: self.on_hostname_resolved(data, destination, ip_address)
+                    if not self.community.dns_resolver.resolve(destination[0], on_resolved):
+                        self.tunnel_logger.warning("dropping packet to %s, too many packets wait for its lookup",
+                                                   destination[0])
+                        self.community.metrics.add_drop('dns_queue_full')
             else:
                 self.tunnel_logger.error("dropping forbidden packets from exit socket with circuit_id %d",
                                          self.circuit_id)
+                self.community.metrics.add_drop('forbidden')
+        else:
+            self.community.metrics.add_drop('no_reply')
+
+    def on_hostname_resolved(self, data, destination, ip_address):
+        if ip_address is None:
+            self.tunnel_logger.error("dropping packet to %s, its hostname could not be resolved", destination[0])
+            self.community.metrics.add_drop('dns_failed')
+        elif self.enabled:
+            # write logs and re-raises its errors, which should not end up in the resolver's callback loop
+            try:
+                self.write(data, (ip_address, destination[1]))
+            except Exception:
+                self.community.metrics.add_drop('write_failed')
+
+    def write(self, data, destination):
+        try:
+            self.transport.write(data, destination)
+        except Exception, e:
+            self.tunnel_logger.error("Failed to write data to transport: %s. Destination: %s",
+                                     e[1],
+                                     repr(destination))
+            raise
+
+        self.community.increase_bytes_sent(self, len(data))
 
     def datagramReceived(self, data, source):
         self.community.increase_bytes_received(self, len(data))
@@ -165,6 +196,9 @@ class TunnelExitSocket(DatagramProtocol):
             else:
                 self.tunnel_logger.warning("dropping forbidden packets to exit socket with circuit_id %d",
                                            self.circuit_id)
+                self.community.metrics.add_drop('forbidden')
+        else:
+            self.community.metrics.add_drop('no_reply')
 
     def tunnel_data(self, source, data):
         self.tunnel_logger.debug("Tunnel data to origin %s for circuit %s", ('0.0.0.0', 0), self.circuit_id)
@@ -210,6 +244,12 @@ class TunnelSettings(object):
         self.max_time_inactive = 20
         self.max_traffic = 250 * 1024 * 1024
 
+        # circuits get a replacement this many seconds before max_time, or after this fraction of max_traffic
+        self.replace_time = 60
+        self.replace_traffic = 0.9
+        # the maximum number of idle introduction/rendezvous circuits kept per number of hops
+        self.max_pooled_circuits = 4
+
         self.max_packets_without_reply = 50
         self.dht_lookup_interval = 30
 
@@ -226,6 +266,14 @@ class ExitCandidate(object):
         self.creation_time = time.time()
 
 
+SELECTION_POLICY_LEAST_LOADED = 'least-loaded'
+SELECTION_POLICY_TWO_CHOICES = 'two-choices'
+DEFAULT_RTT = 0.5  # the rtt of circuits that have not answered a ping yet, in seconds
+THROUGHPUT_PER_DESTINATION = 64 * 1024  # the number of bytes per second a circuit counts as one more destination
+REBALANCE_RTT_FACTOR = 3  # circuits with this many times the median rtt of their hop count lose their destinations
+MIN_REBALANCE_RTT = 0.5  # destinations are never moved off circuits with a lower rtt, in seconds
+
+
 class RoundRobin(object):
 
     def __init__(self, community):
@@ -253,6 +301,114 @@ class RoundRobin(object):
         circuit_id = circuit_ids[self.index]
         return self.community.active_data_circuits()[circuit_id]
 
+    def circuits_changed(self):
+        pass
+
+    def update(self, window):
+        pass
+
+
+class LoadBalancer(RoundRobin):
+
+    """
+    Selects the circuit for a new destination by its load: the smoothed rtt of the circuit, multiplied by the number
+    of destinations that use it and its throughput in the last metrics window. With the two-choices policy, the least
+    loaded of two random circuits is selected, which spreads the destinations almost as well as comparing all
+    circuits. Destinations are moved off circuits that are much slower than the other circuits with the same number
+    of hops. The ready circuits are cached per number of hops, so selection does not depend on the number of
+    circuits.
+    """
+
+    def __init__(self, community, policy=SELECTION_POLICY_TWO_CHOICES):
+        super(LoadBalancer, self).__init__(community)
+        self.policy = policy
+
+        # hops -> ready data circuits, None if the circuits have to be looked up again
+        self._circuits = None
+        # circuit_id -> number of destinations selected since the last window
+        self._selected = defaultdict(int)
+        # circuit_id -> number of destinations / number of bytes per second in the last window
+        self.destinations = {}
+        self.throughputs = {}
+
+    def has_options(self, hops):
+        return len(self.get_circuits(hops)) > 0
+
+    def circuits_changed(self):
+        self._circuits = None
+
+    def get_circuits(self, hops):
+        if self._circuits is None:
+            self._circuits = defaultdict(list)
+            replaced = defaultdict(list)
+            for circuit in self.community.active_data_circuits().itervalues():
+                circuits = replaced if circuit.circuit_id in self.community.replaced_circuits else self._circuits
+                circuits[len(circuit.hops)].append(circuit)
+                circuits[None].append(circuit)
+
+            # circuits that are about to expire are only selected if there is nothing else
+            for circuit_hops, circuits in replaced.iteritems():
+                if not self._circuits[circuit_hops]:
+                    self._circuits[circuit_hops] = circuits
+        return self._circuits.get(hops, [])
+
+    def get_load(self, circuit):
+        circuit_id = circuit.circuit_id
+        queue = self.destinations.get(circuit_id, 0) + self._selected.get(circuit_id, 0) + \
+            self.throughputs.get(circuit_id, 0) / float(THROUGHPUT_PER_DESTINATION)
+        return (circuit.rtt or DEFAULT_RTT) * (1 + queue)
+
+    def select(self, destination, hops):
+        if destination and destination[1] == CIRCUIT_ID_PORT:
+            return super(LoadBalancer, self).select(destination, hops)
+
+        circuits = self.get_circuits(hops)
+        if any(circuit.state != CIRCUIT_STATE_READY for circuit in circuits):
+            self.circuits_changed()
+            circuits = self.get_circuits(hops)
+        if not circuits:
+            return None
+
+        if self.policy == SELECTION_POLICY_TWO_CHOICES and len(circuits) > 2:
+            circuits = random.sample(circuits, 2)
+        circuit = min(circuits, key=self.get_load)
+
+        if destination:
+            self._selected[circuit.circuit_id] += 1
+        return circuit
+
+    def update(self, window):
+        """
+        Updates the load of the circuits with a closed metrics window, and moves destinations off slow circuits.
+        """
+        duration = max(window.end - window.start, 1)
+        self.throughputs = {circuit_id: (counters[BYTES_UP] + counters[BYTES_DOWN]) / duration
+                            for circuit_id, counters in window.circuits.iteritems()}
+
+        socks_server = self.community.socks_server
+        self.destinations = socks_server.get_destination_counts() if socks_server else {}
+        self._selected.clear()
+
+        for hops, circuits in self.get_circuits_by_hops().iteritems():
+            rtts = sorted(circuit.rtt for circuit in circuits if circuit.rtt is not None)
+            if len(rtts) < 2 or not socks_server:
+                continue
+
+            median_rtt = rtts[len(rtts) // 2]
+            for circuit in circuits:
+                if circuit.rtt is not None and \
+                        circuit.rtt > max(median_rtt * REBALANCE_RTT_FACTOR, MIN_REBALANCE_RTT) and \
+                        self.destinations.get(circuit.circuit_id):
+                    self.community.tunnel_logger.info("Moving destinations off circuit %d (rtt %.3f, median %.3f)",
+                                                      circuit.circuit_id, circuit.rtt, median_rtt)
+                    # the destinations select a new circuit on their next packet
+                    socks_server.circuit_dead(circuit)
+                    self.destinations.pop(circuit.circuit_id)
+
+    def get_circuits_by_hops(self):
+        self.get_circuits(None)
+        return {hops: circuits for hops, circuits in self._circuits.iteritems() if hops is not None}
+
 
 class TunnelCommunity(Community):
 
@@ -267,15 +423,27 @@ class TunnelCommunity(Community):
         self.relay_session_keys = {}
         self.exit_sockets = {}
         self.circuits_needed = defaultdict(int)
+        # (hops, ctype) -> requests for pooled circuits since the last do_circuits / smoothed requests per round
+        self.circuit_requests = defaultdict(int)
+        self.circuit_demand = {}
+        # the circuit_ids of the circuits that are about to expire and no longer get new destinations
+        self.replaced_circuits = set()
         self.exit_candidates = {}
         self.notifier = None
-        self.selection_strategy = RoundRobin(self)
+        self.selection_strategy = LoadBalancer(self)
         self.stats = defaultdict(int)
+        self.metrics = TunnelMetrics()
         self.creation_time = time.time()
         self.crawler_mids = ['5e02620cfabea2d2d3bfdc2032f6307136a35e69'.decode('hex'),
                              '43e8807e6f86ef2f0a784fbc8fa21f8bc49a82ae'.decode('hex'),
                              'e79efd8853cef1640b93c149d7b0f067f6ccf221'.decode('hex')]
         self.bittorrent_peers = {}
+        self.dns_resolver = CachingResolver()
+
+        # data packets received by the endpoint thread, processed in one batch per reactor iteration
+        self._data_queue = []
+        self._data_queue_lock = Lock()
+        self._data_batch_scheduled = False
 
         self.trsession = self.settings = self.socks_server = None
 
@@ -295,6 +463,7 @@ class TunnelCommunity(Community):
 
         self.register_task("do_circuits", LoopingCall(self.do_circuits)).start(5, now=True)
         self.register_task("do_ping", LoopingCall(self.do_ping)).start(PING_INTERVAL)
+        self.register_task("do_metrics", LoopingCall(self.do_metrics)).start(self.metrics.window_size, now=False)
 
         self.socks_server = Socks5Server(self, tribler_session.get_tunnel_community_socks5_listen_ports()
                                          if tribler_session else self.settings.socks_listen_ports)
@@ -385,6 +554,8 @@ class TunnelCommunity(Community):
         for circuit_id in self.exit_sockets.keys():
             self.remove_exit_socket(circuit_id, 'unload', destroy=True)
 
+        self.do_metrics()
+
         super(TunnelCommunity, self).unload_community()
 
     @property
@@ -416,15 +587,79 @@ class TunnelCommunity(Community):
     @call_on_reactor_thread
     def do_circuits(self):
         for circuit_length, num_circuits in self.circuits_needed.items():
-            num_to_build = num_circuits - len(self.data_circuits(circuit_length))
+            # Circuits that are about to expire are replaced in advance, so their traffic moves without a gap.
+            num_to_build = num_circuits - len([c for c in self.data_circuits(circuit_length).itervalues()
+                                               if not self.is_expiring(c)])
             self.tunnel_logger.info("want %d data circuits of length %d", num_to_build, circuit_length)
             for _ in range(num_to_build):
                 if not self.create_circuit(circuit_length):
                     self.tunnel_logger.info("circuit creation of %d circuits failed, no need to continue" %
                                              num_to_build)
                     break
+        self.do_pool()
+        self.do_replace()
         self.do_remove()
 
+    def is_expiring(self, circuit):
+        return circuit.creation_time < time.time() - self.settings.max_time + self.settings.replace_time or \
+            circuit.bytes_up + circuit.bytes_down > self.settings.max_traffic * self.settings.replace_traffic
+
+    def pooled_circuits(self, goal_hops, ctype):
+        return [c for c in self.circuits.itervalues() if c.ctype == ctype and c.goal_hops == goal_hops and
+                c.info_hash is None and not self.is_expiring(c)]
+
+    def do_pool(self):
+        # Keep introduction and rendezvous circuits ready, as many as were asked for in recent rounds, so hidden
+        # services do not wait for circuits to be built.
+        for key in set(self.circuit_demand) | set(self.circuit_requests):
+            demand = (1 - POOL_DEMAND_SMOOTHING) * self.circuit_demand.get(key, 0) + \
+                POOL_DEMAND_SMOOTHING * self.circuit_requests.get(key, 0)
+            if demand < MIN_POOL_DEMAND:
+                self.circuit_demand.pop(key, None)
+                continue
+            self.circuit_demand[key] = demand
+
+            goal_hops, ctype = key
+            pool_size = min(self.settings.max_pooled_circuits, int(math.ceil(demand)))
+            num_to_build = pool_size - len(self.pooled_circuits(goal_hops, ctype))
+            if num_to_build > 0:
+                self.tunnel_logger.info("want %d pooled %s circuits of length %d", num_to_build, ctype, goal_hops)
+            for _ in range(num_to_build):
+                if not self.create_circuit(goal_hops, ctype):
+                    break
+        self.circuit_requests.clear()
+
+    def claim_pooled_circuit(self, goal_hops, ctype, callback, info_hash):
+        pooled = self.pooled_circuits(goal_hops, ctype)
+        if not pooled:
+            return None
+
+        circuit = next((c for c in pooled if c.state == CIRCUIT_STATE_READY), pooled[0])
+        self.tunnel_logger.info("using pooled %s circuit %d for %s", ctype, circuit.circuit_id,
+                                info_hash.encode('hex'))
+        circuit.info_hash = info_hash
+        if circuit.state == CIRCUIT_STATE_READY:
+            if callback:
+                callback(circuit)
+        else:
+            circuit.callback = callback
+        return circuit
+
+    def do_replace(self):
+        # Stop selecting data circuits that are about to expire as soon as another circuit with the same number of
+        # hops is ready, and let their destinations select a new circuit.
+        for circuit in self.active_data_circuits().values():
+            if circuit.circuit_id in self.replaced_circuits or not self.is_expiring(circuit):
+                continue
+            if all(self.is_expiring(c) for c in self.active_data_circuits(len(circuit.hops)).itervalues()):
+                continue
+
+            self.tunnel_logger.info("replacing circuit %d, it is about to expire", circuit.circuit_id)
+            self.replaced_circuits.add(circuit.circuit_id)
+            self.selection_strategy.circuits_changed()
+            if self.socks_server:
+                self.socks_server.circuit_dead(circuit)
+
     def tunnels_ready(self, hops):
         if hops > 0:
             if self.settings.min_circuits:
@@ -477,6 +712,12 @@ class TunnelCommunity(Community):
         assert required_endpoint is None or len(required_endpoint) == 3, required_endpoint
         first_hop = None
 
+        if ctype in POOLED_CIRCUIT_TYPES and info_hash and not required_endpoint:
+            self.circuit_requests[goal_hops, ctype] += 1
+            circuit = self.claim_pooled_circuit(goal_hops, ctype, callback, info_hash)
+            if circuit:
+                return circuit.circuit_id
+
         self.tunnel_logger.info("Creating a new circuit of length %d", goal_hops)
 
         if not required_endpoint:
@@ -564,6 +805,8 @@ class TunnelCommunity(Community):
 
             circuit = self.circuits.pop(circuit_id)
             circuit.destroy()
+            self.replaced_circuits.discard(circuit_id)
+            self.selection_strategy.circuits_changed()
 
             affected_peers = self.socks_server.circuit_dead(circuit)
             ltmgr = self.trsession.lm.ltmgr if self.trsession and self.trsession.get_libtorrent() else None
@@ -696,15 +939,22 @@ class TunnelCommunity(Community):
 
             except CryptoException, e:
                 self.tunnel_logger.error(str(e))
+                self.metrics.add_drop('crypto_error')
                 return 0
 
         return self.send_packet(candidates, message_type, packet)
 
     def send_packet(self, candidates, message_type, packet):
-        if self.dispersy.endpoint.send(candidates, [packet], prefix=self.data_prefix if message_type == u"data" else None):
-            self.statistics.increase_msg_count(u"outgoing", message_type, len(candidates))
-            self.tunnel_logger.debug("send %s to %s candidates: %s", message_type, len(candidates), map(str, candidates))
-            return len(packet)
+        return self.send_packets(candidates, message_type, [packet])
+
+    def send_packets(self, candidates, message_type, packets):
+        if self.dispersy.endpoint.send(candidates, packets,
+                                       prefix=self.data_prefix if message_type == u"data" else None):
+            self.statistics.increase_msg_count(u"outgoing", message_type, len(candidates) * len(packets))
+            self.tunnel_logger.debug("send %d %s to %s candidates: %s", len(packets), message_type, len(candidates),
+                                     map(str, candidates))
+            return sum(len(packet) for packet in packets)
+        self.metrics.add_drop('send_failed', len(candidates) * len(packets))
         return 0
 
     def send_destroy(self, candidate, circuit_id, reason):
@@ -720,12 +970,24 @@ class TunnelCommunity(Community):
         next_relay = self.relay_from_to[circuit_id]
         this_relay = self.relay_from_to.get(next_relay.circuit_id, None)
 
-        self.tunnel_logger.debug("Relay %s from %d to %d", message_type, circuit_id, next_relay.circuit_id)
-
         if this_relay:
             this_relay.last_incoming = time.time()
             self.increase_bytes_received(this_relay, len(packet))
 
+        packet = self.prepare_relay_packet(circuit_id, next_relay, message_type, packet)
+        if packet is None:
+            return False
+
+        self.increase_bytes_sent(next_relay, self.send_packet([Candidate(next_relay.sock_addr, False)], message_type, packet))
+        return True
+
+    def prepare_relay_packet(self, circuit_id, next_relay, message_type, packet):
+        """
+        Re-encrypts a packet for the next relay and swaps its circuit id.
+        :return: The packet to send to the next relay, or None if it could not be re-encrypted.
+        """
+        self.tunnel_logger.debug("Relay %s from %d to %d", message_type, circuit_id, next_relay.circuit_id)
+
         plaintext, encrypted = TunnelConversion.split_encrypted_packet(packet, message_type)
         try:
             if next_relay.rendezvous_relay:
@@ -737,11 +999,10 @@ class TunnelCommunity(Community):
 
         except CryptoException, e:
             self.tunnel_logger.error(str(e))
-            return False
+            self.metrics.add_drop('crypto_error')
+            return None
 
-        packet = TunnelConversion.swap_circuit_id(packet, message_type, circuit_id, next_relay.circuit_id)
-        self.increase_bytes_sent(next_relay, self.send_packet([Candidate(next_relay.sock_addr, False)], message_type, packet))
-        return True
+        return TunnelConversion.swap_circuit_id(packet, message_type, circuit_id, next_relay.circuit_id)
 
     def check_create(self, messages):
         for message in messages:
@@ -900,6 +1161,7 @@ class TunnelCommunity(Community):
 
         elif circuit.state == CIRCUIT_STATE_READY:
             self.request_cache.pop(u"anon-circuit", circuit.circuit_id)
+            self.selection_strategy.circuits_changed()
             # Re-add BitTorrent peers, if needed.
             self.readd_bittorrent_peers()
 
@@ -1086,53 +1348,101 @@ class TunnelCommunity(Community):
             circuit = self.circuits[circuit_id]
             self._ours_on_created_extended(circuit, message)
 
-    @call_on_reactor_thread
     def on_data(self, sock_addr, packet):
+        """
+        Called by the endpoint for every data packet. The packets are queued and all packets that arrive before the
+        reactor gets to them are processed as one batch.
+        """
+        with self._data_queue_lock:
+            self._data_queue.append((sock_addr, packet))
+            if self._data_batch_scheduled:
+                return
+            self._data_batch_scheduled = True
+
+        reactor.callFromThread(self.process_data_batch)
+
+    def process_data_batch(self):
+        with self._data_queue_lock:
+            batch, self._data_queue = self._data_queue, []
+            self._data_batch_scheduled = False
+
+        # relayed packets are sent to their next relay together, and their bytes are accounted once per route
+        outgoing = defaultdict(list)
+        received = defaultdict(lambda: [0, 0])
+        now = time.time()
+
+        try:
+            for sock_addr, packet in batch:
+                # a bad packet should not take the rest of the batch down with it
+                try:
+                    circuit_id = TunnelConversion.get_circuit_id(packet, u'data')
+                    if not self.is_relay(circuit_id):
+                        self.process_data(sock_addr, packet, circuit_id)
+                        continue
+
+                    next_relay = self.relay_from_to[circuit_id]
+                    this_relay = self.relay_from_to.get(next_relay.circuit_id, None)
+                    if this_relay:
+                        this_relay.last_incoming = now
+                        received[this_relay][0] += 1
+                        received[this_relay][1] += len(packet)
+
+                    relay_packet = self.prepare_relay_packet(circuit_id, next_relay, u'data', packet)
+                    if relay_packet is not None:
+                        outgoing[next_relay].append(relay_packet)
+                except Exception:
+                    self.tunnel_logger.exception("Failed to process data packet from %s", sock_addr)
+                    self.metrics.add_drop('process_error')
+        finally:
+            for this_relay, (num_packets, num_bytes) in received.iteritems():
+                self.increase_bytes_received(this_relay, num_bytes, num_packets)
+
+            for next_relay, packets in outgoing.iteritems():
+                self.increase_bytes_sent(next_relay, self.send_packets([Candidate(next_relay.sock_addr, False)],
+                                                                       u'data', packets), len(packets))
+
+    def process_data(self, sock_addr, packet, circuit_id):
         # If its our circuit, the messenger is the candidate assigned to that circuit and the DATA's destination
         # is set to the zero-address then the packet is from the outside world and addressed to us from.
 
         message_type = u'data'
-        circuit_id = TunnelConversion.get_circuit_id(packet, message_type)
-
         self.tunnel_logger.debug("Got data (%d) from %s", circuit_id, sock_addr)
 
-        if self.is_relay(circuit_id):
-            self.relay_packet(circuit_id, message_type, packet)
+        plaintext, encrypted = TunnelConversion.split_encrypted_packet(packet, message_type)
 
-        else:
-            plaintext, encrypted = TunnelConversion.split_encrypted_packet(packet, message_type)
+        try:
+            encrypted = self.crypto_in(circuit_id, encrypted, is_data=True)
 
-            try:
-                encrypted = self.crypto_in(circuit_id, encrypted, is_data=True)
+        except CryptoException, e:
+            self.tunnel_logger.warning(str(e))
+            self.metrics.add_drop('crypto_error')
+            return
 
-            except CryptoException, e:
-                self.tunnel_logger.warning(str(e))
-                return
+        packet = plaintext + encrypted
+        circuit_id, destination, origin, data = TunnelConversion.decode_data(packet)
 
-            packet = plaintext + encrypted
-            circuit_id, destination, origin, data = TunnelConversion.decode_data(packet)
-
-            circuit = self.circuits.get(circuit_id, None)
-            if circuit and origin and sock_addr == circuit.first_hop:
-                circuit.beat_heart()
-                self.increase_bytes_received(circuit, len(packet))
-
-                if TunnelConversion.could_be_dispersy(data):
-                    self.tunnel_logger.debug("Giving incoming data packet to dispersy")
-                    self.dispersy.on_incoming_packets([(Candidate(origin, False),
-                                                        data[TUNNEL_PREFIX_LENGHT:])],
-                                                      False, source=u"circuit_%d" % circuit_id)
-                else:
-                    anon_seed = circuit.ctype == CIRCUIT_TYPE_RP
-                    self.socks_server.on_incoming_from_tunnel(self, circuit, origin, data, anon_seed)
+        circuit = self.circuits.get(circuit_id, None)
+        if circuit and origin and sock_addr == circuit.first_hop:
+            circuit.beat_heart()
+            self.increase_bytes_received(circuit, len(packet))
+
+            if TunnelConversion.could_be_dispersy(data):
+                self.tunnel_logger.debug("Giving incoming data packet to dispersy")
+                self.dispersy.on_incoming_packets([(Candidate(origin, False),
+                                                    data[TUNNEL_PREFIX_LENGHT:])],
+                                                  False, source=u"circuit_%d" % circuit_id)
+            else:
+                anon_seed = circuit.ctype == CIRCUIT_TYPE_RP
+                self.socks_server.on_incoming_from_tunnel(self, circuit, origin, data, anon_seed)
 
-            # It is not our circuit so we got it from a relay, we need to EXIT it!
+        # It is not our circuit so we got it from a relay, we need to EXIT it!
+        else:
+            self.tunnel_logger.debug("data for circuit %d exiting tunnel (%s)", circuit_id, destination)
+            if destination != ('0.0.0.0', 0):
+                self.exit_data(circuit_id, sock_addr, destination, data)
             else:
-                self.tunnel_logger.debug("data for circuit %d exiting tunnel (%s)", circuit_id, destination)
-                if destination != ('0.0.0.0', 0):
-                    self.exit_data(circuit_id, sock_addr, destination, data)
-                else:
-                    self.tunnel_logger.error("cannot exit data, destination is 0.0.0.0:0")
+                self.tunnel_logger.error("cannot exit data, destination is 0.0.0.0:0")
+                self.metrics.add_drop('no_destination')
 
     def on_ping(self, messages):
         for message in messages:
@@ -1141,7 +1451,10 @@ class TunnelCommunity(Community):
 
     def on_pong(self, messages):
         for message in messages:
-            self.request_cache.pop(u"ping", message.payload.identifier)
+            cache = self.request_cache.pop(u"ping", message.payload.identifier)
+            rtt = time.time() - cache.sent_time
+            cache.circuit.add_rtt(rtt)
+            self.metrics.add_rtt(cache.circuit.circuit_id, rtt)
             self.tunnel_logger.info("Got pong from %s", message.candidate)
 
     def do_ping(self):
@@ -1175,6 +1488,7 @@ class TunnelCommunity(Community):
                 meta = self.get_meta_message(u"stats-response")
                 stats = dict(self.stats)
                 stats['uptime'] = time.time() - self.creation_time
+                stats.update(self.metrics.get_summary())
                 response = meta.impl(authentication=(self._my_member,), distribution=(
                     self.global_time,), payload=(request.payload.identifier, stats))
                 self.send_packet([request.candidate], u"stats-response", response.packet)
@@ -1198,9 +1512,18 @@ class TunnelCommunity(Community):
                             distribution=(self.global_time,), payload=(cache.number,))
         self.send_packet([candidate], u"stats-request", request.packet)
 
+    def do_metrics(self):
+        # Close the current metrics window and report its traffic per peer to bartercast, so the bartercast keys are
+        # formatted once per window instead of once per packet.
+        window = self.metrics.roll()
+        self.selection_strategy.update(window)
+        for (key, sock_addr), num_bytes in window.peers.iteritems():
+            _barter_statistics.dict_inc_bartercast(BARTERCAST_TRAFFIC_TYPES[key], "%s:%s" % sock_addr, num_bytes)
+
     def exit_data(self, circuit_id, sock_addr, destination, data):
         if not self.become_exitnode() and not TunnelConversion.could_be_dispersy(data):
             self.tunnel_logger.error("Dropping data packets, refusing to be an exit node for data")
+            self.metrics.add_drop('not_exit_node')
 
         elif circuit_id in self.exit_sockets:
             if not self.exit_sockets[circuit_id].enabled:
@@ -1213,9 +1536,12 @@ class TunnelCommunity(Community):
                 self.exit_sockets[circuit_id].sendto(data, destination)
             except:
                 self.tunnel_logger.error("Dropping data packets while EXITing")
+                self.metrics.add_drop('exit_error')
         else:
             self.tunnel_logger.error("Dropping data packets with unknown circuit_id")
+            self.metrics.add_drop('unknown_circuit')
 
+    @sample_duration('crypto_out')
     def crypto_out(self, circuit_id, content, is_data=False):
         circuit = self.circuits.get(circuit_id, None)
         if circuit:
@@ -1233,6 +1559,7 @@ class TunnelCommunity(Community):
 
         raise CryptoException("Don't know how to encrypt outgoing message for circuit_id %d" % circuit_id)
 
+    @sample_duration('crypto_in')
     def crypto_in(self, circuit_id, content, is_data=False):
         circuit = self.circuits.get(circuit_id, None)
         if circuit:
@@ -1269,6 +1596,7 @@ class TunnelCommunity(Community):
 
         raise CryptoException("Received message for unknown circuit ID: %d" % circuit_id)
 
+    @sample_duration('crypto_relay')
     def crypto_relay(self, circuit_id, content):
         direction = self.directions[circuit_id]
         if direction == ORIGINATOR:
@@ -1304,36 +1632,28 @@ class TunnelCommunity(Community):
 
         raise CryptoException("Direction must be either ORIGINATOR or EXIT_NODE")
 
-    def increase_bytes_sent(self, obj, num_bytes):
+    def increase_bytes_sent(self, obj, num_bytes, num_packets=1):
         if isinstance(obj, Circuit):
             obj.bytes_up += num_bytes
-            self.stats['bytes_up'] += num_bytes
-            _barter_statistics.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_BYTES_SENT, "%s:%s" %
-                                                   (obj.first_hop[0], obj.first_hop[1]), num_bytes)
+            self.increase_traffic('bytes_up', obj.circuit_id, obj.first_hop, num_bytes, num_packets)
         elif isinstance(obj, RelayRoute):
             obj.bytes_up += num_bytes
-            self.stats['bytes_relay_up'] += num_bytes
-            _barter_statistics.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_RELAY_BYTES_SENT, "%s:%s" %
-                                                   (obj.sock_addr[0], obj.sock_addr[1]), num_bytes)
+            self.increase_traffic('bytes_relay_up', obj.circuit_id, obj.sock_addr, num_bytes, num_packets)
         elif isinstance(obj, TunnelExitSocket):
             obj.bytes_up += num_bytes
-            self.stats['bytes_exit'] += num_bytes
-            _barter_statistics.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_EXIT_BYTES_SENT, "%s:%s" %
-                                                   (obj.sock_addr[0], obj.sock_addr[1]), num_bytes)
+            self.increase_traffic('bytes_exit', obj.circuit_id, obj.sock_addr, num_bytes, num_packets)
 
-    def increase_bytes_received(self, obj, num_bytes):
+    def increase_bytes_received(self, obj, num_bytes, num_packets=1):
         if isinstance(obj, Circuit):
             obj.bytes_down += num_bytes
-            self.stats['bytes_down'] += num_bytes
-            _barter_statistics.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_BYTES_RECEIVED, "%s:%s" %
-                                                   (obj.first_hop[0], obj.first_hop[1]), num_bytes)
+            self.increase_traffic('bytes_down', obj.circuit_id, obj.first_hop, num_bytes, num_packets)
         elif isinstance(obj, RelayRoute):
             obj.bytes_down += num_bytes
-            self.stats['bytes_relay_down'] += num_bytes
-            _barter_statistics.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_RELAY_BYTES_RECEIVED, "%s:%s" %
-                                                   (obj.sock_addr[0], obj.sock_addr[1]), num_bytes)
+            self.increase_traffic('bytes_relay_down', obj.circuit_id, obj.sock_addr, num_bytes, num_packets)
         elif isinstance(obj, TunnelExitSocket):
             obj.bytes_down += num_bytes
-            self.stats['bytes_enter'] += num_bytes
-            _barter_statistics.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_EXIT_BYTES_RECEIVED, "%s:%s" %
-                                                   (obj.sock_addr[0], obj.sock_addr[1]), num_bytes)
+            self.increase_traffic('bytes_enter', obj.circuit_id, obj.sock_addr, num_bytes, num_packets)
+
+    def increase_traffic(self, key, circuit_id, sock_addr, num_bytes, num_packets):
+        self.stats[key] += num_bytes
+        self.metrics.add_traffic(key, circuit_id, sock_addr, num_bytes, num_packets)
@@ -56,6 +56,8 @@ CREATE UNIQUE INDEX infohash_idx
   ON Torrent
   (infohash);
 
+CREATE INDEX IF NOT EXISTS TorNextCheckIndex ON Torrent(next_tracker_check);
+
 ----------------------------------------
 
 CREATE TABLE TrackerInfo (
@@ -269,6 +271,11 @@ CREATE INDEX IF NOT EXISTS TorMarkIndex ON _TorrentMarkings(channeltorrent_id);
 
 CREATE VIRTUAL TABLE FullTextIndex USING fts3(swarmname, filenames, fileextensions);
 
+CREATE TABLE IF NOT EXISTS TermFrequency (
+  term                  text    PRIMARY KEY,
+  freq                  integer NOT NULL DEFAULT 0
+);
+
 -------------------------------------
 
 COMMIT TRANSACTION create_table;
@@ -277,7 +284,7 @@ COMMIT TRANSACTION create_table;
 
 BEGIN TRANSACTION init_values;
 
-INSERT INTO MyInfo VALUES ('version', 28);
+INSERT INTO MyInfo VALUES ('version', 29);
 
 INSERT INTO TrackerInfo (tracker) VALUES ('no-DHT');
 INSERT INTO TrackerInfo (tracker) VALUES ('DHT');